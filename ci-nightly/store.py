@@ -3,6 +3,8 @@ import types
 import matrix_benchmarking.store as store
 import matrix_benchmarking.store.simple as store_simple
 
+import mlperf.parse_profiling as parse_profiling
+
 def _rewrite_settings(params_dict):
     return params_dict
 
@@ -10,11 +12,11 @@ def _rewrite_settings(params_dict):
 def parse_benchmark_results(dirname, import_settings):
     results = types.SimpleNamespace()
 
-    with open(f"{dirname}/benchmarking_run_ssd_bench_duration.log") as f:
+    with parse_profiling.open_file(f"{dirname}/benchmarking_run_ssd_bench_duration.log") as f:
         content = f.read()
         results.duration = int(content.split()[0])
 
-    with open(f"{dirname}/benchmarking_run_ssd_sample_rate.log") as f:
+    with parse_profiling.open_file(f"{dirname}/benchmarking_run_ssd_sample_rate.log") as f:
         content = f.read()
         results.rate = float(content.split()[0])
 
@@ -26,11 +28,14 @@ def _parse_results(fn_add_to_matrix, dirname, import_settings):
     if import_settings["benchmark"] != "benchmark":
         return
 
-    results = parse_benchmark_results(dirname, import_settings)
-    if results is None:
-        return
+    with parse_profiling.directory(dirname):
+        with parse_profiling.step("log_scan"):
+            results = parse_benchmark_results(dirname, import_settings)
+        if results is None:
+            return
 
-    fn_add_to_matrix(results)
+        with parse_profiling.step("matrix_insert"):
+            fn_add_to_matrix(results)
 
 
 def parse_data():
@@ -38,4 +43,8 @@ def parse_data():
     store.register_custom_rewrite_settings(_rewrite_settings)
     store_simple.register_custom_parse_results(_parse_results)
 
-    return store_simple.parse_data()
+    ret = store_simple.parse_data()
+
+    parse_profiling.report()
+
+    return ret
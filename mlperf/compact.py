@@ -0,0 +1,62 @@
+#! /usr/bin/env python3
+
+"""Compacts mlperf result directories into a single binary sidecar file.
+
+The pod logs and Prometheus files of each run directory are parsed once,
+and the results are saved into the run directory as `mlperf_compact.npz`.
+The mlperf store then loads this file instead of the raw files, as long
+as it is newer than them.
+
+Usage: ./compact.py [--force] RESULTS_DIR...
+"""
+
+import sys
+import os
+import glob
+import pathlib
+import importlib
+
+THIS_DIR = pathlib.Path(os.path.dirname(os.path.abspath(__file__)))
+
+# import the store the same way matrix_benchmarking does,
+# so that the pickled classes keep the same module name
+sys.path.insert(0, str(THIS_DIR.parent))
+mlperf_store = importlib.import_module(f"{THIS_DIR.name}.store")
+
+def main():
+    args = sys.argv[1:]
+    force = "--force" in args
+    if force:
+        args.remove("--force")
+
+    if not args:
+        print(__doc__.strip())
+        return 1
+
+    compacted = skipped = failed = 0
+    for results_dir in args:
+        for this_dir, directories, files in os.walk(results_dir):
+            directories.sort()
+            if not glob.glob(f"{this_dir}/run-*.log"):
+                continue
+
+            if not force and mlperf_store._compact_is_fresh(this_dir):
+                skipped += 1
+                continue
+
+            print(f"Compacting {this_dir} ...")
+            try:
+                if mlperf_store.compact_directory(this_dir):
+                    compacted += 1
+                else:
+                    failed += 1
+            except Exception as e:
+                print(f"WARNING: failed to compact {this_dir}: {e.__class__.__name__}: {e}")
+                failed += 1
+
+    print(f"{compacted} directories compacted, {skipped} already up to date, {failed} failed.")
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    sys.exit(main())
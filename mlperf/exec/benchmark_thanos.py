@@ -0,0 +1,215 @@
+#! /usr/bin/python3
+
+"""Benchmark of the collection of the Thanos metrics, against the local
+Thanos stand-in (fake_thanos.py).
+
+It starts the stand-in in a child process, serving synthetic series or
+the metrics recorded in an artifacts directory, and runs the
+collection of run_ssd.py (planning of the batches, queries, streaming
+into the metric files) in a temporary directory. It reports the
+throughput of the collection and the latency of the queries.
+
+Usage:
+
+    ./benchmark_thanos.py [--window 3600] [--repeat 3] [--workers 8] [--metrics 23]
+                          [--no-batch] [--no-compress] [--no-scope] [--cache 64] [--error-rate 0]
+                          [--pods 1] [--gpus 8] [--other-pods 0] [--duration SECONDS]
+                          [--replay ARTIFACTS_DIR] [--verbose]
+"""
+
+import sys
+import os
+import io
+import gzip
+import time
+import argparse
+import tempfile
+import resource
+import threading
+import statistics
+import contextlib
+import multiprocessing
+from pathlib import Path
+
+import fake_thanos
+import thanos_client
+import prom_stream
+
+TOKEN = "benchmark"
+
+class TimedThanosClient(thanos_client.ThanosClient):
+    """Records the latency of the queries (until the end of the
+    response, including its streaming into the files)."""
+
+    def __init__(self, *args, **kwargs):
+        super().__init__(*args, **kwargs)
+        self.latencies = []
+        self.lock = threading.Lock()
+
+    def _record(self, start):
+        with self.lock:
+            self.latencies.append(time.perf_counter() - start)
+
+    def get(self, api_cmd, timeout=None, **params):
+        start = time.perf_counter()
+        try:
+            return super().get(api_cmd, timeout, **params)
+        finally:
+            self._record(start)
+
+    @contextlib.contextmanager
+    def stream(self, api_cmd, timeout=None, **params):
+        start = time.perf_counter()
+        try:
+            with super().stream(api_cmd, timeout, **params) as read:
+                yield read
+        finally:
+            self._record(start)
+
+def start_server(args):
+    """Starts the Thanos stand-in in a child process, and returns its URL and process."""
+    server = fake_thanos.make_server(0, TOKEN, error_rate=args.error_rate,
+                                     fake=fake_thanos.get_data(args), cache_size=args.cache)
+    # the server does not share the GIL with the collection
+    process = multiprocessing.get_context("fork").Process(target=server.serve_forever, daemon=True)
+    process.start()
+    server.socket.close()
+
+    return f"http://localhost:{server.server_address[1]}", process
+
+def count_saved(metrics_dir):
+    """Returns the number of series and points saved in metrics_dir."""
+    series = points = 0
+    for path in metrics_dir.glob("prom_*.json*"):
+        if path.name.endswith((".meta.json", ".failed")): continue
+
+        # the files hold several responses, one per window saved, in
+        # one gzip member each
+        opener = gzip.open if path.name.endswith(".gz") else open
+        last_ts = {} # labels -> last timestamp counted
+        try:
+            with opener(path, "rt") as in_f:
+                for labels, values in prom_stream.PromStreamReader(in_f.read).iter_series():
+                    key = tuple(sorted(labels.items()))
+                    # the points not after the last one counted are skipped, like in the store
+                    new_points = [ts for ts, _ in values if ts > last_ts.get(key, -1)]
+                    points += len(new_points)
+                    last_ts[key] = new_points[-1] if new_points else last_ts.get(key, -1)
+        except (OSError, EOFError, ValueError):
+            pass
+
+        series += len(last_ts)
+
+    return series, points
+
+def run_collection(run_ssd, thanos, thanos_start, thanos_stop, metrics, matchers, verbose):
+    with tempfile.TemporaryDirectory(prefix="benchmark_thanos_") as tmp_dir:
+        metrics_dir = Path(tmp_dir)
+        thanos["client"].latencies = []
+
+        output = contextlib.nullcontext() if verbose else contextlib.redirect_stdout(io.StringIO())
+        start = time.perf_counter()
+        with output:
+            failed = run_ssd.collect_thanos_metrics(thanos, thanos_start, thanos_stop, metrics,
+                                                    metrics_dir, matchers)
+        elapsed = time.perf_counter() - start
+
+        size = sum(path.stat().st_size for path in metrics_dir.iterdir())
+        series, points = count_saved(metrics_dir)
+
+    return dict(elapsed=elapsed, size=size, series=series, points=points,
+                saved=len(metrics) - len(failed), latencies=sorted(thanos["client"].latencies))
+
+def percentile(values, pct):
+    if not values:
+        return 0
+    return values[min(len(values) - 1, int(len(values) * pct / 100))]
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark of the collection of the Thanos metrics")
+    parser.add_argument("--window", type=float, default=3600, help="seconds of metrics collected")
+    parser.add_argument("--repeat", type=int, default=3, help="number of collections")
+    parser.add_argument("--workers", type=int, default=None, help="metrics downloaded concurrently")
+    parser.add_argument("--metrics", type=int, default=None, help="number of metrics of metrics.list collected")
+    parser.add_argument("--no-batch", action="store_true", help="query the metrics one by one")
+    parser.add_argument("--no-compress", action="store_true", help="save plain JSON files")
+    parser.add_argument("--no-scope", action="store_true", help="query the metrics cluster-wide")
+    parser.add_argument("--cache", type=int, default=64, help="number of range query responses cached by the server")
+    parser.add_argument("--error-rate", type=float, default=0, help="share of the queries failing")
+    parser.add_argument("--verbose", action="store_true", help="show the output of the collection")
+    fake_thanos.add_data_arguments(parser)
+    args = parser.parse_args()
+
+    try:
+        url, server_process = start_server(args)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+
+    # read when query_thanos is imported, to run without cluster access
+    os.environ["THANOS_URL"] = url
+    os.environ["THANOS_TOKEN"] = TOKEN
+    import query_thanos
+    import run_ssd
+
+    if args.workers:
+        run_ssd.THANOS_WORKERS = args.workers
+    run_ssd.THANOS_BATCH_QUERIES = not args.no_batch
+    run_ssd.THANOS_COMPRESS = not args.no_compress
+
+    if args.replay:
+        recording = fake_thanos.RecordedThanos(args.replay)
+        try:
+            thanos_start, thanos_stop, matchers = run_ssd.read_thanos_window(Path(args.replay))
+        except (OSError, ValueError, TypeError, KeyError):
+            # recorded without thanos.yaml
+            thanos_start, thanos_stop = recording.window()
+            matchers = None
+        available = set(recording.metric_names)
+    else:
+        thanos_stop = round(time.time())
+        thanos_start = thanos_stop - args.window
+        if args.hostname:
+            # match the Hostname label of the synthetic series
+            run_ssd.THANOS_NODE_LABEL = "Hostname"
+            run_ssd.NODE_NAME = args.hostname
+        matchers = run_ssd.get_run_matchers()
+        available = None
+
+    if args.no_scope:
+        matchers = None
+
+    metrics = [metric for metric in run_ssd.get_metrics_list() if available is None or metric in available]
+    metrics = metrics[:args.metrics]
+
+    thanos = dict(token=TOKEN, host=url, pod_name=None,
+                  client=TimedThanosClient(url, TOKEN, pool_size=max(run_ssd.THANOS_WORKERS, 1)))
+
+    print(f"Collecting {len(metrics)} metrics, {(thanos_stop - thanos_start) / 60:.0f} minutes, "
+          f"with {run_ssd.THANOS_WORKERS} workers, batches={run_ssd.THANOS_BATCH_QUERIES}, "
+          f"compress={run_ssd.THANOS_COMPRESS}, scoped={matchers is not None}, "
+          f"from {'the recording of ' + args.replay if args.replay else 'synthetic series'} ...")
+
+    runs = []
+    try:
+        for idx in range(args.repeat):
+            run = run_collection(run_ssd, thanos, thanos_start, thanos_stop, metrics, matchers, args.verbose)
+            runs.append(run)
+
+            latencies = run["latencies"]
+            print(f"#{idx} | {run['elapsed']:.2f}s | {run['saved']}/{len(metrics)} metrics | "
+                  f"{run['series']} series | {run['points'] / run['elapsed'] / 1000:.0f} kpoints/s | "
+                  f"{run['size'] / 1024 / 1024:.1f} MiB saved, {run['size'] / 1024 / 1024 / run['elapsed']:.1f} MiB/s | "
+                  f"{len(latencies)} queries, latency p50={percentile(latencies, 50) * 1000:.0f}ms "
+                  f"p95={percentile(latencies, 95) * 1000:.0f}ms max={percentile(latencies, 100) * 1000:.0f}ms")
+    finally:
+        server_process.terminate()
+
+    elapsed = statistics.median(run["elapsed"] for run in runs)
+    print(f"Median: {elapsed:.2f}s, {statistics.median(run['points'] for run in runs) / elapsed / 1000:.0f} kpoints/s | "
+          f"peak RSS {resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024:.0f} MiB")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,72 @@
+#! /usr/bin/python3
+
+"""Collects the Thanos metrics missing from the artifacts of a run.
+
+The metrics of metrics.list which were not saved by run_ssd.py (with a
+.failed marker, an empty file, no file at all, or only the first
+windows saved during the run) are queried again, over the window and
+with the label matchers saved in thanos.yaml, and saved next to the
+others. The metrics partially saved are only queried after their last
+window.
+
+Usage:
+
+    ./collect_missing_metrics.py [--dry-run] [--workers 8] ARTIFACTS_DIR
+"""
+
+import sys
+import argparse
+from pathlib import Path
+
+import query_thanos
+import run_ssd
+
+def get_missing_metrics(metrics_dir, thanos_stop=None):
+    return [metric for metric in run_ssd.get_metrics_list()
+            if not run_ssd.thanos_metric_is_saved(metric, metrics_dir, thanos_stop)]
+
+def main():
+    parser = argparse.ArgumentParser(description="Collects the Thanos metrics missing from the artifacts of a run")
+    parser.add_argument("artifacts_dir", type=Path)
+    parser.add_argument("--dry-run", action="store_true", help="only list the missing metrics")
+    parser.add_argument("--workers", type=int, default=run_ssd.THANOS_WORKERS,
+                        help="metrics downloaded concurrently")
+    args = parser.parse_args()
+
+    try:
+        thanos_start, thanos_stop, matchers = run_ssd.read_thanos_window(args.artifacts_dir)
+    except FileNotFoundError:
+        print(f"ERROR: {args.artifacts_dir / 'thanos.yaml'} not found, cannot collect the metrics.")
+        return 1
+    except (ValueError, TypeError, KeyError) as e:
+        print(f"ERROR: invalid Thanos window in {args.artifacts_dir / 'thanos.yaml'} ({e}), "
+              "cannot collect the metrics.")
+        return 1
+
+    metrics_dir = args.artifacts_dir / "metrics"
+    metrics_dir.mkdir(exist_ok=True)
+
+    missing = get_missing_metrics(metrics_dir, thanos_stop)
+    if not missing:
+        print(f"All the {len(run_ssd.get_metrics_list())} metrics are saved in {metrics_dir}.")
+        return 0
+
+    print(f"{len(missing)} metrics missing in {metrics_dir}: {', '.join(missing)}")
+    print(f"Thanos window: {thanos_start} --> {thanos_stop} ({(thanos_stop - thanos_start) / 60:.0f} minutes)")
+    if args.dry_run:
+        return 0
+
+    run_ssd.THANOS_WORKERS = args.workers
+    thanos = query_thanos.prepare_thanos()
+
+    failed = run_ssd.collect_thanos_metrics(thanos, thanos_start, thanos_stop, missing, metrics_dir, matchers,
+                                            resume=True)
+
+    return 1 if failed else 0
+
+if __name__ == "__main__":
+    try:
+        sys.exit(main())
+    except KeyboardInterrupt:
+        print("\nInterrupted ...")
+        sys.exit(1)
@@ -0,0 +1,37 @@
+import threading
+
+import pytest
+
+TOKEN = "tok"
+
+
+@pytest.fixture
+def serve():
+    fake_thanos = pytest.importorskip("fake_thanos")
+    servers = []
+
+    def serve(**kwargs):
+        server = fake_thanos.make_server(token=TOKEN, gpus=2, **kwargs)
+        threading.Thread(target=server.serve_forever, daemon=True).start()
+        servers.append(server)
+
+        return f"http://localhost:{server.server_address[1]}"
+
+    yield serve
+
+    for server in servers:
+        server.shutdown()
+        server.server_close()
+
+
+@pytest.fixture
+def query_thanos(monkeypatch):
+    pytest.importorskip("kubernetes")
+    # offline, without cluster access
+    monkeypatch.setenv("THANOS_URL", "http://localhost:1")
+    monkeypatch.setenv("THANOS_TOKEN", TOKEN)
+
+    import query_thanos
+    monkeypatch.setattr(query_thanos, "QUERY_RETRY_DELAY", 0)
+
+    return query_thanos
@@ -0,0 +1,517 @@
+#! /usr/bin/python3
+
+"""Local stand-in of the Thanos querier API, to test and benchmark the
+Thanos clients offline.
+
+It serves either synthetic DCGM-like series for any metric name, with a
+configurable number of Pods, GPUs and history, or the metrics recorded
+from a real cluster in an artifacts directory of run_ssd.py
+(metrics/prom_<metric>.json[.gz] and thanos.yaml). The queries can be a
+metric name, or a {__name__=~"A|B|C"} selector, optionally with label
+matchers (label="value", label=~"regex" or label!="value"):
+
+- /api/v1/query (time(), a selector or count by (__name__) (selector),
+  instant vector)
+- /api/v1/query_range (a selector, range matrix)
+- /api/v1/series (a selector, the labels of the series with values
+  between start and end)
+- /api/v1/label/__name__/values (the metrics of metrics.list, or the
+  recorded metrics)
+
+Usage:
+
+    ./fake_thanos.py [--port 9090] [--token TOKEN] [--gpus 8] [--pods 1] [--other-pods 0]
+                     [--duration SECONDS] [--replay ARTIFACTS_DIR] [--cache 64]
+                     [--error-rate 0.1] [--max-samples 50000000] [--tls-cert CERT --tls-key KEY]
+
+--other-pods adds the series of Pods of another namespace, to exercise
+the label matchers. --duration limits the history of the synthetic
+series to the last SECONDS before the start of the server.
+
+--error-rate makes this share of the queries fail with '503 Service
+Unavailable', to test the retries of the clients.
+
+As Prometheus, the range queries of more than 11,000 points per series
+are rejected, and so are those loading more than --max-samples points
+in total (unlimited by default), to test the splitting of the queries
+by the clients.
+
+With --replay, time() returns the stop time of the recorded window
+(from thanos.yaml, or the last point recorded), and the range queries
+return the recorded points of the window, whatever the step.
+
+--cache keeps the last range query responses in memory, so that the
+benchmarks (see benchmark_thanos.py) measure the clients rather than
+the generation of the responses.
+
+and, for instance:
+
+    ./thanos_client.py http://localhost:9090 TOKEN DCGM_FI_DEV_POWER_USAGE
+"""
+
+import sys
+import os
+import re
+import ssl
+import json
+import gzip
+import math
+import time
+import random
+import bisect
+import argparse
+import threading
+import collections
+import urllib.parse
+import http.server
+from pathlib import Path
+
+import yaml
+
+THIS_DIR = Path(os.path.dirname(os.path.abspath(__file__)))
+
+METRIC_NAME_RE = re.compile(r"^\s*([a-zA-Z_:][a-zA-Z0-9_:]*)")
+METRIC_NAMES_RE = re.compile(r'__name__=~"([^"]*)"')
+LABEL_MATCHER_RE = re.compile(r'([a-zA-Z_][a-zA-Z0-9_]*)\s*(=~|!=|=)\s*"([^"]*)"')
+COUNT_BY_NAME_RE = re.compile(r"^\s*count by \(__name__\) \((.*)\)\s*$")
+PROM_METRIC_FILE_RE = re.compile(r"^prom_(.*)\.json(\.gz)?$")
+
+LOOKBACK = 300 # seconds, lookback window of the instant queries, as Prometheus
+MAX_POINTS = 11000 # points per series of the range queries, as Prometheus
+
+def get_metric_names():
+    names = []
+    with open(THIS_DIR / "metrics.list") as in_f:
+        for line in in_f.readlines():
+            if not line.startswith("# HELP "): continue
+            names.append(line.split()[2])
+    return names
+
+class ThanosData():
+    """The series served by the fake Thanos querier, and the evaluation
+    of the queries over them.
+
+    The subclasses provide metric_names and:
+    - now(): the current time
+    - iter_series(metric): the (labels, data) of the series of a metric
+    - instant_value(data, ts): the value of a series at ts, or None
+    - range_values(data, start, end, step): the [ts, "value"] of a series
+    - has_values(data, start, end): if a series has values between start and end
+    """
+
+    metric_names = []
+
+    def metrics(self, selector):
+        """Returns the metric names matched by a selector."""
+        names = METRIC_NAMES_RE.search(selector)
+        if names:
+            return names.group(1).split("|")
+
+        return [METRIC_NAME_RE.match(selector).group(1)]
+
+    def matches(self, selector, labels):
+        """Returns True if the labels match the label matchers of the selector."""
+        for label, op, value in LABEL_MATCHER_RE.findall(selector):
+            if label == "__name__": continue
+
+            label_value = labels.get(label, "")
+            if op == "=" and label_value != value: return False
+            if op == "!=" and label_value == value: return False
+            if op == "=~" and not re.fullmatch(value, label_value): return False
+
+        return True
+
+    def series(self, selector):
+        """Returns the (labels, data) of the series matched by the selector."""
+        return [(labels, data) for metric in self.metrics(selector)
+                for labels, data in self.iter_series(metric)
+                if self.matches(selector, labels)]
+
+    def query(self, query, ts):
+        if query.strip() == "time()":
+            return dict(resultType="scalar", result=[ts, str(ts)])
+
+        count_by_name = COUNT_BY_NAME_RE.match(query)
+        if count_by_name:
+            counts = collections.Counter(labels["__name__"] for labels, data in self.series(count_by_name.group(1))
+                                         if self.instant_value(data, ts) is not None)
+            return dict(resultType="vector",
+                        result=[dict(metric={"__name__": metric}, value=[ts, str(count)])
+                                for metric, count in counts.items()])
+
+        result = []
+        for labels, data in self.series(query):
+            value = self.instant_value(data, ts)
+            if value is None: continue
+
+            result.append(dict(metric=labels, value=[ts, value]))
+
+        return dict(resultType="vector", result=result)
+
+    def series_labels(self, selector, start, end):
+        return [labels for labels, data in self.series(selector) if self.has_values(data, start, end)]
+
+    def query_range(self, query, start, end, step):
+        # same check as Prometheus
+        if (end - start) / step > MAX_POINTS:
+            raise ValueError(f"exceeded maximum resolution of {MAX_POINTS:,} points per timeseries. "
+                             "Try decreasing the query resolution (?step=XX)")
+
+        result = []
+        for labels, data in self.series(query):
+            values = self.range_values(data, start, end, step)
+            if not values: continue
+
+            result.append(dict(metric=labels, values=values))
+
+        return dict(resultType="matrix", result=result)
+
+class FakeThanos(ThanosData):
+    """Synthetic DCGM-like series, for any metric name: one series per
+    GPU of each Pod."""
+
+    def __init__(self, gpus=8, pods=1, other_pods=0, duration=None,
+                 pod_name="run-mlperf-0abcd", namespace="default", hostname=None):
+        self.metric_names = get_metric_names()
+        # the series exist since the start of the server, minus the duration of their history
+        self.start = None if duration is None else time.time() - duration
+
+        self.labels = [] # labels of the series, without __name__
+        for pod in range(pods + other_pods):
+            if pod < pods:
+                labels = dict(exported_pod=pod_name if pod == 0 else f"{pod_name}-{pod}",
+                              exported_namespace=namespace)
+            else:
+                labels = dict(exported_pod=f"other-app-{pod - pods}", exported_namespace="other-tenant")
+
+            for gpu in range(gpus):
+                self.labels.append(dict(gpu=str(gpu), **labels, UUID=f"GPU-{pod:04x}{gpu:04x}"))
+                if hostname:
+                    self.labels[-1]["Hostname"] = hostname
+
+    def now(self):
+        return time.time()
+
+    def iter_series(self, metric):
+        # deterministic values, different for each metric and GPU
+        metric_phase = (sum(map(ord, metric)) % 100) / 10
+        return [({"__name__": metric, **labels}, metric_phase + idx)
+                for idx, labels in enumerate(self.labels)]
+
+    def value(self, phase, ts):
+        return 150 + 100 * math.sin(ts / 60 + phase)
+
+    def instant_value(self, phase, ts):
+        if self.start is not None and ts < self.start:
+            return None
+
+        return str(self.value(phase, ts))
+
+    def range_values(self, phase, start, end, step):
+        if self.start is not None and start < self.start:
+            # first point of the step grid with values
+            start += math.ceil((self.start - start) / step) * step
+
+        n_points = int((end - start) // step) + 1
+        return [[ts, str(self.value(phase, ts))]
+                for ts in (round(start + i * step, 3) for i in range(max(n_points, 0)))]
+
+    def has_values(self, phase, start, end):
+        return self.start is None or end >= self.start
+
+class RecordedThanos(ThanosData):
+    """The metrics recorded from a real cluster, in the artifacts
+    directory of a run (metrics/prom_<metric>.json[.gz] and thanos.yaml)."""
+
+    def __init__(self, artifacts_dir):
+        artifacts_dir = Path(artifacts_dir)
+
+        self.metric_files = {}
+        for path in sorted((artifacts_dir / "metrics").glob("prom_*.json*")):
+            match = PROM_METRIC_FILE_RE.match(path.name)
+            if not match or match.group(1).endswith(".meta"): continue
+            self.metric_files[match.group(1)] = path
+
+        if not self.metric_files:
+            raise ValueError(f"no metric recorded in {artifacts_dir / 'metrics'}")
+
+        self.metric_names = sorted(self.metric_files)
+
+        try:
+            with open(artifacts_dir / "thanos.yaml") as in_f:
+                self.stop = float(yaml.safe_load(in_f)["stop"])
+        except (OSError, ValueError, TypeError, KeyError):
+            self.stop = None
+
+        self.loaded = {} # metric -> [(labels, (timestamps, values))]
+        self.lock = threading.Lock()
+
+    def window(self):
+        """Returns the first and last timestamps recorded."""
+        timestamps = [ts for metric in self.metric_names
+                      for labels, (series_ts, values) in self.iter_series(metric)
+                      for ts in (series_ts[:1] + series_ts[-1:])]
+        if not timestamps:
+            raise ValueError("no value recorded")
+
+        return min(timestamps), max(timestamps)
+
+    def now(self):
+        if self.stop is None:
+            # without thanos.yaml, the end of the recording
+            self.stop = self.window()[1]
+
+        return self.stop
+
+    def load(self, metric):
+        path = self.metric_files[metric]
+        opener = gzip.open if path.name.endswith(".gz") else open
+        try:
+            with opener(path, "rt") as in_f:
+                text = in_f.read()
+        except (OSError, EOFError):
+            return []
+
+        # the responses of run_ssd.py, one per window saved during the
+        # run, or the 'data' of the previous versions
+        series = {} # labels -> (timestamps, values)
+        decoder = json.JSONDecoder()
+        pos = 0
+        while True:
+            while pos < len(text) and text[pos].isspace():
+                pos += 1
+            if pos == len(text):
+                break
+
+            try:
+                content, pos = decoder.raw_decode(text, pos)
+            except ValueError:
+                # empty file (the metric had no value) or truncated window
+                break
+
+            for window_series in content.get("data", content).get("result", []):
+                key = tuple(sorted(window_series["metric"].items()))
+                timestamps, values = series.setdefault(key, (window_series["metric"], ([], [])))[1]
+                for ts, value in window_series["values"]:
+                    if timestamps and float(ts) <= timestamps[-1]: continue
+                    timestamps.append(float(ts))
+                    values.append(value)
+
+        return list(series.values())
+
+    def iter_series(self, metric):
+        if metric not in self.metric_files:
+            return []
+
+        with self.lock:
+            if metric not in self.loaded:
+                self.loaded[metric] = self.load(metric)
+
+            return self.loaded[metric]
+
+    def instant_value(self, data, ts):
+        timestamps, values = data
+        idx = bisect.bisect_right(timestamps, ts) - 1
+        if idx < 0 or timestamps[idx] < ts - LOOKBACK:
+            return None
+
+        return values[idx]
+
+    def range_values(self, data, start, end, step):
+        timestamps, values = data
+        first = bisect.bisect_left(timestamps, start)
+        last = bisect.bisect_right(timestamps, end)
+
+        return [[timestamps[idx], values[idx]] for idx in range(first, last)]
+
+    def has_values(self, data, start, end):
+        timestamps, values = data
+
+        return bisect.bisect_left(timestamps, start) < bisect.bisect_right(timestamps, end)
+
+class FakeThanosHandler(http.server.BaseHTTPRequestHandler):
+    # keep the connections alive
+    protocol_version = "HTTP/1.1"
+    # the headers and the body are sent separately
+    disable_nagle_algorithm = True
+
+    fake = None # ThanosData
+    token = None
+    error_rate = 0 # share of the queries failing with a transient error
+    max_samples = None # points loaded by a range query, or None
+    cache = None # ResponseCache of the range queries, or None
+
+    def do_GET(self):
+        url = urllib.parse.urlparse(self.path)
+        self.handle_api(url.path, urllib.parse.parse_qs(url.query))
+
+    def do_POST(self):
+        length = int(self.headers.get("Content-Length", 0))
+        body = self.rfile.read(length).decode()
+        self.handle_api(urllib.parse.urlparse(self.path).path, urllib.parse.parse_qs(body))
+
+    def handle_api(self, path, params):
+        if self.token and self.headers.get("Authorization") != f"Bearer {self.token}":
+            return self.send_json(403, dict(status="error", errorType="forbidden", error="invalid token"))
+
+        if self.error_rate and random.random() < self.error_rate:
+            return self.send_json(503, dict(status="error", errorType="unavailable",
+                                            error="fake transient error"))
+
+        params = {key: values[-1] for key, values in params.items()}
+
+        compress = "gzip" in self.headers.get("Accept-Encoding", "")
+        cache_key = (path, tuple(sorted(params.items())), compress)
+        if self.cache is not None and path == "/api/v1/query_range":
+            body = self.cache.get(cache_key)
+            if body is not None:
+                return self.send_body(200, body, compress)
+
+        try:
+            if path == "/api/v1/query":
+                data = self.fake.query(params["query"], float(params.get("time", self.fake.now())))
+            elif path == "/api/v1/query_range":
+                data = self.fake.query_range(params["query"], float(params["start"]),
+                                             float(params["end"]), float(params["step"]))
+            elif path == "/api/v1/series":
+                data = self.fake.series_labels(params["match[]"], float(params.get("start", 0)),
+                                               float(params.get("end", self.fake.now())))
+            elif path == "/api/v1/label/__name__/values":
+                data = self.fake.metric_names
+            else:
+                return self.send_json(404, dict(status="error", errorType="not_found", error=path))
+        except (KeyError, ValueError, AttributeError, re.error) as e:
+            return self.send_json(400, dict(status="error", errorType="bad_data",
+                                            error=f"{e.__class__.__name__}: {e}"))
+
+        if (self.max_samples is not None and path == "/api/v1/query_range"
+            and sum(len(series["values"]) for series in data["result"]) > self.max_samples):
+            return self.send_json(422, dict(status="error", errorType="execution",
+                                            error="query processing would load too many samples "
+                                            "into memory in query execution"))
+
+        body = self.send_json(200, dict(status="success", data=data))
+        if self.cache is not None and path == "/api/v1/query_range":
+            self.cache.put(cache_key, body)
+
+    def send_json(self, code, content):
+        """Sends the JSON content, and returns the body sent."""
+        body = json.dumps(content).encode()
+
+        compress = "gzip" in self.headers.get("Accept-Encoding", "")
+        if compress:
+            body = gzip.compress(body, compresslevel=1)
+
+        self.send_body(code, body, compress)
+
+        return body
+
+    def send_body(self, code, body, compressed):
+        self.send_response(code)
+        self.send_header("Content-Type", "application/json")
+        if compressed:
+            self.send_header("Content-Encoding", "gzip")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, format, *args):
+        pass
+
+class ResponseCache():
+    """The last bodies sent, shared by the threads of the server."""
+
+    def __init__(self, size):
+        self.size = size
+        self.bodies = collections.OrderedDict()
+        self.lock = threading.Lock()
+
+    def get(self, key):
+        with self.lock:
+            body = self.bodies.get(key)
+            if body is not None:
+                self.bodies.move_to_end(key)
+            return body
+
+    def put(self, key, body):
+        with self.lock:
+            self.bodies[key] = body
+            while len(self.bodies) > self.size:
+                self.bodies.popitem(last=False)
+
+def make_server(port=0, token=None, gpus=8, tls_cert=None, tls_key=None, error_rate=0,
+                fake=None, cache_size=0, max_samples=None):
+    """Returns a fake Thanos HTTP server, listening on localhost:port
+    (0 for a random port). Call its serve_forever method to run it.
+
+    fake: the ThanosData served, by default FakeThanos(gpus=gpus)
+    cache_size: the number of range query responses kept in memory
+    max_samples: the number of points a range query may load, or None
+    """
+
+    handler = type("Handler", (FakeThanosHandler,), dict(fake=fake or FakeThanos(gpus=gpus), token=token,
+                                                         error_rate=error_rate, max_samples=max_samples,
+                                                         cache=ResponseCache(cache_size) if cache_size else None))
+    server = http.server.ThreadingHTTPServer(("localhost", port), handler)
+    server.daemon_threads = True
+
+    if tls_cert:
+        context = ssl.SSLContext(ssl.PROTOCOL_TLS_SERVER)
+        context.load_cert_chain(tls_cert, tls_key)
+        server.socket = context.wrap_socket(server.socket, server_side=True)
+
+    return server
+
+def add_data_arguments(parser):
+    """Adds the arguments of the data served, see get_data."""
+    parser.add_argument("--gpus", type=int, default=8, help="number of GPUs (series) per Pod")
+    parser.add_argument("--pods", type=int, default=1, help="number of Pods of the run")
+    parser.add_argument("--other-pods", type=int, default=0, help="number of Pods of another namespace")
+    parser.add_argument("--duration", type=float, default=None,
+                        help="seconds of history of the synthetic series (default: unlimited)")
+    parser.add_argument("--hostname", default=None,
+                        help="value of the Hostname label of the synthetic series (default: no label)")
+    parser.add_argument("--replay", default=None, metavar="ARTIFACTS_DIR",
+                        help="serve the metrics recorded in this artifacts directory")
+
+def get_data(args):
+    if args.replay:
+        return RecordedThanos(args.replay)
+
+    return FakeThanos(gpus=args.gpus, pods=args.pods, other_pods=args.other_pods, duration=args.duration,
+                      hostname=args.hostname)
+
+def main():
+    parser = argparse.ArgumentParser(description="Fake Thanos querier")
+    parser.add_argument("--port", type=int, default=9090)
+    parser.add_argument("--token", default=None, help="bearer token required by the server")
+    add_data_arguments(parser)
+    parser.add_argument("--cache", type=int, default=0, help="number of range query responses cached")
+    parser.add_argument("--error-rate", type=float, default=0,
+                        help="share of the queries failing with a transient error")
+    parser.add_argument("--max-samples", type=int, default=None,
+                        help="number of points a range query may load (default: unlimited)")
+    parser.add_argument("--tls-cert", default=None)
+    parser.add_argument("--tls-key", default=None)
+    args = parser.parse_args()
+
+    try:
+        fake = get_data(args)
+    except ValueError as e:
+        print(f"ERROR: {e}")
+        return 1
+
+    server = make_server(args.port, args.token, tls_cert=args.tls_cert, tls_key=args.tls_key,
+                         error_rate=args.error_rate, fake=fake, cache_size=args.cache,
+                         max_samples=args.max_samples)
+    scheme = "https" if args.tls_cert else "http"
+    print(f"Fake Thanos listening on {scheme}://localhost:{server.server_address[1]} ...")
+    try:
+        server.serve_forever()
+    except KeyboardInterrupt:
+        pass
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,170 @@
+"""Incremental reader of Thanos query_range responses.
+
+Used to stream the responses into the metric files (query_thanos.py),
+and to decode the metric files (the mlperf store). The metric files
+saved during the run contain several responses, one per window of the
+run, one after the other.
+"""
+
+import re
+import json
+
+READ_SIZE = 1024 * 1024 # bytes read at once
+
+_json_decoder = json.JSONDecoder()
+_RESULT_KEY_RE = re.compile(r'"result"\s*:\s*\[')
+_VALUES_END_RE = re.compile(r'\[\s*\]|\]\s*\]')
+
+class PromStreamReader():
+    """Incremental decoder of the 'result' lists of query_range responses.
+
+    The 'metric' labels of each series are decoded first, and the
+    'values' list of the series rejected by the `keep` callback is
+    skipped without being decoded nor kept in memory.
+
+    read: read(size) callable returning the next text chunk, or '' at
+    the end of the data (eg, the read method of a text file)
+    """
+
+    def __init__(self, read, read_size=READ_SIZE):
+        self.read = read
+        self.read_size = read_size
+        self.buf = ""
+        self.pos = 0
+        self.mark = None # start of the text kept in the buffer, if not pos
+        self.window = 0 # index of the response being read
+
+    def _fill(self):
+        # drop the consumed part of the buffer and read the next chunk
+        chunk = self.read(self.read_size)
+        if not chunk:
+            return False
+
+        start = self.pos if self.mark is None else self.mark
+        self.buf = self.buf[start:] + chunk
+        self.pos -= start
+        if self.mark is not None:
+            self.mark = 0
+
+        return True
+
+    def _peek(self):
+        # skip the whitespaces and return the next character
+        while True:
+            while self.pos < len(self.buf) and self.buf[self.pos].isspace():
+                self.pos += 1
+
+            if self.pos < len(self.buf):
+                return self.buf[self.pos]
+
+            if not self._fill():
+                raise ValueError("unexpected end of the data")
+
+    def _expect(self, char):
+        if self._peek() != char:
+            raise ValueError(f"expected '{char}', found '{self.buf[self.pos]}'")
+        self.pos += 1
+
+    def _decode(self):
+        # only used for strings, objects and lists, which cannot be
+        # truncated by the end of the buffer without failing to decode
+        self._peek()
+        while True:
+            try:
+                value, self.pos = _json_decoder.raw_decode(self.buf, self.pos)
+                return value
+            except json.JSONDecodeError:
+                if not self._fill():
+                    raise
+
+    def _read_values(self, decode):
+        # 'values' is a list of [ts, "value"] pairs, so it ends with the
+        # first ']]' (or is an empty '[]')
+        self._peek()
+        search_from = self.pos
+        while True:
+            match = _VALUES_END_RE.search(self.buf, search_from)
+            if match:
+                break
+
+            if not decode:
+                # the values are skipped, no need to keep them in memory
+                # (unless the text of the series is marked)
+                self.pos = max(self.pos, len(self.buf) - 16)
+
+            # the closing brackets may be split by the end of the buffer
+            search_offset = max(self.pos, len(self.buf) - 16) - self.pos
+            if not self._fill():
+                raise ValueError("unexpected end of the data in a 'values' list")
+            search_from = self.pos + search_offset
+
+        values = json.loads(self.buf[self.pos:match.end()]) if decode else None
+        self.pos = match.end()
+
+        return values
+
+    def _seek_result(self):
+        # returns False at the end of the data
+        while True:
+            match = _RESULT_KEY_RE.search(self.buf, self.pos)
+            if match:
+                self.pos = match.end() - 1 # keep the '['
+                return True
+
+            self.pos = max(self.pos, len(self.buf) - 64)
+            if not self._fill():
+                return False
+
+    def _read_series(self, keep, text):
+        labels = None
+        values = None
+
+        if text:
+            self.mark = self.pos
+
+        self._expect("{")
+        while self._peek() != "}":
+            key = self._decode()
+            self._expect(":")
+
+            if key == "metric":
+                labels = self._decode()
+            elif key == "values":
+                decode = not text and (labels is None or keep is None or keep(labels))
+                values = self._read_values(decode)
+            else:
+                self._decode()
+
+            if self._peek() == ",":
+                self.pos += 1
+        self.pos += 1
+
+        if text:
+            values = self.buf[self.mark:self.pos]
+            self.mark = None
+
+        return labels or {}, values
+
+    def iter_series(self, keep=None, text=False):
+        """Yields the (labels, values) of the series of the 'result'
+        lists, in the order of the responses (see `window`).
+
+        values is None when the series was rejected by keep(labels).
+        With text=True, the JSON text of the whole series is yielded
+        instead of its values, which are not decoded.
+        """
+        if not self._seek_result():
+            raise ValueError("no 'result' list found")
+
+        while True:
+            self._expect("[")
+            while self._peek() != "]":
+                yield self._read_series(keep, text)
+
+                if self._peek() == ",":
+                    self.pos += 1
+            self.pos += 1
+
+            if not self._seek_result():
+                return
+            self.window += 1
@@ -1,24 +1,71 @@
 #! /usr/bin/python3
 
+import os
+import time
+import random
 import subprocess
+import contextlib
 import urllib.request
 import urllib.parse
 import json
+import collections
 import ssl
 import base64
+import concurrent.futures
 
 import kubernetes.client
 import kubernetes.config
 import kubernetes.utils
 from kubernetes.stream import stream as k8s_stream
 
-kubernetes.config.load_kube_config()
+import thanos_client
+import prom_stream
+
+THANOS_CLUSTER_ROUTE = None # "thanos-querier-openshift-monitoring.apps.nvidia-test.nvidia-ocp.net"
+
+# 'http': direct HTTPS connection to the Thanos route (default)
+# 'exec': curl executed in the DCGM exporter pod, also used as a fallback
+#         when the route cannot be reached
+THANOS_TRANSPORT = os.environ.get("THANOS_TRANSPORT", "http")
+# TLS verification of the route certificate: 0 (default, like curl -k),
+# 1 (system CA bundle) or the path of a CA bundle
+THANOS_TLS_VERIFY = thanos_client.parse_verify(os.environ.get("THANOS_TLS_VERIFY", "0"))
+# overrides https://<route host>, eg to use fake_thanos.py
+THANOS_URL = os.environ.get("THANOS_URL")
+# with THANOS_URL, the token of the querier, to run offline (without
+# cluster access), eg against fake_thanos.py
+THANOS_TOKEN = os.environ.get("THANOS_TOKEN")
+
+QUERY_STEP = 1 # seconds between the points of the range queries
+# maximum number of points per series of a range query (Prometheus
+# refuses the queries above 11000). Longer windows are split in chunks.
+QUERY_MAX_POINTS = 11000
+# approximate size of a point in a query_range response ([ts,"value"],)
+QUERY_POINT_SIZE = 40
+STREAM_READ_SIZE = 1024 * 1024 # bytes read at once from the streamed responses
+# attempts of the queries failing with transient errors (timeout,
+# connection reset, querier overloaded), and delay before the first
+# retry, doubled after each attempt
+QUERY_ATTEMPTS = int(os.environ.get("THANOS_QUERY_ATTEMPTS", 5))
+QUERY_RETRY_DELAY = float(os.environ.get("THANOS_QUERY_RETRY_DELAY", 2)) # seconds
+
+# layout of the files written by save_values, same as the query_range responses
+RESULT_HEADER = '{"status":"success","data":{"resultType":"matrix","result":['
+RESULT_FOOTER = ']}}'
+
+def load_kube_config():
+    try:
+        kubernetes.config.load_kube_config()
+    except kubernetes.config.ConfigException:
+        if not (THANOS_URL and THANOS_TOKEN):
+            raise
+        print(f"WARNING: Thanos: no Kubernetes configuration, running offline against {THANOS_URL}.")
+
+load_kube_config()
 
 v1 = kubernetes.client.CoreV1Api()
 customv1 = kubernetes.client.CustomObjectsApi()
 
-THANOS_CLUSTER_ROUTE = None # "thanos-querier-openshift-monitoring.apps.nvidia-test.nvidia-ocp.net"
-
 def has_user_monitoring():
     print("Thanos: Checking if user-monitoring is enabled ...")
     try:
@@ -67,18 +114,59 @@ def get_dcgm_podname():
 
     return pods.items[0].metadata.name
 
-def _do_query(thanos, api_cmd, **data):
-    if not thanos['token']:
-        raise RuntimeError("Thanos token not available ...")
-
+def _do_query_exec(thanos, api_cmd, timeout=None, **data):
     url = f"https://{thanos['host']}/api/v1/{api_cmd}"
     encoded_data = urllib.parse.urlencode(data)
     url += "?" + encoded_data
 
     curl_cmd = f"curl --silent -k '{url}' --header 'Authorization: Bearer {thanos['token']}'"
-    resp = exec_in_pod("nvidia-gpu-operator", thanos["pod_name"], curl_cmd)
+    resp = exec_in_pod("nvidia-gpu-operator", thanos["pod_name"], curl_cmd, timeout=timeout)
+
+    return json.loads(resp.replace("'", '"'))
+
+def _retry(fct, what):
+    """Calls fct() and returns its result, retrying it with an
+    exponential backoff when it raises a ThanosTransientError."""
+    delay = QUERY_RETRY_DELAY
+    for attempt in range(1, QUERY_ATTEMPTS + 1):
+        try:
+            return fct()
+        except thanos_client.ThanosTransientError as e:
+            if attempt == QUERY_ATTEMPTS:
+                raise
+
+            # single write, the queries run concurrently
+            print(f"WARNING: Thanos: {what}: {e}\n"
+                  f"WARNING: Thanos: {what}: retrying in {delay:.0f}s "
+                  f"(attempt {attempt}/{QUERY_ATTEMPTS}) ...\n", end="")
+            # with some jitter, so that the concurrent queries do not retry all at once
+            time.sleep(delay * random.uniform(1, 1.25))
+            delay *= 2
+
+def _fall_back_to_exec(thanos, e):
+    print(f"WARNING: Thanos: {e}\n"
+          "WARNING: Thanos: route not reachable, falling back to the pod exec transport.\n", end="")
+    thanos["client"] = None
+
+def _do_query(thanos, api_cmd, timeout=None, **data):
+    """Runs a Thanos API query and returns the data of the response, or
+    None if the query failed.
+
+    timeout: the maximum duration (in seconds) of the query
+    """
+    if not thanos['token']:
+        raise RuntimeError("Thanos token not available ...")
 
-    result = json.loads(resp.replace("'", '"'))
+    client = thanos.get("client")
+    if client is None:
+        result = _do_query_exec(thanos, api_cmd, timeout, **data)
+    else:
+        try:
+            result = _retry(lambda: client.get(api_cmd, timeout, **data), api_cmd)
+        except thanos_client.ThanosConnectionError as e:
+            _fall_back_to_exec(thanos, e)
+
+            result = _do_query_exec(thanos, api_cmd, timeout, **data)
 
     if result["status"] == "success":
         return result["data"]
@@ -93,16 +181,218 @@ def query_current_ts(thanos):
 def query_metrics(thanos):
     return _do_query(thanos, "label/__name__/values")
 
-def query_values(thanos, metrics, ts_start, ts_stop):
+def _split_window(ts_start, ts_stop):
+    """Splits the window into (start, end) chunks of at most
+    QUERY_MAX_POINTS points. The chunks share their boundary point."""
+    chunk_length = (QUERY_MAX_POINTS - 1) * QUERY_STEP
+
+    chunks = []
+    chunk_start = ts_start
+    while True:
+        chunk_end = min(chunk_start + chunk_length, ts_stop)
+        chunks.append((chunk_start, chunk_end))
+        if chunk_end >= ts_stop:
+            return chunks
+        chunk_start = chunk_end
+
+def next_window_start(ts_start, ts_stop):
+    """Returns the start of the window following the [ts_start, ts_stop]
+    window, on the same grid of QUERY_STEP seconds, so that the
+    successive windows do not share their boundary point."""
+    return ts_start + (int((ts_stop - ts_start) / QUERY_STEP) + 1) * QUERY_STEP
+
+def _stitch_chunks(chunks_values):
+    """Stitches the query_range results of successive chunks into one
+    series per label set, without the duplicated boundary points."""
+    series = {}
+    for chunk_values in chunks_values:
+        for chunk_series in chunk_values["result"]:
+            key = tuple(sorted(chunk_series["metric"].items()))
+            try:
+                values = series[key]["values"]
+            except KeyError:
+                series[key] = chunk_series
+                continue
+
+            last_ts = values[-1][0] if values else None
+            values += [value for value in chunk_series["values"]
+                       if last_ts is None or value[0] > last_ts]
+
+    return dict(chunks_values[0], result=list(series.values()))
+
+def label_matchers(**labels):
+    """Returns the PromQL label matchers of the labels, eg
+    label_matchers(namespace="default", pod=("=~", "run-.*"))
+    --> 'namespace="default",pod=~"run-.*"'
+
+    The values are either a string (equality) or an (operator, value) tuple.
+    """
+    matchers = []
+    for label, value in labels.items():
+        op, value = value if isinstance(value, tuple) else ("=", value)
+        matchers.append(f'{label}{op}{json.dumps(value)}')
+
+    return ",".join(matchers)
+
+def add_matchers(selector, matchers):
+    """Adds label matchers to a metric name or a {...} selector."""
+    if not matchers:
+        return selector
+
+    if selector.endswith("}"):
+        return f"{selector[:-1]},{matchers}}}"
+
+    return f"{selector}{{{matchers}}}"
+
+def query_values(thanos, metrics, ts_start, ts_stop, timeout=None, workers=1, matchers=None):
+    """Returns the values of the metrics between ts_start and ts_stop.
+
+    matchers: label matchers (see label_matchers) restricting the series
+    returned, eg to the Pods of the run.
+
+    The long windows are queried by chunks, in parallel with `workers`
+    threads, and stitched back together.
+    """
     #print(f"Get thanos metrics for '{metrics}' between {ts_start} and {ts_stop}.")
-    return _do_query(thanos, "query_range",
-                     query=metrics,
-                     start=ts_start,
-                     end=ts_stop,
-                     step=1)
+    query = add_matchers(metrics, matchers)
+
+    def query_chunk(chunk):
+        chunk_start, chunk_end = chunk
+        return _do_query(thanos, "query_range", timeout,
+                         query=query,
+                         start=chunk_start,
+                         end=chunk_end,
+                         step=QUERY_STEP)
+
+    chunks = _split_window(float(ts_start), float(ts_stop))
+    if len(chunks) == 1:
+        return query_chunk(chunks[0])
 
+    with concurrent.futures.ThreadPoolExecutor(max_workers=workers) as executor:
+        chunks_values = list(executor.map(query_chunk, chunks))
 
-def exec_in_pod(namespace, name, cmd):
+    if None in chunks_values:
+        return None
+
+    return _stitch_chunks(chunks_values)
+
+
+def metrics_selector(metrics):
+    return '{__name__=~"' + "|".join(metrics) + '"}'
+
+def plan_batches(thanos, metrics, ts_start, ts_stop, max_size, timeout=None, matchers=None):
+    """Groups the metrics into batches queried at once, whose responses
+    should not exceed max_size bytes.
+
+    The size of the responses is estimated from the number of series of
+    each metric with values in the window (including the Pods or GPUs
+    gone before ts_stop), listed from the index with a single series
+    query, times the number of points of the whole window.
+    """
+    selector = add_matchers(metrics_selector(metrics), matchers)
+    series = _do_query(thanos, "series", timeout,
+                       start=ts_start,
+                       end=ts_stop,
+                       **{"match[]": selector})
+
+    series_count = collections.Counter(labels.get("__name__") for labels in series or [])
+
+    # not only the points of a chunk: with the exec transport, the chunks
+    # of the long windows are stitched together in memory (see query_values)
+    points = int((float(ts_stop) - float(ts_start)) / QUERY_STEP) + 1
+
+    batches = [[]]
+    batch_size = 0
+    for metric in metrics:
+        size = series_count.get(metric, 0) * points * QUERY_POINT_SIZE
+        if batches[-1] and batch_size + size > max_size:
+            batches.append([])
+            batch_size = 0
+
+        batches[-1].append(metric)
+        batch_size += size
+
+    return batches
+
+def _iter_values_series(values):
+    for series in values["result"]:
+        yield series["metric"], json.dumps(series)
+
+def _write_series(metrics, responses, open_dest):
+    """Writes the (labels, JSON text) series of each response into the
+    files of their metric, one response after the other.
+
+    Returns a dict of metric -> number of series saved, the maximum of
+    the responses.
+    """
+    series_count = {metric: 0 for metric in metrics}
+    with contextlib.ExitStack() as stack:
+        dest_files = {metric: stack.enter_context(open_dest(metric)) for metric in metrics}
+        for series in responses:
+            response_count = {metric: 0 for metric in metrics}
+            for dest_f in dest_files.values():
+                dest_f.write(RESULT_HEADER)
+
+            for labels, text in series:
+                metric = labels.get("__name__", metrics[0] if len(metrics) == 1 else None)
+                if metric not in dest_files: continue
+
+                dest_files[metric].write(("," if response_count[metric] else "") + text)
+                response_count[metric] += 1
+
+            for dest_f in dest_files.values():
+                dest_f.write(RESULT_FOOTER)
+
+            for metric, count in response_count.items():
+                series_count[metric] = max(series_count[metric], count)
+
+    return series_count
+
+def _iter_stream_series(thanos, query, ts_start, ts_stop, timeout):
+    """Yields the (labels, JSON text) series of the query_range
+    response, streamed."""
+    with thanos["client"].stream("query_range", timeout, query=query,
+                                 start=ts_start, end=ts_stop, step=QUERY_STEP) as read:
+        yield from prom_stream.PromStreamReader(read, STREAM_READ_SIZE).iter_series(text=True)
+
+def save_values(thanos, metrics, ts_start, ts_stop, open_dest, timeout=None, workers=1, matchers=None):
+    """Queries the values of the metrics, at once, and saves them into
+    the text files opened by open_dest(metric), with the layout of the
+    query_range responses.
+
+    With the HTTP transport, the response of a window of a single chunk
+    is streamed into the files one series at a time, instead of being
+    kept in memory. The transient errors are retried (the files are
+    rewritten from the beginning). The longer windows are queried by
+    chunks, in parallel with `workers` threads, and stitched together
+    in memory (see query_values), with both transports: the files hold
+    a single response per window.
+
+    Returns a dict of metric -> number of series saved, or None if the
+    query failed.
+    """
+    # a single metric is queried by name, to keep the query simple
+    selector = metrics[0] if len(metrics) == 1 else metrics_selector(metrics)
+
+    if thanos.get("client") is not None and len(_split_window(float(ts_start), float(ts_stop))) == 1:
+        query = add_matchers(selector, matchers)
+        try:
+            def save_stream():
+                return _write_series(metrics, [_iter_stream_series(thanos, query, ts_start, ts_stop, timeout)],
+                                     open_dest)
+
+            return _retry(save_stream, f"query_range {selector}")
+        except thanos_client.ThanosConnectionError as e:
+            _fall_back_to_exec(thanos, e)
+
+    values = query_values(thanos, selector, ts_start, ts_stop,
+                          timeout=timeout, workers=workers, matchers=matchers)
+    if values is None:
+        return None
+
+    return _write_series(metrics, [_iter_values_series(values)], open_dest)
+
+def exec_in_pod(namespace, name, cmd, timeout=None):
     # Calling exec and waiting for response
     exec_command = ['/bin/sh', '-c', cmd]
 
@@ -110,18 +400,35 @@ def exec_in_pod(namespace, name, cmd):
                       name=name, namespace=namespace,
                       command=exec_command,
                       stderr=False, stdin=False,
-                      stdout=True, tty=False)
+                      stdout=True, tty=False,
+                      _request_timeout=timeout)
 
 def prepare_thanos():
+    if THANOS_URL and THANOS_TOKEN:
+        # offline, the exec transport is not available
+        return dict(
+            token = THANOS_TOKEN,
+            host = urllib.parse.urlparse(THANOS_URL).netloc,
+            pod_name = None,
+            client = thanos_client.ThanosClient(THANOS_URL, THANOS_TOKEN, verify=THANOS_TLS_VERIFY),
+        )
+
     if not has_user_monitoring():
         raise Exception("""Thanos monitoring not enabled. See https://docs.openshift.com/container-platform/4.7/monitoring/enabling-monitoring-for-user-defined-projects.html#enabling-monitoring-for-user-defined-projects_enabling-monitoring-for-user-defined-projects""")
 
-    return dict(
+    thanos = dict(
         token = get_secret_token(),
         host = get_thanos_hostname(),
         pod_name = get_dcgm_podname(),
+        client = None,
     )
 
+    if THANOS_TRANSPORT == "http":
+        thanos["client"] = thanos_client.ThanosClient(THANOS_URL or f"https://{thanos['host']}",
+                                                      thanos["token"], verify=THANOS_TLS_VERIFY)
+
+    return thanos
+
 if __name__ == "__main__":
     thanos = prepare_thanos()
     #metrics = query_metrics(thanos)
@@ -6,6 +6,9 @@ import subprocess
 import time
 import datetime
 import json
+import gzip
+import threading
+import concurrent.futures
 from pathlib import Path
 from collections import defaultdict
 
@@ -19,7 +22,7 @@ import kubernetes.utils
 
 from kubernetes.client import V1ConfigMap, V1ObjectMeta
 
-kubernetes.config.load_kube_config()
+# loaded by query_thanos, which allows to run offline
 
 v1 = kubernetes.client.CoreV1Api()
 appsv1 = kubernetes.client.AppsV1Api()
@@ -49,8 +52,19 @@ MAX_START_TIME = 5 # minutes before failing the test if some pods are still pend
 MAX_RECONFIGURE_TIME = 5 # minutes before failing the test if the MIG reconfiguration didn't complete
 
 ENABLE_THANOS = True
+THANOS_WORKERS = 8 # metrics downloaded concurrently
+THANOS_QUERY_TIMEOUT = 120 # seconds before giving up a metric query
+THANOS_CHUNK_WORKERS = 1 # chunks of a long metric query downloaded concurrently
+THANOS_BATCH_QUERIES = True # query several metrics at once, see query_thanos.plan_batches
+THANOS_BATCH_MAX_SIZE = 64 * 1024 * 1024 # bytes, estimated size of the response of a batch
+THANOS_RUN_SCOPED = True # query only the series of the Pods of the run, see get_run_matchers
+THANOS_NODE_LABEL = None # label of the DCGM metrics holding the node name (eg, "Hostname"), to also match it
+THANOS_UNSCOPED_METRICS = set() # metrics without the exported_* labels, queried cluster-wide
+THANOS_COMPRESS = True # save prom_<metric>.json.gz files instead of prom_<metric>.json
+THANOS_SCRAPE_INTERVAL = 10 # minutes between the collections of the metrics during the run, or None
 thanos = None
 thanos_start = None
+thanos_scraper = None
 
 benchmark = None
 
@@ -194,41 +208,343 @@ def get_metrics_list():
             metrics[metric] = descr
     return metrics
 
-def save_thanos_metrics(thanos, thanos_start, thanos_stop):
-    if not sys.stdout.isatty():
-        with open(ARTIFACTS_DIR / "thanos.yaml", "w") as out_f:
-            print(f"start: {thanos_start}", file=out_f)
-            print(f"stop: {thanos_stop}", file=out_f)
+def thanos_metric_path(metric, metrics_dir):
+    suffix = ".json.gz" if THANOS_COMPRESS else ".json"
+    return metrics_dir / f"prom_{metric}{suffix}"
+
+def open_thanos_metric(metric, metrics_dir, offset=None):
+    """Opens metrics_dir/prom_<metric>.json[.gz] for writing, as a text file.
+
+    offset: the size of the windows already saved in the file, to
+    append the new window after them (the content after the offset,
+    partially written by a failed attempt, is dropped). The file is
+    overwritten when None.
+    """
+    dest_fname = thanos_metric_path(metric, metrics_dir)
+    if offset is not None:
+        with open(dest_fname, "ab") as out_f:
+            out_f.truncate(offset)
+
+    mode = "w" if offset is None else "a"
+    if THANOS_COMPRESS:
+        # level 6 is ~4x faster than the default 9, for ~2% more bytes.
+        # The windows appended are new gzip members of the file.
+        return gzip.open(dest_fname, mode + "t", encoding="utf-8", compresslevel=6)
+
+    return open(dest_fname, mode)
+
+def read_thanos_metadata(metric, metrics_dir):
+    """Returns the content of metrics_dir/prom_<metric>.meta.json, or None."""
+    try:
+        with open(metrics_dir / f"prom_{metric}.meta.json") as in_f:
+            return json.load(in_f)
+    except (OSError, ValueError):
+        return None
+
+def get_thanos_saved_window(metric, thanos_start, metrics_dir, matchers):
+    """Returns the metadata of the values of a metric already saved in
+    metrics_dir from thanos_start, with the same label matchers and
+    file format, or None if the metric must be queried from the
+    beginning."""
+    metadata = read_thanos_metadata(metric, metrics_dir)
+    if not metadata or "size" not in metadata:
+        # not saved, or saved by the previous versions
+        return None
+
+    if (metadata["start"] != thanos_start or metadata["matchers"] != matchers
+        or metadata["file"] != thanos_metric_path(metric, metrics_dir).name):
+        return None
+
+    try:
+        if thanos_metric_path(metric, metrics_dir).stat().st_size < metadata["size"]:
+            return None
+    except FileNotFoundError:
+        return None
+
+    return metadata
+
+def write_thanos_metadata(metric, series_count, thanos_start, thanos_stop, metrics_dir, matchers,
+                          previous=None):
+    """Saves the description of a metric file into metrics_dir/prom_<metric>.meta.json.
+
+    previous: the metadata of the windows the last one was appended to,
+    see get_thanos_saved_window.
+
+    Returns True and the number of bytes saved.
+    """
+    dest_fname = thanos_metric_path(metric, metrics_dir)
+    size = dest_fname.stat().st_size
+    metadata = dict(metric=metric, descr=get_metrics_list()[metric],
+                    start=previous["start"] if previous else thanos_start, stop=thanos_stop,
+                    matchers=matchers,
+                    series=max(series_count, previous["series"]) if previous else series_count,
+                    windows=previous["windows"] + 1 if previous else 1,
+                    file=dest_fname.name, size=size,
+                    compression="gzip" if THANOS_COMPRESS else None)
+
+    meta_fname = metrics_dir / f"prom_{metric}.meta.json"
+    with open(meta_fname, "w") as out_f:
+        json.dump(metadata, out_f)
+
+    # failure marker of a previous attempt
+    (metrics_dir / f"prom_{metric}.json.failed").unlink(missing_ok=True)
+
+    return True, size - (previous["size"] if previous else 0) + meta_fname.stat().st_size
+
+def write_thanos_failure(metric, e, metrics_dir, previous=None):
+    """Saves the exception of a failed metric into metrics_dir/prom_<metric>.json.failed.
+
+    previous: the metadata of the windows already saved, which are kept.
+    """
+    dest_fname = metrics_dir / f"prom_{metric}.json"
+
+    # single write, the metrics are saved concurrently
+    print(f"WARNING: Failed to save {dest_fname} logs:\n"
+          f"WARNING: {e.__class__.__name__}: {e}\n", end="")
+
+    # the values may have been partially written
+    if previous:
+        with open(thanos_metric_path(metric, metrics_dir), "ab") as out_f:
+            out_f.truncate(previous["size"])
+    else:
+        thanos_metric_path(metric, metrics_dir).unlink(missing_ok=True)
+        (metrics_dir / f"prom_{metric}.meta.json").unlink(missing_ok=True)
+
+    with open(f'{dest_fname}.failed', 'w') as out_f:
+        print(f"{e.__class__.__name__}: {e}", file=out_f)
+
+def get_run_matchers():
+    """Returns the label matchers selecting the series of the GPUs used
+    by the Pods of the run (see the job template)."""
+
+    labels = dict(exported_namespace=NAMESPACE,
+                  exported_pod=("=~", f"{APP_NAME}-.*"))
+    if THANOS_NODE_LABEL:
+        labels[THANOS_NODE_LABEL] = NODE_NAME
+
+    return query_thanos.label_matchers(**labels)
+
+def save_thanos_batch(thanos, batch, thanos_start, thanos_stop, metrics_dir, matchers=None, previous=None):
+    """Queries a batch of metrics at once, and saves them into their own file.
+
+    previous: metric -> metadata of the windows already saved (see
+    get_thanos_saved_window), which the values are appended to.
+
+    When the query of the batch fails, the batch is split in two.
+    Returns a dict of metric -> (saved, bytes saved).
+    """
+    previous = previous or {}
+
+    def open_dest(metric):
+        return open_thanos_metric(metric, metrics_dir,
+                                  offset=previous[metric]["size"] if metric in previous else None)
+
+    try:
+        series_count = query_thanos.save_values(thanos, batch, thanos_start, thanos_stop, open_dest,
+                                                timeout=THANOS_QUERY_TIMEOUT,
+                                                workers=THANOS_CHUNK_WORKERS,
+                                                matchers=matchers)
+        if series_count is None and len(batch) > 1:
+            raise RuntimeError("query failed")
+    except Exception as e:
+        if len(batch) == 1:
+            write_thanos_failure(batch[0], e, metrics_dir, previous.get(batch[0]))
+            return {batch[0]: (False, 0)}
+
+        print(f"WARNING: Failed to query a batch of {len(batch)} metrics, splitting it. "
+              f"{e.__class__.__name__}: {e}\n", end="")
+
+        half = len(batch) // 2
+        return {**save_thanos_batch(thanos, batch[:half], thanos_start, thanos_stop, metrics_dir, matchers, previous),
+                **save_thanos_batch(thanos, batch[half:], thanos_start, thanos_stop, metrics_dir, matchers, previous)}
+
+    if series_count is None:
+        metric = batch[0]
+        print(f"No metric values collected for {metric}\n", end="")
+        if metric in previous:
+            # keep the windows already saved, the next one will be queried again
+            with open(thanos_metric_path(metric, metrics_dir), "ab") as out_f:
+                out_f.truncate(previous[metric]["size"])
+        else:
+            with open_dest(metric) as out_f:
+                # an empty response (a valid gzip member when compressed)
+                out_f.write(query_thanos.RESULT_HEADER + query_thanos.RESULT_FOOTER)
+            # not saved, see thanos_metric_is_saved
+            with open(metrics_dir / f"prom_{metric}.json.failed", "w") as out_f:
+                print("No metric values collected", file=out_f)
+        return {metric: (False, 0)}
+
+    return {metric: write_thanos_metadata(metric, series_count[metric], thanos_start, thanos_stop,
+                                          metrics_dir, matchers, previous.get(metric))
+            for metric in batch}
+
+def write_thanos_window(thanos_start, thanos_stop, matchers, artifacts_dir):
+    with open(artifacts_dir / "thanos.yaml", "w") as out_f:
+        print(f"start: {thanos_start}", file=out_f)
+        print(f"stop: {thanos_stop}", file=out_f)
+        if matchers:
+            print(f"matchers: {json.dumps(matchers)}", file=out_f)
+
+def read_thanos_window(artifacts_dir):
+    """Returns the start, stop timestamps and label matchers saved in
+    artifacts_dir/thanos.yaml by save_thanos_metrics.
+
+    Raises ValueError if the start and stop timestamps are not valid.
+    """
+    with open(artifacts_dir / "thanos.yaml") as in_f:
+        window = yaml.safe_load(in_f)
+
+    # 'None' when the timestamps were not captured
+    return float(window["start"]), float(window["stop"]), window.get("matchers")
+
+def thanos_metric_is_saved(metric, metrics_dir, thanos_stop=None):
+    """Tells if the values of a metric were saved into metrics_dir,
+    until thanos_stop if not None."""
+    if (metrics_dir / f"prom_{metric}.json.failed").exists():
+        return False
+
+    metadata = read_thanos_metadata(metric, metrics_dir)
+    if metadata:
+        # the last windows may not have been saved
+        return thanos_stop is None or metadata["stop"] >= thanos_stop
+
+    # saved without the .meta.json sidecar file, by the previous versions
+    dest_fname = metrics_dir / f"prom_{metric}.json"
+    return dest_fname.exists() and dest_fname.stat().st_size > 0
+
+def collect_thanos_metrics(thanos, thanos_start, thanos_stop, metrics, metrics_dir, matchers,
+                           resume=False, verbose=True):
+    """Saves the metrics into metrics_dir, concurrently.
+
+    resume: only query the values after the windows already saved
+    (see get_thanos_saved_window), and append them to the files.
+    verbose: when False, only print the summary and the failures.
+
+    Returns the list of the metrics not saved.
+    """
+
+    previous = {} # metric -> metadata of the windows already saved
+    if resume:
+        for metric in metrics:
+            metric_matchers = None if metric in THANOS_UNSCOPED_METRICS else matchers
+            metadata = get_thanos_saved_window(metric, thanos_start, metrics_dir, metric_matchers)
+            if metadata:
+                previous[metric] = metadata
+
+    # the metrics without the labels of the run are queried cluster-wide,
+    # and the metrics already saved only from the end of their last window
+    windows = defaultdict(list) # (matchers, window start) -> metrics
+    complete = [] # metrics already saved until thanos_stop
+    for metric in metrics:
+        window_start = thanos_start
+        if metric in previous:
+            window_start = query_thanos.next_window_start(thanos_start, previous[metric]["stop"])
+            if window_start > thanos_stop:
+                complete.append(metric)
+                continue
+
+        windows[(None if metric in THANOS_UNSCOPED_METRICS else matchers, window_start)].append(metric)
+
+    if matchers and verbose:
+        print(f"Thanos: run-scoped queries: {{{matchers}}}")
+
+    start = time.time()
+    batches = [] # (matchers, window start, metrics)
+    for (scope_matchers, window_start), window_metrics in windows.items():
+        window_batches = [[metric] for metric in window_metrics]
+        if THANOS_BATCH_QUERIES:
+            try:
+                window_batches = query_thanos.plan_batches(thanos, window_metrics, window_start, thanos_stop,
+                                                           THANOS_BATCH_MAX_SIZE, timeout=THANOS_QUERY_TIMEOUT,
+                                                           matchers=scope_matchers)
+            except Exception as e:
+                print(f"WARNING: Failed to plan the batches of metrics, querying them one by one. "
+                      f"{e.__class__.__name__}: {e}\n", end="")
+
+        batches += [(scope_matchers, window_start, batch) for batch in window_batches]
+
+    if verbose:
+        appended = f", {len(previous)} appended to the windows already saved" if previous else ""
+        print(f"Saving {len(metrics)} metrics in {len(batches)} queries with {THANOS_WORKERS} workers{appended} ...")
+
+    with concurrent.futures.ThreadPoolExecutor(max_workers=THANOS_WORKERS) as executor:
+        futures = [executor.submit(save_thanos_batch, thanos, batch,
+                                   window_start, thanos_stop, metrics_dir, batch_matchers, previous)
+                   for batch_matchers, window_start, batch in batches]
+
+        saved = {metric: 0 for metric in complete}
+        for future in concurrent.futures.as_completed(futures):
+            for metric, (success, size) in future.result().items():
+                if success:
+                    saved[metric] = size
+
+    elapsed = time.time() - start
+    failed = [metric for metric in metrics if metric not in saved]
+
+    # single write, the metrics may be saved in the background
+    print(f"Thanos: saved {len(saved)}/{len(metrics)} metrics, "
+          f"{sum(saved.values())/1024/1024:.1f} MiB in {elapsed:.1f}s.\n", end="")
+    if saved and verbose:
+        print(f"Thanos: saved: {', '.join(metric for metric in metrics if metric in saved)}")
+    if failed:
+        print(f"Thanos: not saved: {', '.join(failed)}\n", end="")
+        if verbose:
+            print(f"Thanos: run './collect_missing_metrics.py {metrics_dir.parent}' "
+                  "to collect them again.")
+
+    return failed
+
+def save_thanos_metrics(thanos, thanos_start, thanos_stop, verbose=True):
+    """Saves the metrics of the run into ARTIFACTS_DIR/metrics, after
+    the windows already saved by ThanosScraper."""
+    matchers = get_run_matchers() if THANOS_RUN_SCOPED else None
+
+    # the window of the metrics, to collect them again if needed
+    write_thanos_window(thanos_start, thanos_stop, matchers, ARTIFACTS_DIR)
+
     metrics_dir = ARTIFACTS_DIR / "metrics"
     metrics_dir.mkdir(exist_ok=True)
 
-    for metric, descr in get_metrics_list().items():
-        dest_fname = metrics_dir / f"prom_{metric}.json"
-        try:
-            if not (thanos_start and thanos_stop):
-                print("... invalid thanos values, skipping.")
-                continue
-            thanos_values = query_thanos.query_values(thanos, metric, thanos_start, thanos_stop)
+    if not (thanos_start and thanos_stop):
+        print("... invalid thanos values, skipping.")
+        return
 
-            if not thanos_values:
-                print("No metric values collected for {metric}")
-                with open(dest_fname, 'w'): pass
-                continue
+    collect_thanos_metrics(thanos, thanos_start, thanos_stop, list(get_metrics_list()),
+                           metrics_dir, matchers, resume=True, verbose=verbose)
 
-            thanos_values["__metric_name"] = metric
-            thanos_values["__metric_descr"] = descr
+class ThanosScraper():
+    """Saves the metrics of the run in the background, every
+    THANOS_SCRAPE_INTERVAL minutes while it executes, so that the final
+    collection only queries the last window, and that the metrics of
+    the failed runs are kept."""
 
-            print(f"Saving {metric} metrics ...")
-            with open(dest_fname, 'w') as out_f:
-                json.dump(thanos_values, out_f)
+    def __init__(self, thanos, thanos_start):
+        self.thanos = thanos
+        self.thanos_start = thanos_start
+        self.stopped = threading.Event()
+        self.thread = threading.Thread(target=self.run, name="thanos-scraper", daemon=True)
 
-        except Exception as e:
-            print(f"WARNING: Failed to save {dest_fname} logs:")
-            print(f"WARNING: {e.__class__.__name__}: {e}")
+    def start(self):
+        self.thread.start()
 
-            with open(f'{dest_fname}.failed', 'w') as out_f:
-                print(f"{e.__class__.__name__}: {e}", file=out_f)
-            pass
+    def run(self):
+        while not self.stopped.wait(THANOS_SCRAPE_INTERVAL * 60):
+            try:
+                thanos_stop = query_thanos.query_current_ts(self.thanos)
+                if thanos_stop is None:
+                    continue
+
+                print(f"\nThanos: saving the metrics until {thanos_stop} ...\n", end="")
+                save_thanos_metrics(self.thanos, self.thanos_start, thanos_stop, verbose=False)
+            except Exception as e:
+                # the metrics will be saved by the next collection
+                print(f"WARNING: Failed to save the Thanos metrics in the background: "
+                      f"{e.__class__.__name__}: {e}\n", end="")
+
+    def stop(self):
+        """Stops the collection, after the end of the current one."""
+        self.stopped.set()
+        self.thread.join()
 
 def prepare_configmap():
     print("Deleting the old ConfigMap, if any ...")
@@ -360,9 +676,10 @@ def await_completion(opts):
 
     if ENABLE_THANOS:
         print("Thanos: Preparing  ...")
-        global thanos, thanos_start
+        global thanos, thanos_start, thanos_scraper
         thanos = query_thanos.prepare_thanos()
         thanos_start = None
+        thanos_scraper = None
 
         print("-----")
 
@@ -384,125 +701,136 @@ def await_completion(opts):
 
     failure_detected = False
 
-    while True:
-        jobs = batchv1.list_namespaced_job(namespace=NAMESPACE,
-                                  label_selector=f"app={APP_NAME}")
+    try:
+        while True:
+            jobs = batchv1.list_namespaced_job(namespace=NAMESPACE,
+                                      label_selector=f"app={APP_NAME}")
 
-        all_finished = True
-        for job in jobs.items:
-            job = batchv1.read_namespaced_job(namespace=NAMESPACE, name=job.metadata.name)
-            active = job.status.active
-            succeeded = job.status.succeeded
-            failed = job.status.failed
+            all_finished = True
+            for job in jobs.items:
+                job = batchv1.read_namespaced_job(namespace=NAMESPACE, name=job.metadata.name)
+                active = job.status.active
+                succeeded = job.status.succeeded
+                failed = job.status.failed
 
-            if not active: active = 0
-            if not succeeded: succeeded = 0
-            if not failed: failed = 0
+                if not active: active = 0
+                if not succeeded: succeeded = 0
+                if not failed: failed = 0
 
-            if sum([active, succeeded, failed]) == 0:
-                phase = "Not started"
-            else:
-                phase = "Active" if active else "Finished"
+                if sum([active, succeeded, failed]) == 0:
+                    phase = "Not started"
+                else:
+                    phase = "Active" if active else "Finished"
 
-            if phase != "Finished":
-                all_finished = False
+                if phase != "Finished":
+                    all_finished = False
 
-            job_state = f"{job.metadata.name} - {phase} (active={active}, succeeded={succeeded}, failed={failed})"
-            if job_state != job_states[job.metadata.name]:
-                job_states[job.metadata.name] = job_state
-                print("\n"+job_state)
+                job_state = f"{job.metadata.name} - {phase} (active={active}, succeeded={succeeded}, failed={failed})"
+                if job_state != job_states[job.metadata.name]:
+                    job_states[job.metadata.name] = job_state
+                    print("\n"+job_state)
 
-            if failed:
-                print(f"ERROR: Failure detected in Job {job.metadata.name}, aborting...")
-                failure_detected = True
-                all_finished = True
-                break
+                if failed:
+                    print(f"ERROR: Failure detected in Job {job.metadata.name}, aborting...")
+                    failure_detected = True
+                    all_finished = True
+                    break
 
-        if all_finished:
-            break
+            if all_finished:
+                break
 
-        pods = v1.list_namespaced_pod(namespace=NAMESPACE,
-                                          label_selector=f"app={APP_NAME}")
-        for pod in pods.items:
-            phase = pod.status.phase
+            pods = v1.list_namespaced_pod(namespace=NAMESPACE,
+                                              label_selector=f"app={APP_NAME}")
+            for pod in pods.items:
+                phase = pod.status.phase
+
+                if phase == "Running":
+                    if no_sync and exec_start is None:
+                        print("Execution started!")
+                        exec_start = datetime.datetime.now()
+                        printed_time = None
+                        wait_start = None
+
+                    if ENABLE_THANOS and thanos_start is None:
+                        thanos_start = query_thanos.query_current_ts(thanos)
+                        print(ERASE_LINE+f"Thanos: start time: {thanos_start}")
+
+                        if thanos_start and THANOS_SCRAPE_INTERVAL:
+                            print(f"Thanos: saving the metrics every {THANOS_SCRAPE_INTERVAL} minutes ...")
+                            thanos_scraper = ThanosScraper(thanos, thanos_start)
+                            thanos_scraper.start()
+
+                if pod_phases[pod.metadata.name] != phase:
+                    print(ERASE_LINE+f"{pod.metadata.name} --> {phase}")
+                    pod_phases[pod.metadata.name] = phase
+
+                if phase == "Failed":
+                    print(f"ERROR: Failure detected in Pod {pod.metadata.name}, aborting...")
+                    all_finished = True
+                    failure_detected = True
+                    break
 
-            if phase == "Running":
-                if no_sync and exec_start is None:
+            if not no_sync and exec_start is None:
+                if "Pending" not in pod_phases.values():
                     print("Execution started!")
                     exec_start = datetime.datetime.now()
                     printed_time = None
                     wait_start = None
 
-                if ENABLE_THANOS and thanos_start is None:
-                    thanos_start = query_thanos.query_current_ts(thanos)
-                    print(ERASE_LINE+f"Thanos: start time: {thanos_start}")
+            if wait_start:
+                wait_time = (datetime.datetime.now() - wait_start).seconds / 60
+                if wait_time >= MAX_START_TIME:
+                    print(ERASE_LINE+f"ERROR: Pods execution didn't properly start after {wait_time:.1f} minutes, aborting...")
+                    all_finished = True
+                    failure_detected = True
+                    break
 
-            if pod_phases[pod.metadata.name] != phase:
-                print(ERASE_LINE+f"{pod.metadata.name} --> {phase}")
-                pod_phases[pod.metadata.name] = phase
+                if no_sync:
+                    # Pods may stay pending until the previous one is finished
+                    if "Running" in pod_phases.values():
+                        wait_start = None
+                else:
+                    # all synced
+                    if "Pending" not in pod_phases.values():
+                        wait_start = None
 
-            if phase == "Failed":
-                print(f"ERROR: Failure detected in Pod {pod.metadata.name}, aborting...")
-                all_finished = True
-                failure_detected = True
-                break
+            else:
+                if no_sync:
+                    if "Running" not in pod_phases.values():
+                        if "Pending" in pod_phases.values():
+                            print("Restart waiting for Pod execution ...")
+                            wait_start = datetime.datetime.now()
+                        else:
+                            if "Failed" in pod_phases.values():
+                                failure_detected = True
+                                all_finished = True
+                else:
+                    if "Running" not in pod_phases.values():
+                        all_finished = True
 
-        if not no_sync and exec_start is None:
-            if "Pending" not in pod_phases.values():
-                print("Execution started!")
-                exec_start = datetime.datetime.now()
-                printed_time = None
-                wait_start = None
-
-        if wait_start:
-            wait_time = (datetime.datetime.now() - wait_start).seconds / 60
-            if wait_time >= MAX_START_TIME:
-                print(ERASE_LINE+f"ERROR: Pods execution didn't properly start after {wait_time:.1f} minutes, aborting...")
-                all_finished = True
-                failure_detected = True
+            if all_finished:
                 break
 
-            if no_sync:
-                # Pods may stay pending until the previous one is finished
-                if "Running" in pod_phases.values():
-                    wait_start = None
-            else:
-                # all synced
-                if "Pending" not in pod_phases.values():
-                    wait_start = None
-
-        else:
-            if no_sync:
-                if "Running" not in pod_phases.values():
-                    if "Pending" in pod_phases.values():
-                        print("Restart waiting for Pod execution ...")
-                        wait_start = datetime.datetime.now()
-                    else:
-                        if "Failed" in pod_phases.values():
-                            failure_detected = True
-                            all_finished = True
+            time.sleep(5)
+            if exec_start:
+                print(".", end="")
+                run_time = round((datetime.datetime.now() - exec_start).seconds / 60)
+                if not (run_time % 5) and run_time and run_time != printed_time:
+                    print(ERASE_LINE + f"{run_time} minutes of execution ...")
+                    printed_time = run_time
             else:
-                if "Running" not in pod_phases.values():
-                    all_finished = True
-
-        if all_finished:
-            break
-
-        time.sleep(5)
-        if exec_start:
-            print(".", end="")
-            run_time = round((datetime.datetime.now() - exec_start).seconds / 60)
-            if not (run_time % 5) and run_time and run_time != printed_time:
-                print(ERASE_LINE + f"{run_time} minutes of execution ...")
-                printed_time = run_time
-        else:
-            print("x", end="")
-            wait_time = round((datetime.datetime.now() - wait_start).seconds / 60)
-            if not (wait_time % 1) and wait_time and wait_time != printed_time:
-                print(ERASE_LINE + f"{wait_time} minutes of wait ...")
-                printed_time = wait_time
-
-        sys.stdout.flush()
+                print("x", end="")
+                wait_time = round((datetime.datetime.now() - wait_start).seconds / 60)
+                if not (wait_time % 1) and wait_time and wait_time != printed_time:
+                    print(ERASE_LINE + f"{wait_time} minutes of wait ...")
+                    printed_time = wait_time
+
+            sys.stdout.flush()
+    finally:
+        # also when interrupted, not to leave the collection running
+        if ENABLE_THANOS and thanos_scraper:
+            print(ERASE_LINE+"Thanos: waiting for the end of the background collection ...")
+            thanos_scraper.stop()
 
     print("-----")
     print(datetime.datetime.now())
@@ -611,7 +939,8 @@ def save_artifacts(is_successful):
     save_jobs()
     save_image_sha()
 
-    if ENABLE_THANOS and is_successful:
+    if ENABLE_THANOS:
+        # the metrics of the failed runs are saved too
         if thanos_start:
             thanos_stop = query_thanos.query_current_ts(thanos)
             print(f"Thanos: stop time: {thanos_stop}")
@@ -0,0 +1,93 @@
+import io
+import gzip
+import json
+
+import pytest
+
+import prom_stream
+
+
+def _response(window, series_count=3, points=5):
+    result = []
+    for series in range(series_count):
+        labels = {"__name__": "DCGM_FI_DEV_POWER_USAGE", "exported_pod": f"run-mlperf-{series}",
+                  "gpu": str(series), "Hostname": "node [1]"}
+        values = [[1700000000.5 + window * points + i, str(100.25 * series + i)] for i in range(points)]
+        # the key order varies, as the labels may come after the values
+        result.append(dict(values=values, metric=labels) if series % 2 else dict(metric=labels, values=values))
+
+    # an empty series
+    result.append(dict(metric={"__name__": "DCGM_FI_DEV_POWER_USAGE", "exported_pod": "empty"}, values=[]))
+
+    return dict(status="success", data=dict(resultType="matrix", result=result))
+
+
+def _multi_member_gzip(responses):
+    data = io.BytesIO()
+    for response in responses:
+        # one gzip member per window, like run_ssd.open_thanos_metric
+        with gzip.open(data, "at", encoding="utf-8") as out_f:
+            out_f.write(json.dumps(response, indent=1 if len(responses) % 2 else None))
+    data.seek(0)
+
+    return data
+
+
+def _expected(responses, keep=None):
+    return [(window, series["metric"], series["values"] if keep is None or keep(series["metric"]) else None)
+            for window, response in enumerate(responses)
+            for series in response["data"]["result"]]
+
+
+@pytest.mark.parametrize("read_size", [1, 2, 3, 7, 16, 17, 64, prom_stream.READ_SIZE])
+def test_split_buffers_match_json_load(read_size):
+    response = _response(0)
+    reader = prom_stream.PromStreamReader(io.StringIO(json.dumps(response)).read, read_size)
+
+    assert [(reader.window, labels, values) for labels, values in reader.iter_series()] == \
+        _expected([response])
+
+
+@pytest.mark.parametrize("read_size", [5, 1024])
+def test_multi_member_gzip_matches_json_load(read_size):
+    responses = [_response(window) for window in range(3)]
+    with gzip.open(_multi_member_gzip(responses), "rt", encoding="utf-8") as in_f:
+        reader = prom_stream.PromStreamReader(in_f.read, read_size)
+        decoded = [(reader.window, labels, values) for labels, values in reader.iter_series()]
+
+    assert decoded == _expected(responses)
+
+
+@pytest.mark.parametrize("read_size", [3, 1024])
+def test_rejected_series_are_not_decoded(read_size):
+    responses = [_response(window) for window in range(2)]
+    text = "\n".join(json.dumps(response) for response in responses)
+
+    def keep(labels):
+        return labels.get("exported_pod") == "run-mlperf-1"
+
+    reader = prom_stream.PromStreamReader(io.StringIO(text).read, read_size)
+    decoded = [(reader.window, labels, values) for labels, values in reader.iter_series(keep)]
+
+    assert decoded == _expected(responses, keep)
+
+
+@pytest.mark.parametrize("read_size", [4, 1024])
+def test_text_of_the_series(read_size):
+    response = _response(0)
+    reader = prom_stream.PromStreamReader(io.StringIO(json.dumps(response)).read, read_size)
+
+    series = [(labels, json.loads(text)) for labels, text in reader.iter_series(text=True)]
+
+    assert series == [(series["metric"], series) for series in response["data"]["result"]]
+
+
+def test_truncated_data():
+    text = json.dumps(_response(0))
+    reader = prom_stream.PromStreamReader(io.StringIO(text[:len(text) // 2]).read, 16)
+
+    with pytest.raises(ValueError):
+        list(reader.iter_series())
+
+    with pytest.raises(ValueError, match="no 'result' list found"):
+        list(prom_stream.PromStreamReader(io.StringIO("").read).iter_series())
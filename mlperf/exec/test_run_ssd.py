@@ -0,0 +1,170 @@
+import types
+import threading
+
+import pytest
+
+pytest.importorskip("urllib3")
+pytest.importorskip("yaml")
+
+import fake_thanos
+import thanos_client
+from conftest import TOKEN
+
+METRICS = ["DCGM_FI_DEV_SM_CLOCK", "DCGM_FI_DEV_MEM_CLOCK", "DCGM_FI_DEV_GPU_TEMP", "DCGM_FI_DEV_POWER_USAGE"]
+
+
+@pytest.fixture
+def run_ssd(query_thanos, monkeypatch, tmp_path):
+    import run_ssd
+    monkeypatch.setattr(run_ssd, "ARTIFACTS_DIR", tmp_path)
+    (tmp_path / "metrics").mkdir()
+
+    return run_ssd
+
+
+def _thanos(url):
+    return dict(token=TOKEN, client=thanos_client.ThanosClient(url, TOKEN))
+
+
+def _saved_series(artifacts_dir, metric):
+    # the windows of the files, concatenated
+    return [(labels, timestamps) for labels, (timestamps, values)
+            in fake_thanos.RecordedThanos(artifacts_dir).iter_series(metric)]
+
+
+@pytest.mark.parametrize("error_rate", [0, 1])
+def test_metrics_are_saved_concurrently(serve, run_ssd, query_thanos, monkeypatch, tmp_path, capsys, error_rate):
+    monkeypatch.setattr(query_thanos, "QUERY_ATTEMPTS", 1)
+    monkeypatch.setattr(run_ssd, "THANOS_WORKERS", 4)
+    monkeypatch.setattr(run_ssd, "THANOS_BATCH_QUERIES", False)
+    thanos = _thanos(serve(error_rate=error_rate))
+    now = query_thanos.query_current_ts(_thanos(serve()))
+
+    failed = run_ssd.collect_thanos_metrics(thanos, now - 60, now, METRICS, tmp_path / "metrics", None)
+
+    if error_rate:
+        assert failed == METRICS
+        assert f"Thanos: saved 0/{len(METRICS)} metrics" in capsys.readouterr().out
+        assert sorted(path.name for path in (tmp_path / "metrics").iterdir()) == \
+            sorted(f"prom_{metric}.json.failed" for metric in METRICS)
+    else:
+        assert failed == []
+        assert f"Thanos: saved {len(METRICS)}/{len(METRICS)} metrics" in capsys.readouterr().out
+        for metric in METRICS:
+            assert [len(timestamps) for labels, timestamps in _saved_series(tmp_path, metric)] == [61, 61]
+
+
+def test_queries_are_scoped_to_the_run(serve, run_ssd, monkeypatch, tmp_path):
+    monkeypatch.setattr(run_ssd, "THANOS_UNSCOPED_METRICS", {METRICS[0]})
+    thanos = _thanos(serve(fake=fake_thanos.FakeThanos(gpus=2, other_pods=1)))
+    now = run_ssd.query_thanos.query_current_ts(thanos)
+    matchers = run_ssd.get_run_matchers()
+
+    assert run_ssd.collect_thanos_metrics(thanos, now - 60, now, METRICS, tmp_path / "metrics", matchers) == []
+
+    assert {labels["exported_pod"] for labels, timestamps in _saved_series(tmp_path, METRICS[0])} == \
+        {"run-mlperf-0abcd", "other-app-0"}
+    for metric in METRICS[1:]:
+        assert [labels["exported_pod"] for labels, timestamps in _saved_series(tmp_path, metric)] == \
+            ["run-mlperf-0abcd"] * 2
+        assert run_ssd.read_thanos_metadata(metric, tmp_path / "metrics")["matchers"] == matchers
+
+
+@pytest.mark.parametrize("max_samples, saved", [
+    (2 * 2 * 61, True), # the batch is split in two
+    (61, False), # each metric is split down to a failure
+])
+def test_failed_batches_are_split(serve, run_ssd, tmp_path, capsys, max_samples, saved):
+    thanos = _thanos(serve(max_samples=max_samples))
+    now = run_ssd.query_thanos.query_current_ts(thanos)
+
+    result = run_ssd.save_thanos_batch(thanos, METRICS, now - 60, now, tmp_path / "metrics")
+
+    assert "Failed to query a batch of 4 metrics, splitting it" in capsys.readouterr().out
+    assert {metric: success for metric, (success, size) in result.items()} == {metric: saved for metric in METRICS}
+    for metric in METRICS:
+        assert (tmp_path / "metrics" / f"prom_{metric}.json.failed").exists() != saved
+        if saved:
+            assert [len(timestamps) for labels, timestamps in _saved_series(tmp_path, metric)] == [61, 61]
+
+
+def test_long_windows_are_queried_by_chunks(serve, run_ssd, monkeypatch, tmp_path):
+    thanos = _thanos(serve())
+    now = run_ssd.query_thanos.query_current_ts(thanos)
+    window = 3 * fake_thanos.MAX_POINTS
+
+    result = run_ssd.save_thanos_batch(thanos, METRICS[:1], now - window, now, tmp_path / "metrics")
+    assert result[METRICS[0]][0]
+    assert [timestamps for labels, timestamps in _saved_series(tmp_path, METRICS[0])] == \
+        [pytest.approx([now - window + ts for ts in range(window + 1)])] * 2
+
+    # the chunks above the limit are refused by Thanos
+    monkeypatch.setattr(run_ssd.query_thanos, "QUERY_MAX_POINTS", 2 * fake_thanos.MAX_POINTS)
+    result = run_ssd.save_thanos_batch(thanos, METRICS[:1], now - window, now, tmp_path / "metrics")
+    assert not result[METRICS[0]][0]
+    assert (tmp_path / "metrics" / f"prom_{METRICS[0]}.json.failed").exists()
+
+
+def test_collection_resumes_after_the_saved_windows(serve, run_ssd, tmp_path):
+    thanos = _thanos(serve())
+    now = run_ssd.query_thanos.query_current_ts(thanos)
+    metrics_dir = tmp_path / "metrics"
+
+    assert run_ssd.collect_thanos_metrics(thanos, now - 120, now - 60, METRICS, metrics_dir, None) == []
+    # a window partially written by a failed attempt, without its metadata
+    with open(run_ssd.thanos_metric_path(METRICS[0], metrics_dir), "ab") as out_f:
+        out_f.write(b"\x1f\x8b partial window")
+
+    assert run_ssd.collect_thanos_metrics(thanos, now - 120, now, METRICS, metrics_dir, None, resume=True) == []
+
+    for metric in METRICS:
+        metadata = run_ssd.read_thanos_metadata(metric, metrics_dir)
+        assert (metadata["start"], metadata["stop"], metadata["windows"]) == (now - 120, now, 2)
+        assert run_ssd.thanos_metric_path(metric, metrics_dir).stat().st_size == metadata["size"]
+
+        assert [timestamps for labels, timestamps in _saved_series(tmp_path, metric)] == \
+            [pytest.approx([now - 120 + ts for ts in range(121)])] * 2
+
+
+@pytest.mark.parametrize("interrupted", [False, True])
+def test_background_collection_is_stopped(serve, run_ssd, monkeypatch, interrupted):
+    monkeypatch.setattr(run_ssd.query_thanos, "THANOS_URL", serve())
+    monkeypatch.setattr(run_ssd.query_thanos, "THANOS_TOKEN", TOKEN)
+    monkeypatch.setattr(run_ssd, "THANOS_SCRAPE_INTERVAL", 0.001)
+    for name in ("thanos", "thanos_start", "thanos_scraper"):
+        monkeypatch.setattr(run_ssd, name, None)
+
+    collections = []
+    collecting = threading.Event()
+    def save_thanos_metrics(thanos, thanos_start, thanos_stop, verbose=True):
+        collecting.set()
+        # the end of the collection is awaited
+        threading.Event().wait(0.5)
+        collections.append(thanos_stop)
+    monkeypatch.setattr(run_ssd, "save_thanos_metrics", save_thanos_metrics)
+
+    status = types.SimpleNamespace(active=1, succeeded=0, failed=0)
+    job = types.SimpleNamespace(metadata=types.SimpleNamespace(name="run-mlperf"), status=status)
+    pod = types.SimpleNamespace(metadata=types.SimpleNamespace(name="run-mlperf-0abcd"),
+                                status=types.SimpleNamespace(phase="Running"))
+    monkeypatch.setattr(run_ssd, "batchv1", types.SimpleNamespace(
+        list_namespaced_job=lambda **kwargs: types.SimpleNamespace(items=[job]),
+        read_namespaced_job=lambda **kwargs: job))
+
+    def list_namespaced_pod(**kwargs):
+        if collecting.is_set():
+            if interrupted:
+                raise KeyboardInterrupt()
+            status.active, status.succeeded = 0, 1
+        return types.SimpleNamespace(items=[pod])
+    monkeypatch.setattr(run_ssd, "v1", types.SimpleNamespace(list_namespaced_pod=list_namespaced_pod))
+    monkeypatch.setattr(run_ssd.time, "sleep", lambda seconds: collecting.wait(5))
+
+    if interrupted:
+        with pytest.raises(KeyboardInterrupt):
+            run_ssd.await_completion([])
+    else:
+        assert run_ssd.await_completion([])
+
+    assert not run_ssd.thanos_scraper.thread.is_alive()
+    assert collections and collections[0] >= run_ssd.thanos_start
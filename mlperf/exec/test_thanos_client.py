@@ -0,0 +1,110 @@
+import json
+
+import pytest
+
+pytest.importorskip("urllib3")
+pytest.importorskip("yaml")
+
+import fake_thanos
+import thanos_client
+from conftest import TOKEN
+
+
+def _query_range(client, **params):
+    now = client.get("query", query="time()")["data"]["result"][0]
+    return dict(query="DCGM_FI_DEV_POWER_USAGE", start=now - 60, end=now, step=1, **params)
+
+
+def test_get_and_stream(serve):
+    client = thanos_client.ThanosClient(serve(), TOKEN)
+    params = _query_range(client)
+
+    result = client.get("query_range", **params)
+    assert result["status"] == "success"
+    assert len(result["data"]["result"]) == 2
+
+    with client.stream("query_range", **params) as read:
+        text = "".join(iter(lambda: read(7), ""))
+    assert json.loads(text) == result
+
+
+def test_api_errors_are_returned(serve):
+    client = thanos_client.ThanosClient(serve(), TOKEN)
+
+    # bad query: the error response of the API is returned, not raised
+    result = client.get("query_range", query="DCGM_FI_DEV_POWER_USAGE")
+    assert result["status"] == "error"
+    assert result["errorType"] == "bad_data"
+
+    with pytest.raises(thanos_client.ThanosError) as exc_info:
+        with client.stream("query_range", query="DCGM_FI_DEV_POWER_USAGE"):
+            pass
+    assert not isinstance(exc_info.value, thanos_client.ThanosTransientError)
+    assert "HTTP 400" in str(exc_info.value)
+
+
+def test_invalid_token(serve):
+    client = thanos_client.ThanosClient(serve(), "invalid")
+
+    assert client.get("query", query="time()")["errorType"] == "forbidden"
+
+    with pytest.raises(thanos_client.ThanosError, match="HTTP 403"):
+        with client.stream("query", query="time()"):
+            pass
+
+
+def test_transient_errors(serve):
+    client = thanos_client.ThanosClient(serve(error_rate=1), TOKEN)
+
+    with pytest.raises(thanos_client.ThanosTransientError, match="HTTP 503"):
+        client.get("query", query="time()")
+
+    with pytest.raises(thanos_client.ThanosTransientError, match="HTTP 503"):
+        with client.stream("query", query="time()"):
+            pass
+
+
+def test_connection_error():
+    # nothing listens on the port
+    with pytest.raises(thanos_client.ThanosConnectionError):
+        thanos_client.ThanosClient("http://localhost:1", TOKEN).get("query", query="time()")
+
+
+@pytest.mark.parametrize("error_rate", [0, 0.5])
+def test_transient_errors_are_retried(serve, query_thanos, monkeypatch, error_rate):
+    monkeypatch.setattr(query_thanos, "QUERY_ATTEMPTS", 50)
+    thanos = dict(token=TOKEN, client=thanos_client.ThanosClient(serve(error_rate=error_rate), TOKEN))
+
+    assert query_thanos.query_current_ts(thanos) is not None
+
+
+def test_retries_are_bounded(serve, query_thanos, monkeypatch):
+    monkeypatch.setattr(query_thanos, "QUERY_ATTEMPTS", 3)
+    attempts = []
+    client = thanos_client.ThanosClient(serve(error_rate=1), TOKEN)
+    monkeypatch.setattr(client, "get", lambda *args, get=client.get, **kwargs: attempts.append(1) or get(*args, **kwargs))
+
+    with pytest.raises(thanos_client.ThanosTransientError):
+        query_thanos.query_current_ts(dict(token=TOKEN, client=client))
+    assert len(attempts) == 3
+
+
+def test_batches_count_the_series_of_the_whole_window(serve, query_thanos, tmp_path):
+    metrics = ["DCGM_FI_DEV_POWER_USAGE", "DCGM_FI_DEV_GPU_UTIL"]
+    (tmp_path / "metrics").mkdir()
+    for metric in metrics:
+        # the second Pod is gone long before the end of the window
+        result = [dict(metric={"__name__": metric, "exported_pod": f"run-mlperf-{pod}"},
+                       values=[[1700000000 + ts, "1"] for ts in range(0, 1001 if pod == 0 else 101, 10)])
+                  for pod in range(2)]
+        (tmp_path / "metrics" / f"prom_{metric}.json").write_text(
+            json.dumps(dict(status="success", data=dict(resultType="matrix", result=result))))
+
+    fake = fake_thanos.RecordedThanos(tmp_path)
+    thanos = dict(token=TOKEN, client=thanos_client.ThanosClient(serve(fake=fake), TOKEN))
+    metric_size = 2 * 1001 * query_thanos.QUERY_POINT_SIZE
+
+    assert query_thanos.plan_batches(thanos, metrics, 1700000000, 1700001000, metric_size) == \
+        [[metric] for metric in metrics]
+    assert query_thanos.plan_batches(thanos, metrics, 1700000000, 1700001000, 2 * metric_size) == \
+        [metrics]
@@ -0,0 +1,192 @@
+#! /usr/bin/python3
+
+"""HTTP client of the Thanos querier API.
+
+The connections are kept alive in a pool, so that the successive
+queries do not pay the connection and TLS handshake setup. The
+responses are decoded directly from the HTTP body, or streamed.
+
+Usage, eg against fake_thanos.py:
+
+    ./thanos_client.py http://localhost:9090 TOKEN DCGM_FI_DEV_POWER_USAGE
+"""
+
+import sys
+import json
+import time
+import codecs
+import contextlib
+
+import urllib3
+
+DEFAULT_TIMEOUT = 60 # seconds, per query
+DEFAULT_POOL_SIZE = 8 # connections kept alive
+# HTTP statuses of the errors which may not happen again
+# (too many requests, querier overloaded or timed out)
+TRANSIENT_STATUSES = (429, 502, 503, 504)
+
+class ThanosError(Exception):
+    """The Thanos query failed."""
+    pass
+
+class ThanosConnectionError(ThanosError):
+    """The Thanos querier could not be reached."""
+    pass
+
+class ThanosTransientError(ThanosError):
+    """The Thanos query failed, but may succeed if retried (timeout,
+    connection reset, querier overloaded)."""
+    pass
+
+def _http_error(url, e):
+    if isinstance(e, (urllib3.exceptions.ReadTimeoutError, urllib3.exceptions.ProtocolError)):
+        return ThanosTransientError(f"{url}: {e.__class__.__name__}: {e}")
+
+    return ThanosError(f"{url}: {e.__class__.__name__}: {e}")
+
+def _status_error(url, resp, error):
+    error_class = ThanosTransientError if resp.status in TRANSIENT_STATUSES else ThanosError
+
+    return error_class(f"{url}: HTTP {resp.status} {resp.reason}, {error}")
+
+def parse_verify(value):
+    """Parses the TLS verification setting: '0' or 'false' to disable
+    it, '1' or 'true' to verify with the system CA bundle, or the path
+    of a CA bundle."""
+
+    if value.lower() in ("", "0", "false", "no"):
+        return False
+    if value.lower() in ("1", "true", "yes"):
+        return True
+
+    return value
+
+class ThanosClient():
+    def __init__(self, url, token, verify=False, timeout=DEFAULT_TIMEOUT, pool_size=DEFAULT_POOL_SIZE):
+        """
+        url: the base URL of the Thanos querier, eg https://<route host>
+        token: the bearer token of the requests
+        verify: the TLS verification setting, see parse_verify
+        """
+        self.url = url.rstrip("/")
+        self.timeout = timeout
+
+        self.headers = urllib3.make_headers(accept_encoding=True)
+        self.headers["Accept"] = "application/json"
+        if token:
+            self.headers["Authorization"] = f"Bearer {token}"
+
+        tls_kwargs = dict(cert_reqs="CERT_REQUIRED" if verify else "CERT_NONE")
+        if isinstance(verify, str):
+            tls_kwargs["ca_certs"] = verify
+        if verify is False:
+            # same as curl -k, the route certificate is usually self-signed
+            urllib3.disable_warnings(urllib3.exceptions.InsecureRequestWarning)
+
+        self.pool = urllib3.PoolManager(num_pools=1, maxsize=pool_size, block=True,
+                                        retries=False, **tls_kwargs)
+
+    def _request(self, url, timeout, preload_content, params):
+        try:
+            return self.pool.request("GET", url, fields=params, headers=self.headers,
+                                     timeout=urllib3.Timeout(total=timeout or self.timeout),
+                                     preload_content=preload_content)
+        except (urllib3.exceptions.NewConnectionError,
+                urllib3.exceptions.ConnectTimeoutError,
+                urllib3.exceptions.SSLError) as e:
+            raise ThanosConnectionError(f"{url}: {e}") from e
+        except urllib3.exceptions.HTTPError as e:
+            raise _http_error(url, e) from e
+
+    def get(self, api_cmd, timeout=None, **params):
+        """Sends a GET request to /api/v1/<api_cmd> and returns the decoded
+        JSON response.
+
+        Raises ThanosConnectionError if the querier cannot be reached,
+        ThanosTransientError if the query may succeed if retried, and
+        ThanosError if the response is not JSON.
+        """
+
+        url = f"{self.url}/api/v1/{api_cmd}"
+        resp = self._request(url, timeout, True, params)
+
+        if resp.status in TRANSIENT_STATUSES:
+            raise _status_error(url, resp, resp.data[:200].decode(errors="replace"))
+
+        try:
+            # the API errors (bad query, ...) are returned as JSON too
+            return json.loads(resp.data)
+        except ValueError:
+            raise _status_error(url, resp, "invalid JSON response")
+
+    @contextlib.contextmanager
+    def stream(self, api_cmd, timeout=None, **params):
+        """Sends a GET request to /api/v1/<api_cmd> and yields a read(size)
+        function returning the next decoded text of the successful
+        response, without loading it in memory.
+
+        Raises ThanosConnectionError if the querier cannot be reached,
+        ThanosTransientError if the query may succeed if retried, and
+        ThanosError if the query failed.
+        """
+
+        url = f"{self.url}/api/v1/{api_cmd}"
+        resp = self._request(url, timeout, False, params)
+        try:
+            if resp.status != 200:
+                # the API errors (bad query, ...) are small JSON documents
+                try:
+                    error = json.loads(resp.read())["error"]
+                except (ValueError, KeyError):
+                    error = "invalid JSON response"
+                raise _status_error(url, resp, error)
+
+            decoder = codecs.getincrementaldecoder("utf-8")()
+
+            def read(size):
+                try:
+                    data = resp.read(size)
+                except urllib3.exceptions.HTTPError as e:
+                    raise _http_error(url, e) from e
+
+                return decoder.decode(data, final=not data)
+
+            yield read
+        except BaseException:
+            # the rest of the body is not read, do not reuse the connection
+            resp.close()
+            raise
+        finally:
+            resp.release_conn()
+
+    def close(self):
+        self.pool.clear()
+
+if __name__ == "__main__":
+    if len(sys.argv) != 4:
+        print(f"Usage: {sys.argv[0]} URL TOKEN QUERY")
+        sys.exit(1)
+
+    url, token, query = sys.argv[1:]
+    client = ThanosClient(url, token)
+
+    result = client.get("query", query="time()")
+    if result["status"] != "success":
+        print(f"Query failed: {result}")
+        sys.exit(1)
+
+    # scalar result: [ts, "value"]
+    ts_stop = result["data"]["result"][0]
+    ts_start = ts_stop - 600
+
+    start = time.time()
+    result = client.get("query_range", query=query, start=ts_start, end=ts_stop, step=1)
+    elapsed = time.time() - start
+
+    if result["status"] != "success":
+        print(f"Query failed: {result}")
+        sys.exit(1)
+
+    series = result["data"]["result"]
+    print(f"Found {len(series)} series, {sum(len(s['values']) for s in series)} values "
+          f"for '{query}' in {elapsed:.3f}s")
@@ -0,0 +1,205 @@
+"""Opt-in instrumentation of the parsing of the workload stores.
+
+Set MATBENCH_PARSE_PROFILE to the path of a report file (.json or .csv)
+to enable it. For each parsed directory, the wall time, the number of
+files opened, the bytes read (size of the files opened) and the time
+spent in each parsing step are recorded. At the end of the parsing,
+`report()` prints a summary sorted by wall time and saves the report
+file.
+
+Usage in a store (imported as `import mlperf.parse_profiling as
+parse_profiling`, or `from . import parse_profiling` in the mlperf store):
+
+    with parse_profiling.directory(dirname):
+        with parse_profiling.open_file(dirname / "file.log") as f:
+            with parse_profiling.step("log_scan"):
+                ...
+        with parse_profiling.step("matrix_insert"):
+            fn_add_to_matrix(results)
+    ...
+    parse_profiling.report()
+
+The time spent in a directory outside of any step is accounted as
+'other'. Nested steps are exclusive: the time of the inner step is not
+accounted in the outer one.
+"""
+
+import os
+import csv
+import json
+import time
+import contextlib
+from collections import defaultdict
+
+REPORT_PATH = os.environ.get("MATBENCH_PARSE_PROFILE")
+ENABLED = bool(REPORT_PATH)
+
+SUMMARY_LENGTH = 20 # number of directories printed in the summary
+
+class DirectoryRecord():
+    def __init__(self, dirname):
+        self.dirname = str(dirname)
+        self.wall_time = 0
+        self.files_opened = 0
+        self.bytes_read = 0
+        self.steps = defaultdict(float)
+
+        self._step = None
+        self._step_start = None
+
+    def to_dict(self):
+        return dict(dirname=self.dirname,
+                    wall_time=self.wall_time,
+                    files_opened=self.files_opened,
+                    bytes_read=self.bytes_read,
+                    steps=dict(self.steps))
+
+records = {}
+_current = None
+
+def _switch_step(name):
+    # charge the time elapsed since the last switch to the current step
+    now = time.perf_counter()
+    record = _current
+    prev_step = record._step
+    if prev_step is not None:
+        record.steps[prev_step] += now - record._step_start
+
+    record._step = name
+    record._step_start = now
+
+    return prev_step
+
+@contextlib.contextmanager
+def directory(dirname):
+    """Records the parsing of a directory.
+
+    Entering the same directory again accumulates into the same record.
+    """
+    global _current
+    if not ENABLED:
+        yield None
+        return
+
+    prev_record = _current
+    record = records.get(str(dirname))
+    if record is None:
+        record = records[str(dirname)] = DirectoryRecord(dirname)
+
+    _current = record
+    start = time.perf_counter()
+    _switch_step("other")
+    try:
+        yield record
+    finally:
+        _switch_step(None)
+        record.wall_time += time.perf_counter() - start
+        _current = prev_record
+
+@contextlib.contextmanager
+def step(name):
+    """Accounts the time spent in the block to the `name` step."""
+    if not ENABLED or _current is None:
+        yield
+        return
+
+    prev_step = _switch_step(name)
+    try:
+        yield
+    finally:
+        _switch_step(prev_step)
+
+def timed(fct, name):
+    """Returns a version of `fct` accounted to the `name` step.
+
+    Returns `fct` itself when the instrumentation is disabled.
+    """
+    if not ENABLED:
+        return fct
+
+    def timed_fct(*args, **kwargs):
+        with step(name):
+            return fct(*args, **kwargs)
+
+    return timed_fct
+
+def count_file(path, size=None):
+    """Accounts a file read by other means than open_file.
+
+    size: the number of bytes read, when the file was not read entirely
+    """
+    if not ENABLED or _current is None:
+        return
+
+    _current.files_opened += 1
+    if size is not None:
+        _current.bytes_read += size
+        return
+
+    try:
+        _current.bytes_read += os.path.getsize(path)
+    except OSError:
+        pass
+
+def open_file(path, *args, **kwargs):
+    """Opens a file, like `open`, and accounts it to the current directory."""
+    f = open(path, *args, **kwargs)
+    count_file(path)
+
+    return f
+
+def add_record(record):
+    """Merges a record collected in another process (eg, a worker pool)."""
+    if not ENABLED or record is None:
+        return
+
+    records[record.dirname] = record
+
+def report():
+    if not ENABLED:
+        return
+
+    if not records:
+        print("INFO: parse profiling: no directory parsed.")
+        return
+
+    sorted_records = sorted(records.values(), key=lambda rec: rec.wall_time, reverse=True)
+
+    total_steps = defaultdict(float)
+    for record in sorted_records:
+        for name, duration in record.steps.items():
+            total_steps[name] += duration
+
+    total_time = sum(rec.wall_time for rec in sorted_records)
+    total_bytes = sum(rec.bytes_read for rec in sorted_records)
+    total_files = sum(rec.files_opened for rec in sorted_records)
+
+    print("---")
+    print(f"Parse profiling: {len(sorted_records)} directories parsed in {total_time:.2f}s, "
+          f"{total_files} files opened, {total_bytes/1024/1024:.1f} MiB read.")
+    print("Time per step: " + ", ".join(f"{name}={duration:.2f}s" for name, duration in
+                                        sorted(total_steps.items(), key=lambda kv: kv[1], reverse=True)))
+    print(f"Slowest directories:")
+    for record in sorted_records[:SUMMARY_LENGTH]:
+        steps = ", ".join(f"{name}={duration:.3f}s" for name, duration in sorted(record.steps.items()))
+        print(f"- {record.wall_time:.3f}s | {record.files_opened} files | "
+              f"{record.bytes_read/1024/1024:.1f} MiB | {steps} | {record.dirname}")
+    print("---")
+
+    try:
+        if REPORT_PATH.endswith(".csv"):
+            step_names = sorted(total_steps)
+            with open(REPORT_PATH, "w", newline="") as out_f:
+                writer = csv.writer(out_f)
+                writer.writerow(["dirname", "wall_time", "files_opened", "bytes_read"] + step_names)
+                for record in sorted_records:
+                    writer.writerow([record.dirname, record.wall_time, record.files_opened, record.bytes_read]
+                                    + [record.steps.get(name, 0) for name in step_names])
+        else:
+            with open(REPORT_PATH, "w") as out_f:
+                json.dump([record.to_dict() for record in sorted_records], out_f, indent=2)
+    except OSError as e:
+        print(f"WARNING: failed to save the parse profiling report into '{REPORT_PATH}': {e}")
+        return
+
+    print(f"Parse profiling report saved into '{REPORT_PATH}'.")
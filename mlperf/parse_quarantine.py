@@ -0,0 +1,243 @@
+#! /usr/bin/env python3
+
+"""Persistent index of the result directories that could not be parsed.
+
+When a workload store rejects a directory (no logs, OOM, no result
+generated, ...), it records it with `quarantine(dirname, reason)`,
+along with a fingerprint of the files the store reads. On the next
+imports, `check(dirname)` returns the reason without re-reading the
+directory, until one of these files changes.
+
+The index is saved by `report()` at the end of the parsing, into
+MATBENCH_PARSE_QUARANTINE_INDEX, or by default into
+'<results_dirname>/.matbench_quarantine.json'. Set
+MATBENCH_PARSE_QUARANTINE=0 to disable it.
+
+Usage in a workload store, with the glob patterns of the files it
+reads (all the files of the directory tree by default):
+
+    reason = parse_quarantine.check(dirname, PATTERNS)
+    if reason is not None:
+        return # rejected by a previous import
+    ...
+    if not results:
+        parse_quarantine.quarantine(dirname, "no result generated", PATTERNS)
+        return
+    ...
+    parse_quarantine.report()
+
+The module is part of the mlperf package (`from . import
+parse_quarantine`), and `import mlperf.parse_quarantine` from the
+other workloads.
+
+Usage from the command line, to list the quarantined directories:
+
+    ./mlperf/parse_quarantine.py [--clear] RESULTS_DIR|INDEX_FILE
+"""
+
+import os
+import sys
+import json
+import time
+import hashlib
+import pathlib
+
+ENABLED = os.environ.get("MATBENCH_PARSE_QUARANTINE", "1") != "0"
+INDEX_PATH = os.environ.get("MATBENCH_PARSE_QUARANTINE_INDEX")
+INDEX_FILENAME = ".matbench_quarantine.json"
+# bump this version when the content of the index changes
+INDEX_VERSION = 2
+
+_index = None # dirname -> dict(reason=, fingerprint=, date=)
+_index_path = None
+_modified = False
+
+skipped = {} # dirname -> reason, of the directories skipped by this import
+added = {} # dirname -> entry, of the directories quarantined by this import
+
+def _key(dirname):
+    return str(pathlib.Path(dirname).resolve())
+
+def _default_index_path():
+    if INDEX_PATH:
+        return pathlib.Path(INDEX_PATH)
+
+    import matrix_benchmarking.cli_args as cli_args
+    results_dirname = cli_args.kwargs.get("results_dirname")
+    if not results_dirname:
+        return None
+
+    return pathlib.Path(results_dirname) / INDEX_FILENAME
+
+def _read_index(path):
+    try:
+        with open(path) as f:
+            content = json.load(f)
+    except FileNotFoundError:
+        return {}
+    except (OSError, ValueError) as e:
+        print(f"WARNING: failed to read the parse quarantine index '{path}': {e}")
+        return {}
+
+    if content.get("version") != INDEX_VERSION:
+        return {}
+
+    return content["directories"]
+
+def _get_index():
+    global _index, _index_path
+    if _index is None:
+        _index_path = _default_index_path()
+        _index = _read_index(_index_path) if _index_path else {}
+
+    return _index
+
+def _iter_files(dirname, patterns):
+    dirname = pathlib.Path(dirname)
+    if patterns is None:
+        for this_dir, directories, files in os.walk(dirname):
+            # the hidden files are the caches of the stores
+            directories[:] = [d for d in directories if not d.startswith(".")]
+            for fname in files:
+                if fname.startswith("."): continue
+                yield pathlib.Path(this_dir) / fname
+        return
+
+    for pattern in patterns:
+        yield from dirname.glob(pattern)
+
+def fingerprint(dirname, patterns=None):
+    """Returns a digest of the relative paths, sizes and mtimes of the
+    files of a directory.
+
+    patterns: the glob patterns of the files read by the store,
+    relative to the directory ('**' matches the sub-directories), or
+    None for all the files of the directory tree, except the hidden
+    ones.
+    """
+    entries = set()
+    for path in _iter_files(dirname, patterns):
+        if not path.is_file(): continue
+        stat = path.stat()
+        entries.add((str(path.relative_to(dirname)), stat.st_size, stat.st_mtime_ns))
+
+    return hashlib.sha1(json.dumps(sorted(entries)).encode()).hexdigest()
+
+def check(dirname, patterns=None):
+    """Returns the reason why the directory is quarantined, or None.
+
+    A quarantined directory whose files (see fingerprint) changed is
+    released.
+    """
+    global _modified
+    if not ENABLED:
+        return None
+
+    index = _get_index()
+    key = _key(dirname)
+    entry = index.get(key)
+    if entry is None:
+        return None
+
+    try:
+        current_fingerprint = fingerprint(dirname, patterns)
+    except OSError:
+        current_fingerprint = None
+
+    if entry["fingerprint"] != current_fingerprint:
+        del index[key]
+        _modified = True
+        return None
+
+    skipped[key] = entry["reason"]
+
+    return entry["reason"]
+
+def quarantine(dirname, reason, patterns=None):
+    """Records that the directory could not be parsed, for `reason`.
+
+    patterns: the files read by the store, see fingerprint.
+    """
+    if not ENABLED:
+        return
+
+    try:
+        entry = dict(reason=reason, fingerprint=fingerprint(dirname, patterns),
+                     date=time.strftime("%Y-%m-%d %H:%M:%S"))
+    except OSError:
+        return
+
+    add_entry(dirname, entry)
+
+def added_entry(dirname):
+    """Returns the entry of a directory quarantined by this import, or None."""
+    return added.get(_key(dirname))
+
+def add_entry(dirname, entry):
+    """Merges an entry recorded in another process (eg, a worker pool)."""
+    global _modified
+    if not ENABLED or entry is None:
+        return
+
+    key = _key(dirname)
+    _get_index()[key] = added[key] = entry
+    _modified = True
+
+def _save():
+    if not _modified or not _index_path:
+        return
+
+    tmp_path = _index_path.with_name(_index_path.name + ".tmp")
+    try:
+        with open(tmp_path, "w") as f:
+            json.dump(dict(version=INDEX_VERSION, directories=_index), f, indent=1, sort_keys=True)
+        os.replace(tmp_path, _index_path)
+    except OSError as e:
+        print(f"WARNING: failed to save the parse quarantine index into '{_index_path}': {e}")
+
+def report():
+    """Saves the index and prints a summary of the quarantined directories."""
+    if not ENABLED or _index is None:
+        return
+
+    _save()
+
+    if not (skipped or added):
+        return
+
+    print("---")
+    print(f"Parse quarantine: {len(skipped)} directories skipped, "
+          f"{len(added)} directories quarantined, {len(_index)} in '{_index_path}'.")
+    for dirname, entry in sorted(added.items()):
+        print(f"- {entry['reason']} | {dirname}")
+    print(f"Run '{pathlib.Path(__file__).resolve()} {_index_path}' to list all of them.")
+    print("---")
+
+def main():
+    args = sys.argv[1:]
+    clear = "--clear" in args
+    if clear:
+        args.remove("--clear")
+
+    if len(args) != 1:
+        print(f"Usage: {sys.argv[0]} [--clear] RESULTS_DIR|INDEX_FILE")
+        return 1
+
+    path = pathlib.Path(args[0])
+    if path.is_dir():
+        path = path / INDEX_FILENAME
+
+    index = _read_index(path)
+    for dirname, entry in sorted(index.items(), key=lambda kv: (kv[1]["reason"], kv[0])):
+        print(f"{entry['date']} | {entry['reason']} | {dirname}")
+
+    print(f"{len(index)} directories quarantined in '{path}'.")
+
+    if clear and path.exists():
+        path.unlink()
+        print(f"'{path}' removed.")
+
+    return 0
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -13,15 +13,26 @@ def register():
     table_stats.TableStats.ValueDev("exec_time", "Execution Time",
                                     lambda entry: entry.results.exec_time,
                                     ".2f", "minutes", divisor=60, higher_better=False)
+    table_stats.TableStats.ValueDev("time_to_threshold", "Time to threshold",
+                                    time_to_threshold.entry_time_to_threshold,
+                                    ".2f", "minutes", higher_better=False)
+    table_stats.TableStats.ValueDev("joules_to_threshold", "Energy to threshold",
+                                    time_to_threshold.entry_joules_to_threshold,
+                                    ".2f", "kJ", divisor=1000, higher_better=False)
+    table_stats.TableStats.ValueDev("samples_per_joule", "Samples per joule",
+                                    time_to_threshold.entry_samples_per_joule,
+                                    ".2f", "samples / J", higher_better=True)
     directories.Directories()
     time_to_threshold.Plot()
 
     time_to_threshold.MigThresholdOverTime()
     time_to_threshold.MigTimeToThreshold()
     time_to_threshold.MigTimeToThreshold(speed=True)
+    time_to_threshold.MigTimeToThreshold(energy=True)
 
     time_to_threshold.MigTimeToThreshold("full", full_gpu_isolation=True)
     time_to_threshold.MigTimeToThreshold("full", full_gpu_isolation=True, speed=True)
+    time_to_threshold.MigTimeToThreshold("full", energy=True)
 
     for mig_type in ["full", "7g.40gb"]: # "1g.5gb", "2g.10gb", "3g.20gb",
         time_to_threshold.MigThresholdOverTime(mig_type)
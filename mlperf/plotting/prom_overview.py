@@ -1,3 +1,4 @@
+import numpy as np
 import plotly.graph_objs as go
 
 import matrix_benchmarking.plotting.table_stats as table_stats
@@ -18,6 +19,13 @@ class Plot():
     def do_plot(self, ordered_vars, params, param_lists, variables, cfg):
         fig = go.Figure()
 
+        # roughly the number of pixels of the plot width
+        cfg__max_points = int(cfg.get('prom_overview.max_points', 2000))
+        # 'start,stop' time window to plot, in minutes
+        cfg__window = cfg.get('prom_overview.window', "")
+        # the UI and URL settings are strings, eg 'false' or '0'
+        cfg__show_minmax = str(cfg.get('prom_overview.minmax', False)).lower() in ("1", "true", "yes", "on")
+
         plot_title = f"Prometheus: {self.metric} (overview)"
         y_max = 0
         x_start = None
@@ -26,31 +34,62 @@ class Plot():
             try: prom = entry.results.prom
             except AttributeError: continue
 
-            for target, records in prom[self.metric].items():
+            for target, series in prom[self.metric].items():
+                if not len(series): continue
+
                 if x_start is None:
-                    x_start = records[0][0]
+                    x_start = series.ts[0]
                 else:
-                    x_start = min([x_start, records[0][0]])
+                    x_start = min([x_start, series.ts[0]])
+
+        window_start = window_stop = None
+        if cfg__window and x_start is not None:
+            try:
+                start, stop = cfg__window.split(",")
+                window_start = x_start + float(start) * 60
+                window_stop = x_start + float(stop) * 60
+            except ValueError:
+                print(f"WARNING: Could not parse 'prom_overview.window={cfg__window}',"
+                      " ignoring it. Expecting =START,STOP (in minutes)")
 
         for entry in Matrix.all_records(params, param_lists):
             try: prom = entry.results.prom
             except AttributeError: continue
 
-            for target, records in sorted(prom[self.metric].items()):
+            for target, series in sorted(prom[self.metric].items()):
+                if not len(series): continue
+
                 name_key = "_".join(f"{k}={params[k]}" for k in ordered_vars)
                 name = f"{name_key} | {target}"
 
-                x = [(rec[0]-x_start)/60 for rec in records]
-                y = [rec[1]*100 for rec in records]
-                y_max = max([y_max]+y)
+                ts, mean_values, min_values, max_values = \
+                    series.select(cfg__max_points, window_start, window_stop)
+                if not len(ts): continue
+
+                x = (ts - x_start) / 60
+                y = mean_values * 100
+                y_max = max(y_max, np.nanmax(max_values * 100))
 
                 trace = go.Scatter(x=x, y=y,
                                    name=name,
+                                   legendgroup=name,
                                    hoverlabel= {'namelength' :-1},
                                    showlegend=True,
                                    mode='lines')
                 fig.add_trace(trace)
 
+                if cfg__show_minmax and min_values is not mean_values:
+                    trace = go.Scatter(x=np.concatenate((x, x[::-1])),
+                                       y=np.concatenate((max_values, min_values[::-1])) * 100,
+                                       fill='toself',
+                                       opacity=0.2,
+                                       line=dict(color='rgba(255,255,255,0)'),
+                                       hoverinfo="skip",
+                                       name=name + " (min/max)",
+                                       legendgroup=name,
+                                       showlegend=False)
+                    fig.add_trace(trace)
+
         fig.update_layout(
             title=plot_title, title_x=0.5,
             yaxis=dict(title=self.y_title, range=[0, y_max*1.05]),
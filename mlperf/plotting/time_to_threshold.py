@@ -1,5 +1,6 @@
-from collections import defaultdict
+from collections import defaultdict, Counter
 import statistics as stats
+import math
 
 import plotly.graph_objs as go
 from dash import html
@@ -8,6 +9,58 @@ import matrix_benchmarking.plotting.table_stats as table_stats
 from matrix_benchmarking.common import Matrix
 from matrix_benchmarking.plotting import COLORS
 
+def entry_time_to_threshold(entry):
+    """Returns the time (in minutes) each GPU of the entry took to reach
+    the entry's threshold setting."""
+    index = entry.results.threshold_index
+    times = index.time_to_threshold([float(entry.settings.threshold)])[:, 0] / 1000 / 60
+
+    return {name: time for name, time in zip(index.names, times) if not math.isnan(time)}
+
+def entry_joules_to_threshold(entry, threshold=None):
+    """Returns the energy (in J) consumed by the GPUs of the entry until
+    each of its GPUs reached the threshold (by default, the entry's
+    threshold setting).
+
+    Each training is accounted the energy share of its pod (see
+    RunEnergy.pods), divided by the number of trainings of the pod.
+    """
+    energy = entry.results.energy
+    if energy is None:
+        return {}
+
+    if threshold is None:
+        threshold = float(entry.settings.threshold)
+
+    index = entry.results.threshold_index
+    times = index.time_to_threshold([threshold])[:, 0]
+    pod_names = [name.partition(" | ")[0] for name in index.names]
+    pod_trainings = Counter(pod_names)
+
+    joules = {}
+    for name, pod_name, start, time in zip(index.names, pod_names, index.starts, times):
+        if math.isnan(time) or pod_name not in energy.pods: continue
+
+        joules[name] = float(energy.joules_at(start + time, pod_name)) / pod_trainings[pod_name]
+
+    return joules
+
+def entry_samples_per_joule(entry):
+    """Returns the number of samples processed per J of energy consumed
+    by the GPUs of the entry, for each of its GPUs.
+
+    Each GPU is accounted its share of the average power of the run, so
+    that the mean of the values is the samples per J of the whole run.
+    """
+    energy = entry.results.energy
+    avg_sample_sec = entry.results.avg_sample_sec
+    if energy is None or not energy.total or not avg_sample_sec:
+        return {}
+
+    avg_power = energy.total / energy.duration
+
+    return {name: speed * len(avg_sample_sec) / avg_power for name, speed in avg_sample_sec.items()}
+
 # https://plotly.com/python/marker-style/#custom-marker-symbols
 SYMBOLS = [
     "circle",
@@ -270,12 +323,13 @@ class MigThresholdOverTime():
         return fig, ""
 
 class MigTimeToThreshold():
-    def __init__(self, mig_type=None, speed=False, full_gpu_isolation=False):
+    def __init__(self, mig_type=None, speed=False, full_gpu_isolation=False, energy=False):
         self.mig_type = mig_type
         self.full_gpu_isolation = full_gpu_isolation
         self.multi_gpu = self.mig_type == "full"
 
         self.speed = speed
+        self.energy = energy
         self.name = "MIG"
 
         if self.multi_gpu:
@@ -289,6 +343,8 @@ class MigTimeToThreshold():
 
         if self.speed:
             self.name += " processing speed"
+        elif self.energy:
+            self.name += " energy to threshold"
         else:
             self.name += " time to threshold"
 
@@ -303,6 +359,16 @@ class MigTimeToThreshold():
         fig = go.Figure()
         plot_title = "MIG"
         threshold = settings['threshold']
+
+        # target accuracy of the time to threshold, or 'setting' for the
+        # threshold setting. By default, the last logged threshold is used.
+        cfg__target = cfg.get('time_to_threshold.target', None)
+        if cfg__target == "setting":
+            cfg__target = float(threshold)
+        elif cfg__target is not None:
+            cfg__target = float(cfg__target)
+            threshold = cfg__target
+
         if self.multi_gpu:
             plot_title = "GPU Isolation" if self.full_gpu_isolation else "Multi-GPU"
 
@@ -314,6 +380,8 @@ class MigTimeToThreshold():
         plot_title += ": "
         if self.speed:
             plot_title += "Processing speed"
+        elif self.energy:
+            plot_title += f"Energy to {threshold} threshold"
         else:
             plot_title += f"Time to {threshold} threshold"
 
@@ -330,6 +398,8 @@ class MigTimeToThreshold():
 
         plot_values = defaultdict(list)
         x_names = {}
+        # (x_value, threshold_index) of the entries, looked up all at once
+        target_indexes = []
         for entry in entries:
             def add_plot(an_entry):
                 gpu_name = gpu_full_name = an_entry.settings.gpu_type
@@ -364,6 +434,12 @@ class MigTimeToThreshold():
                 if self.speed:
                     for mig_name, speed in an_entry.results.avg_sample_sec.items():
                         plot_values[x_value].append(speed)
+                elif self.energy:
+                    joules = entry_joules_to_threshold(an_entry, cfg__target)
+                    if not joules: return
+                    plot_values[x_value] += [value / 1000 for value in joules.values()]
+                elif cfg__target is not None:
+                    target_indexes.append((x_value, an_entry.results.threshold_index))
                 else:
                     for log_filename, values in an_entry.results.thresholds.items():
                         ts = [xy[1]/1000/60 for xy in values]
@@ -380,6 +456,15 @@ class MigTimeToThreshold():
             else:
                 add_plot(entry)
 
+        if target_indexes:
+            first_index = target_indexes[0][1]
+            index, owners = first_index.concat([index for _, index in target_indexes])
+            times = index.time_to_threshold([cfg__target])[:, 0] / 1000 / 60
+
+            for owner, time in zip(owners, times):
+                if math.isnan(time): continue
+                plot_values[target_indexes[owner][0]].append(time)
+
         y_means = [stats.mean(y_values) for y_values in plot_values.values()]
         if not y_means:
             return go.Figure(layout=go.Layout(
@@ -388,9 +473,14 @@ class MigTimeToThreshold():
 
         if self.mig_type or self.full_gpu_isolation:
             y_mean_ref = y_means[0] #max(y_means) if self.speed else min(y_means)
+        elif self.energy:
+            # energy of the smallest number of GPUs
+            y_mean_ref = stats.mean(plot_values[min(plot_values)])
         else:
             y_mean_ref = min(y_means) if self.speed else max(y_means)
 
+        ref_name = "speed" if self.speed else ("energy" if self.energy else "time")
+
         x = sorted(plot_values.keys())
         y = [stats.mean(plot_values[x_value]) for x_value in x]
         y_err = [(stats.stdev(plot_values[x_value]) if len(plot_values[x_value]) >= 2 else None) for x_value in x]
@@ -402,7 +492,7 @@ class MigTimeToThreshold():
         if self.mig_type or self.full_gpu_isolation:
             x_names = [f"{x_value} instance{'s' if int(x_value) > 1 else ''}: " +
                        (f"{xy_slowdown[x_value]:.2f}x "
-                        f"{'speed' if self.speed else 'slower'}" if x_value != x[0] else f"reference {'speed' if self.speed else 'time'}")
+                        f"{'speed' if self.speed else ('efficiency' if self.energy else 'slower')}" if x_value != x[0] else f"reference {ref_name}")
                         for x_value in x]
 
             x_baseline = [-100, x[-1], 100]
@@ -414,12 +504,12 @@ class MigTimeToThreshold():
                 textposition = "top right"
 
             baseline_text = [None for _ in x_baseline]
-            baseline_text[-2] = "        Reference " + ("speed" if self.speed else "time")
+            baseline_text[-2] = "        Reference " + ref_name
             baseline_textposition = "top right"
         else:
             x_names = [f"{x_names[x_value]}: " +
                        (f"{xy_slowdown[x_value]:.2f}x "
-                        f"{'speed' if self.speed else 'faster'}" if x_value != x[0] else f"reference {'speed' if self.speed else 'time'}")
+                        f"{'speed' if self.speed else ('efficiency' if self.energy else 'faster')}" if x_value != x[0] else f"reference {ref_name}")
 
                        for x_value in x]
             if self.speed:
@@ -433,6 +523,11 @@ class MigTimeToThreshold():
                 y_baseline = [y_mean_ref * x_value for x_value in x_baseline]
                 #baseline_text[4] = "Perfect scaling"
                 baseline_textposition = "bottom right"
+            elif self.energy:
+                # the same energy, whatever the number of GPUs
+                y_baseline = [y_mean_ref for _ in x_baseline]
+                baseline_text[-1] = "Perfect scaling"
+                baseline_textposition = "top center"
             else:
                 y_baseline = [y_mean_ref / x_value for x_value in x_baseline]
                 baseline_text[-1] = "Perfect scaling"
@@ -467,7 +562,8 @@ class MigTimeToThreshold():
         fig.update_layout(
             showlegend=False,
             yaxis=dict(
-                title='Avg Samples / sec, higher is better' if self.speed else "Time (in min), lower is better",
+                title='Avg Samples / sec, higher is better' if self.speed else \
+                    ("Energy (in kJ), lower is better" if self.energy else "Time (in min), lower is better"),
                 range=[0, y_max*(1.05 if self.speed else 1.05)],
             ),
             xaxis=dict(
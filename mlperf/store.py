@@ -1,12 +1,82 @@
 import types
 import glob
 import json
+import os
+import pickle
+import hashlib
+import pathlib
+import re
+import io
+import gzip
+import math
+import array
+import time
+import threading
+import contextlib
+import multiprocessing
+import concurrent.futures
+import collections.abc
 from collections import defaultdict
 
+import numpy as np
+
 import matrix_benchmarking.store as store
 import matrix_benchmarking.store.simple as store_simple
 import matrix_benchmarking.cli_args as cli_args
 
+from . import parse_profiling
+from . import parse_quarantine
+from .exec import prom_stream
+
+# set MATBENCH_MLPERF_PARSE_CACHE=0 to disable the parse cache
+PARSE_CACHE_ENABLED = os.environ.get("MATBENCH_MLPERF_PARSE_CACHE", "1") != "0"
+# the cache files are pickled, so they are stored in a directory of the
+# user, not in the result directories (possibly shared with other users)
+PARSE_CACHE_DIR = os.environ.get("MATBENCH_MLPERF_PARSE_CACHE_DIR") or \
+    os.path.join(os.environ.get("XDG_CACHE_HOME") or os.path.expanduser("~/.cache"), "matbench-mlperf")
+# bump this version when the content of the parsed results changes
+PARSE_CACHE_VERSION = 8
+
+# binary sidecar file generated by compact.py
+COMPACT_FILENAME = "mlperf_compact.npz"
+# bump this version when the content of the sidecar file changes
+COMPACT_VERSION = 3
+
+# number of worker processes used to parse the result directories.
+# 1 (default) parses them serially, 0 uses all the CPUs.
+PARSE_WORKERS = int(os.environ.get("MATBENCH_MLPERF_PARSE_WORKERS", "1")) or os.cpu_count()
+# number of worker processes used to parse the pod log files of a
+# directory (eg, MIG runs with 7 pods). Same values as PARSE_WORKERS.
+# Not used when the directories are already parsed by a worker pool.
+POD_WORKERS = int(os.environ.get("MATBENCH_MLPERF_POD_WORKERS", "1")) or os.cpu_count()
+
+# set MATBENCH_MLPERF_SUMMARY_ONLY=1 to only parse the summary of the
+# runs (exec_time, avg. samples / sec), from the tail of the pod logs.
+# The thresholds need all the evaluations since init_start, so they are
+# left empty, unless the tail covers the whole log file. The Prometheus
+# metrics are not parsed.
+SUMMARY_ONLY = os.environ.get("MATBENCH_MLPERF_SUMMARY_ONLY", "0") == "1"
+# initial and maximal size of the tail of the pod logs read in summary
+# mode. When the summary lines are not found in the maximal tail, the
+# whole log file is parsed.
+SUMMARY_TAIL_SIZE = 64 * 1024
+SUMMARY_TAIL_MAX_SIZE = 4 * 1024 * 1024
+
+# the files read to parse a run directory, fingerprinted by parse_quarantine
+QUARANTINE_PATTERNS = ("run-*.log",)
+
+# set MATBENCH_MLPERF_WATCH to a number of seconds to watch the runs
+# still in progress: when visualizing, the lines appended to their pod
+# logs are parsed at this interval, and their results are updated in
+# place. The directories are parsed serially in this mode.
+WATCH_INTERVAL = float(os.environ.get("MATBENCH_MLPERF_WATCH", "0"))
+# a run is not watched anymore when its pod logs were not modified for
+# MATBENCH_MLPERF_WATCH_TIMEOUT seconds (eg, a crashed pod without any
+# result= line)
+WATCH_TIMEOUT = float(os.environ.get("MATBENCH_MLPERF_WATCH_TIMEOUT", "3600"))
+# bytes of a watched pod log read at once
+WATCH_READ_SIZE = 16 * 1024 * 1024
+
 def _rewrite_settings(params_dict):
     params_dict.pop("opts", True)
     if params_dict["gpu_type"] == "full":
@@ -23,132 +93,1451 @@ def _rewrite_settings(params_dict):
     return params_dict
 
 
-def _parse_prom_gpu_metrics(dirname, results):
-    prom = results.prom = defaultdict(lambda: defaultdict(dict))
-    for res_file in glob.glob(f"{dirname}/metrics/prom_*.json"):
-        with open(res_file) as f:
-            data = json.load(f)
+# resolutions (in seconds) of the rollups of the Prometheus series
+PROM_ROLLUP_RESOLUTIONS = (1, 10, 60, 5*60)
+
+
+class PromSeries():
+    """A Prometheus time series, stored as two contiguous float64 arrays.
+
+    ts: the timestamps of the samples (in seconds)
+    values: the values of the samples
+    rollups: list of (resolution, ts, min, max, mean) arrays, from the
+             finest to the coarsest resolution. See build_rollups.
+    device: the physical GPU of the series ('<Hostname> | <UUID>'), or
+            None. The MIG pods sharing a GPU have one series each.
+    """
+    __slots__ = ("ts", "values", "rollups", "device")
 
-        for result_per_gpu in data['result']:
-            try: exported_pod = result_per_gpu["metric"]["exported_pod"]
-            except KeyError: continue
+    def __init__(self, ts, values, device=None):
+        self.ts = ts
+        self.values = values
+        self.rollups = []
+        self.device = device
 
-            if exported_pod not in results.pod_names:
+    def __len__(self):
+        return len(self.ts)
+
+    @staticmethod
+    def from_json_values(values):
+        # vectorized conversion of the [[ts, "value"], ...] JSON list
+        samples = np.array(values, dtype=np.float64).reshape(-1, 2)
+
+        return PromSeries(np.ascontiguousarray(samples[:, 0]),
+                          np.ascontiguousarray(samples[:, 1]))
+
+    @staticmethod
+    def from_json_windows(windows_values):
+        """Converts the JSON values of the successive windows of a
+        series, without the points repeated by overlapping windows."""
+        if len(windows_values) == 1:
+            return PromSeries.from_json_values(windows_values[0])
+
+        windows = [PromSeries.from_json_values(values) for values in windows_values]
+        ts = np.concatenate([window.ts for window in windows])
+        values = np.concatenate([window.values for window in windows])
+
+        # keep the points after all the previous ones
+        keep = np.concatenate(([True], ts[1:] > np.maximum.accumulate(ts)[:-1]))
+
+        return PromSeries(np.ascontiguousarray(ts[keep]), np.ascontiguousarray(values[keep]))
+
+    def build_rollups(self, resolutions=PROM_ROLLUP_RESOLUTIONS):
+        """Computes the min, max and mean of the series over buckets of
+        each resolution. A resolution is skipped if it doesn't at least
+        halve the number of points of the previous level."""
+
+        self.rollups = []
+        if not len(self):
+            return
+
+        prev_length = len(self)
+        for resolution in resolutions:
+            bucket = np.floor((self.ts - self.ts[0]) / resolution)
+            # the timestamps are sorted, so the buckets are contiguous
+            starts = np.concatenate(([0], np.flatnonzero(np.diff(bucket)) + 1))
+            if len(starts) * 2 > prev_length:
                 continue
 
-            if 'gpu' in result_per_gpu['metric']:
-                gpu = result_per_gpu['metric']['gpu']
-                prom_group = f"{exported_pod} | gpu #{gpu} "
-            else:
-                prom_group = "container"
+            counts = np.diff(np.append(starts, len(self)))
+            self.rollups.append((
+                resolution,
+                self.ts[starts],
+                np.minimum.reduceat(self.values, starts),
+                np.maximum.reduceat(self.values, starts),
+                np.add.reduceat(self.values, starts) / counts,
+            ))
+            prev_length = len(starts)
 
-            metric = result_per_gpu['metric']['__name__']
-            values = [[ts, float(val)] for ts, val in result_per_gpu['values']]
+    def select(self, max_points, start=None, stop=None):
+        """Returns the (ts, mean, min, max) arrays of the [start, stop] window.
 
-            prom[metric][prom_group] = values
-        pass
+        The coarsest rollup level with at least max_points points in
+        the window is used (roughly one point per pixel). The raw
+        series is returned when no level is that dense.
+        """
 
+        for resolution, ts, min_values, max_values, mean_values in reversed(self.rollups):
+            first, last = self._window(ts, start, stop)
+            if last - first < max_points: continue
 
-def _parse_pod_logs(dirname, results, pod_logs_f):
-    has_thr020 = {}
-    prev_thr = {}
-    #start_ts = None
-    start_timestamps = {}
+            return (ts[first:last], mean_values[first:last],
+                    min_values[first:last], max_values[first:last])
+
+        first, last = self._window(self.ts, start, stop)
+        values = self.values[first:last]
+
+        return self.ts[first:last], values, values, values
+
+    @staticmethod
+    def _window(ts, start, stop):
+        first = 0 if start is None else np.searchsorted(ts, start, side="left")
+        last = len(ts) if stop is None else np.searchsorted(ts, stop, side="right")
+
+        return first, last
+
+
+PROM_READ_SIZE = 1024 * 1024 # bytes read at once from the Thanos JSON dumps
+
+
+def _open_prom_metric_file(res_file):
+    if not res_file.endswith(".gz"):
+        return parse_profiling.open_file(res_file)
+
+    # the compressed size is accounted, like for the other files
+    parse_profiling.count_file(res_file)
+    return gzip.open(res_file, "rt", encoding="utf-8")
+
+
+def _load_prom_metric_file(res_file, pod_names):
+    def keep(labels):
+        return labels.get("exported_pod") in pod_names
+
+    windows_values = defaultdict(dict) # prom_group -> window index -> values
+    devices = {} # prom_group -> physical GPU
+    with _open_prom_metric_file(res_file) as f, parse_profiling.step("json_decode"):
+        reader = prom_stream.PromStreamReader(f.read, PROM_READ_SIZE)
+        try:
+            for labels, values in reader.iter_series(keep):
+                if values is None or not keep(labels):
+                    continue
+
+                exported_pod = labels["exported_pod"]
+                if 'gpu' in labels:
+                    gpu = labels['gpu']
+                    prom_group = f"{exported_pod} | gpu #{gpu} "
+                    # the UUID is the one of the physical GPU, also with MIG
+                    devices[prom_group] = f"{labels.get('Hostname', '')} | {labels.get('UUID', gpu)}"
+                else:
+                    prom_group = "container"
+
+                # in a window, the last series of the group is kept
+                windows_values[prom_group][reader.window] = values
+        except (ValueError, OSError, EOFError) as e:
+            print(f"WARNING: failed to parse {res_file}: {e}")
+
+    prom_metric = {}
+    for prom_group, values in windows_values.items():
+        series = prom_metric[prom_group] = PromSeries.from_json_windows(list(values.values()))
+        series.device = devices.get(prom_group)
+        series.build_rollups()
+
+    return prom_metric
+
+
+class LazyPromMetrics(collections.abc.Mapping):
+    """Mapping metric name -> {prom_group: PromSeries}.
+
+    Only the list of metric files is recorded at parse time; a metric
+    file is read and decoded the first time the metric is accessed, and
+    kept in memory afterwards. Unknown metrics map to an empty dict.
+
+    metric_files: metric name -> path of its file, relative to dirname,
+                  which is set again when the results are loaded from
+                  the parse cache (see _load_parse_cache)
+    """
+
+    def __init__(self, metric_files, pod_names, dirname=None):
+        self.metric_files = metric_files
+        self.pod_names = pod_names
+        self.dirname = dirname
+        self.loaded = {}
+
+    def __getitem__(self, metric):
+        try: return self.loaded[metric]
+        except KeyError: pass
+
+        if metric not in self.metric_files:
+            return {}
+
+        prom_metric = self.loaded[metric] = self._load(metric)
+
+        return prom_metric
+
+    def _load(self, metric):
+        return _load_prom_metric_file(os.path.join(self.dirname, self.metric_files[metric]),
+                                      self.pod_names)
+
+    def __contains__(self, metric):
+        return metric in self.metric_files
+
+    def __iter__(self):
+        return iter(self.metric_files)
+
+    def __len__(self):
+        return len(self.metric_files)
+
+
+class _CompactPromMetrics(LazyPromMetrics):
+    """LazyPromMetrics reading the series from a compact sidecar file.
+
+    metric_files: metric name -> {prom_group: (ts array key, values array key, device)}
+    """
+
+    def __init__(self, metric_files, pod_names, compact_path):
+        super().__init__(metric_files, pod_names)
+        self.compact_path = compact_path
+
+    def _load(self, metric):
+        prom_metric = {}
+        # np.load only reads the arrays which are accessed
+        parse_profiling.count_file(self.compact_path)
+        with np.load(self.compact_path, allow_pickle=False) as compact:
+            for prom_group, (ts_key, values_key, device) in self.metric_files[metric].items():
+                series = prom_metric[prom_group] = PromSeries(compact[ts_key], compact[values_key], device)
+                series.build_rollups()
+
+        return prom_metric
+
+
+PROM_METRIC_FILE_RE = re.compile(r"^prom_(.*)\.json(\.gz)?$")
+
+def _parse_prom_gpu_metrics(dirname, results):
+    metric_files = {}
+    for res_file in sorted(glob.glob(f"{dirname}/metrics/prom_*.json*")):
+        # eg: prom_DCGM_FI_DEV_POWER_USAGE.json or prom_DCGM_FI_DEV_POWER_USAGE.json.gz
+        # (not the prom_<metric>.meta.json sidecar files)
+        match = PROM_METRIC_FILE_RE.match(res_file.rpartition("/")[-1])
+        if not match or match.group(1).endswith(".meta"): continue
+
+        metric_files[match.group(1)] = os.path.relpath(res_file, dirname)
+
+    results.prom = LazyPromMetrics(metric_files, results.pod_names, str(dirname))
+    results.energy = RunEnergy.from_results(results)
+
+
+# metric of the power usage of the GPUs, in W
+ENERGY_METRIC = "DCGM_FI_DEV_POWER_USAGE"
+
+class RunEnergy():
+    """The energy consumed by the GPUs of a run, integrated once from
+    their power usage over the run window.
+
+    start, stop: the run window (in ms), from the first init_start to
+                 the last MLLOG event
+    ts: the timestamps (in ms) where the energy is known
+    joules: the energy consumed by all the GPUs since `start`, at `ts`
+    pods: pod_name -> the share of `joules` of the pod. The energy of a
+          GPU shared by several (MIG) pods is split evenly between them.
+    """
+    __slots__ = ("start", "stop", "ts", "joules", "pods")
+
+    def __init__(self, start, stop, ts, joules, pods):
+        self.start = start
+        self.stop = stop
+        self.ts = ts
+        self.joules = joules
+        self.pods = pods
+
+    @property
+    def total(self):
+        """Returns the energy (in J) consumed during the whole run."""
+        return float(self.joules[-1])
+
+    @property
+    def duration(self):
+        """Returns the duration (in s) of the run window."""
+        return (self.stop - self.start) / 1000
+
+    def joules_at(self, ts, pod_name=None):
+        """Returns the energy (in J) consumed between `start` and each
+        of the timestamps (in ms), by all the GPUs or by the share of a
+        pod."""
+        return np.interp(ts, self.ts, self.joules if pod_name is None else self.pods[pod_name])
+
+    @staticmethod
+    def from_results(results):
+        """Integrates the power usage of the GPUs of the run, with the
+        trapezoidal rule. Returns None when it is not available.
+
+        The power of a physical GPU is reported once per pod using it
+        (eg, the MIG pods sharing it), so it is integrated once per GPU.
+        """
+
+        # physical GPU -> (its series, the pods sharing it)
+        devices = {}
+        for prom_group, series in sorted(results.prom[ENERGY_METRIC].items()):
+            if prom_group == "container" or len(series) < 2: continue
+
+            pod_name = prom_group.partition(" | ")[0]
+            device = series.device or prom_group
+            devices.setdefault(device, (series, set()))[1].add(pod_name)
+
+        if not devices or "init_start" not in results.mllog_keys:
+            return None
+
+        init_start_id = results.mllog_keys.index("init_start")
+        start = stop = None
+        for pod_events in results.mllog_events.values():
+            for events in pod_events.values():
+                init_ts, _ = events.select(init_start_id)
+                if not len(init_ts): continue
+                start = init_ts.min() if start is None else min(start, init_ts.min())
+                stop = events.ts.max() if stop is None else max(stop, events.ts.max())
+
+        if start is None or stop <= start:
+            return None
+
+        # the cumulative energy of each GPU at its own timestamps
+        cumulative = []
+        for series, pod_names in devices.values():
+            valid = ~np.isnan(series.values)
+            ts, watts = series.ts[valid] * 1000, series.values[valid]
+            joules = np.concatenate(([0], np.cumsum(np.diff(ts) / 1000 * (watts[1:] + watts[:-1]) / 2)))
+            cumulative.append((ts, joules, pod_names))
+
+        all_ts = np.concatenate([ts for ts, _, _ in cumulative] + [[start, stop]])
+        grid = np.unique(all_ts[(all_ts >= start) & (all_ts <= stop)])
+
+        total = np.zeros(len(grid))
+        pods = defaultdict(lambda: np.zeros(len(grid)))
+        for ts, joules, pod_names in cumulative:
+            gpu_joules = np.interp(grid, ts, joules) - np.interp(start, ts, joules)
+            total += gpu_joules
+            for pod_name in pod_names:
+                pods[pod_name] += gpu_joules / len(pod_names)
+
+        return RunEnergy(float(start), float(stop), grid, total, dict(pods))
+
+
+MLLOG_PREFIX = ":::MLLOG "
+
+_decode_mllog_json = parse_profiling.timed(json.loads, "json_decode")
+
+
+class MllogEvents():
+    """The MLLOG events of one GPU, stored as three numpy arrays.
+
+    ts: the time_ms of the events
+    key: the id of the event key, index in results.mllog_keys
+    value: the value of the events, NaN when it is not a number
+    """
+    __slots__ = ("ts", "key", "value")
+
+    def __init__(self, ts, key, value):
+        self.ts = ts
+        self.key = key
+        self.value = value
+
+    def __len__(self):
+        return len(self.ts)
+
+    def select(self, key_id):
+        """Returns the (ts, value) arrays of the events of a given key id."""
+        mask = self.key == key_id
+
+        return self.ts[mask], self.value[mask]
+
+
+class _PodLogParser():
+    """Line-at-a-time parser of a pod log file.
+
+    The parsing state is kept in the object, so that the log file can
+    be streamed instead of being loaded in memory. All the MLLOG events
+    are extracted in a single pass, and the thresholds are derived from
+    them in `finish`.
+    """
+
+    def __init__(self, results, log_name):
+        self.results = results
+        self.log_name = log_name
+
+        # gpu_name -> (ts, key id, value) arrays of the MLLOG events
+        # parsed since the last call to `finish`
+        self.events = {}
+        # gpu_name -> _EventBuffers, all the events saved by `finish`
+        self.event_buffers = {}
+        self.key_ids = {key: key_id for key_id, key in enumerate(results.mllog_keys)}
+        # gpu_name -> _ThresholdState
+        self.threshold_states = {}
+
+    def parse_line(self, line):
+        gpu_name, mllog, payload = line.partition(MLLOG_PREFIX)
+        if mllog:
+            try:
+                json_content = _decode_mllog_json(payload)
+            except json.JSONDecodeError:
+                return # eg, truncated line
+
+            self._parse_mllog(gpu_name or "full_gpu", json_content)
+            return
 
-    for line in pod_logs_f.readlines():
         if "result=" in line:
-            results.exec_time = int(line.split('=')[-1].strip())/60
+            self.results.exec_time = int(line.split('=')[-1].strip())/60
 
         if "avg. samples / sec" in line:
             gpu_name = "single" if not line.startswith("/tmp") else \
                 line.split(":")[0]
 
-            results.avg_sample_sec[gpu_name] = float(line.split("avg. samples / sec: ")[-1].strip())
+            self.results.avg_sample_sec[gpu_name] = float(line.split("avg. samples / sec: ")[-1].strip())
 
-        if '"key": "eval_accuracy"' in line or '"key": "init_start"' in line:
-            MLLOG_PREFIX = ":::MLLOG "
-            if line.startswith(MLLOG_PREFIX):
-                gpu_name = "full_gpu"
-            else:
-                gpu_name = line.partition(MLLOG_PREFIX)[0]
+    def _key_id(self, key):
+        try:
+            return self.key_ids[key]
+        except KeyError:
+            pass
 
-            json_content = json.loads(line.partition(MLLOG_PREFIX)[-1])
-            line_ts = json_content['time_ms']
+        # the key list may be shared with other parsers (see _PodLogWatcher)
+        if key in self.results.mllog_keys:
+            key_id = self.key_ids[key] = self.results.mllog_keys.index(key)
+        else:
+            key_id = self.key_ids[key] = len(self.results.mllog_keys)
+            self.results.mllog_keys.append(key)
 
-            if json_content['key'] == "eval_accuracy":
-                if gpu_name in has_thr020: continue
-                line_threshold = json_content['value']
-                if line_threshold < prev_thr.get(gpu_name, 0): continue
-                prev_thr[gpu_name] = line_threshold
-                try:
-                    threadhold_time = line_ts - start_timestamps[gpu_name]
-                    results.thresholds[gpu_name].append([line_threshold, threadhold_time])
-                    if line_threshold > 0.2: has_thr020[gpu_name] = True
-                except KeyError:
-                    raise Exception(f"gpu_name={gpu_name} didn't start in {pod_logs_f.name}")
+        return key_id
 
-            elif json_content['key'] == "init_start":
-                if gpu_name in start_timestamps:
-                    if gpu_name != "full_gpu":
-                        raise Exception(f"Duplicated gpu_name={gpu_name} found in {pod_logs_f.name}")
-                    else:
-                        # running with in multi-GPU mode,
-                        # keep only the 1st timestamp
-                        continue
+    def _parse_mllog(self, gpu_name, json_content):
+        try:
+            ts, keys, values = self.events[gpu_name]
+        except KeyError:
+            ts, keys, values = self.events[gpu_name] = array.array("d"), array.array("i"), array.array("d")
 
-                start_timestamps[gpu_name] = line_ts
+        value = json_content.get('value')
+        if isinstance(value, bool) or not isinstance(value, (int, float)):
+            value = math.nan
 
-                results.thresholds[gpu_name] = []
+        ts.append(json_content['time_ms'])
+        keys.append(self._key_id(json_content['key']))
+        values.append(value)
 
+    def finish(self, pod_name):
+        """Saves the events into results.mllog_events[pod_name] and
+        derives the thresholds from them.
 
-def _parse_ssd_results(dirname, import_settings):
+        Can be called again after parsing more lines: only the new
+        events are appended to the arrays and used to extend the
+        thresholds.
+        """
+
+        pod_events = self.results.mllog_events.setdefault(pod_name, {})
+        for gpu_name, (ts, keys, values) in self.events.items():
+            if not ts: continue
+
+            try:
+                buffers = self.event_buffers[gpu_name]
+            except KeyError:
+                buffers = self.event_buffers[gpu_name] = _EventBuffers()
+
+            pod_events[gpu_name] = buffers.extend(ts, keys, values)
+            del ts[:], keys[:], values[:]
+
+        self._derive_thresholds(pod_events)
+
+    def _derive_thresholds(self, pod_events):
+        init_start_id = self.key_ids.get("init_start", -1)
+        eval_accuracy_id = self.key_ids.get("eval_accuracy", -1)
+
+        for gpu_name, events in pod_events.items():
+            try:
+                state = self.threshold_states[gpu_name]
+            except KeyError:
+                state = self.threshold_states[gpu_name] = _ThresholdState()
+
+            # only the events not derived yet
+            new_events = slice(state.derived, len(events))
+            state.derived = len(events)
+
+            new_keys = events.key[new_events]
+            mask = (new_keys == init_start_id) | (new_keys == eval_accuracy_id)
+
+            for key_id, line_ts, line_threshold in zip(new_keys[mask].tolist(),
+                                                       events.ts[new_events][mask].tolist(),
+                                                       events.value[new_events][mask].tolist()):
+                if key_id == eval_accuracy_id:
+                    if state.has_thr020: continue
+                    if line_threshold < state.prev_thr: continue
+                    state.prev_thr = line_threshold
+
+                    if state.start_ts is None:
+                        raise Exception(f"gpu_name={gpu_name} didn't start in {self.log_name}")
+
+                    state.thresholds.append([line_threshold, line_ts - state.start_ts])
+                    if line_threshold > 0.2: state.has_thr020 = True
+
+                else: # init_start
+                    if state.start_ts is not None:
+                        if gpu_name != "full_gpu":
+                            raise Exception(f"Duplicated gpu_name={gpu_name} found in {self.log_name}")
+                        else:
+                            # running with in multi-GPU mode,
+                            # keep only the 1st timestamp
+                            continue
+
+                    state.start_ts = line_ts
+                    state.thresholds = self.results.thresholds[gpu_name] = []
+
+
+class _EventBuffers():
+    """Growable arrays of the MLLOG events of a GPU.
+
+    The capacity of the arrays is doubled when they are full, so that
+    appending the events of a watched log costs the size of the new
+    events, not the size of all the events. The MllogEvents returned are
+    views of the arrays: the events already saved are never modified.
+    """
+    __slots__ = ("ts", "key", "value", "length")
+
+    def __init__(self):
+        self.ts = np.empty(0, dtype=np.float64)
+        self.key = np.empty(0, dtype=np.int32)
+        self.value = np.empty(0, dtype=np.float64)
+        self.length = 0
+
+    def extend(self, ts, keys, values):
+        """Appends the events of the (ts, key id, value) arrays, and
+        returns the MllogEvents of all the events."""
+        start, self.length = self.length, self.length + len(ts)
+
+        if self.length > len(self.ts):
+            capacity = max(self.length, 2 * len(self.ts))
+            for name in self.__slots__[:3]:
+                old = getattr(self, name)
+                new = np.empty(capacity, dtype=old.dtype)
+                new[:start] = old[:start]
+                setattr(self, name, new)
+
+        self.ts[start:self.length] = np.frombuffer(ts, dtype=np.float64)
+        self.key[start:self.length] = np.frombuffer(keys, dtype=np.int32)
+        self.value[start:self.length] = np.frombuffer(values, dtype=np.float64)
+
+        return MllogEvents(self.ts[:self.length], self.key[:self.length], self.value[:self.length])
+
+
+class _ThresholdState():
+    """State of the threshold derivation of a GPU, carried across the
+    increments of a pod log."""
+    __slots__ = ("start_ts", "prev_thr", "has_thr020", "thresholds", "derived")
+
+    def __init__(self):
+        self.start_ts = None
+        self.prev_thr = 0
+        self.has_thr020 = False
+        self.thresholds = None
+        # number of events already derived
+        self.derived = 0
+
+
+class ThresholdIndex():
+    """The accuracy curves of the GPUs of one or more runs, indexed for
+    vectorized time-to-threshold lookups.
+
+    names: the name of each curve ('<pod_name> | <gpu_name>')
+    thr, ts: the accuracies and times (in ms since init_start) of all the
+             curves, concatenated. Each curve is sorted by accuracy.
+    offsets: the start of each curve in thr/ts, plus the total length
+    starts: the init_start time (in ms) of each curve
+    """
+
+    def __init__(self, names, thr, ts, offsets, starts):
+        self.names = names
+        self.thr = thr
+        self.ts = ts
+        self.offsets = offsets
+        self.starts = starts
+
+    def __len__(self):
+        return len(self.names)
+
+    @staticmethod
+    def from_results(results):
+        """Builds the index from the eval_accuracy MLLOG events.
+
+        The whole curve is used (not truncated like results.thresholds),
+        and it is made monotone by dropping the accuracies lower than a
+        previous one.
+        """
+        names = []
+        starts = []
+        curves_thr = []
+        curves_ts = []
+
+        if "init_start" in results.mllog_keys and "eval_accuracy" in results.mllog_keys:
+            init_start_id = results.mllog_keys.index("init_start")
+            eval_accuracy_id = results.mllog_keys.index("eval_accuracy")
+        else:
+            init_start_id = eval_accuracy_id = None
+
+        for pod_name, pod_events in sorted(results.mllog_events.items()):
+            if init_start_id is None: break
+
+            for gpu_name, events in pod_events.items():
+                start_ts, _ = events.select(init_start_id)
+                eval_ts, eval_thr = events.select(eval_accuracy_id)
+                if not len(start_ts): continue
+
+                keep = (eval_ts >= start_ts[0]) & ~np.isnan(eval_thr)
+                eval_ts, eval_thr = eval_ts[keep], eval_thr[keep]
+                # keep the monotone increasing part of the curve
+                monotone = eval_thr >= np.maximum.accumulate(eval_thr)
+                if not monotone.any(): continue
+
+                names.append(f"{pod_name} | {gpu_name}")
+                starts.append(start_ts[0])
+                curves_thr.append(eval_thr[monotone])
+                curves_ts.append(eval_ts[monotone] - start_ts[0])
+
+        offsets = np.cumsum([0] + [len(thr) for thr in curves_thr])
+        return ThresholdIndex(names,
+                              np.concatenate(curves_thr) if curves_thr else np.empty(0),
+                              np.concatenate(curves_ts) if curves_ts else np.empty(0),
+                              offsets,
+                              np.array(starts, dtype=np.float64))
+
+    @staticmethod
+    def concat(indexes):
+        """Merges several indexes, eg, the indexes of all the entries of
+        a plot. Returns the merged index and the position of the source
+        index of each curve."""
+        names = []
+        owners = []
+        offsets = [0]
+        for owner, index in enumerate(indexes):
+            names += index.names
+            owners += [owner] * len(index)
+            offsets += list(index.offsets[1:] + offsets[-1])
+
+        merged = ThresholdIndex(names,
+                                np.concatenate([index.thr for index in indexes] or [np.empty(0)]),
+                                np.concatenate([index.ts for index in indexes] or [np.empty(0)]),
+                                np.array(offsets),
+                                np.concatenate([index.starts for index in indexes] or [np.empty(0)]))
+
+        return merged, np.array(owners, dtype=int)
+
+    def time_to_threshold(self, thresholds):
+        """Returns the time (in ms) each curve took to reach each threshold.
+
+        The result is a (curves x thresholds) array, with a linear
+        interpolation between the evaluation points, and NaN where the
+        threshold is outside the range of the curve.
+
+        All the curves are looked up at once by shifting each curve (and
+        its queries) into its own disjoint range of a single sorted
+        array.
+        """
+        thresholds = np.asarray(thresholds, dtype=np.float64)
+        n_curves, n_thr = len(self), len(thresholds)
+        result = np.full((n_curves, n_thr), np.nan)
+        if not n_curves or not n_thr or not len(self.thr):
+            return result
+
+        lowest = min(self.thr.min(), thresholds.min())
+        span = max(self.thr.max(), thresholds.max()) - lowest + 1
+
+        curve_ids = np.repeat(np.arange(n_curves), np.diff(self.offsets))
+        keys = curve_ids * span + (self.thr - lowest)
+
+        query_thr = np.tile(thresholds, n_curves)
+        query_curve = np.repeat(np.arange(n_curves), n_thr)
+        queries = query_curve * span + (query_thr - lowest)
+
+        right = np.searchsorted(keys, queries, side="left")
+        start, end = self.offsets[query_curve], self.offsets[query_curve + 1]
+
+        in_range = right < end
+        exact = in_range.copy()
+        exact[in_range] = self.thr[right[in_range]] == query_thr[in_range]
+        between = in_range & ~exact & (right > start)
+
+        times = np.full(len(queries), np.nan)
+        times[exact] = self.ts[right[exact]]
+
+        r = right[between]
+        l = r - 1
+        times[between] = self.ts[l] + (query_thr[between] - self.thr[l]) * \
+            (self.ts[r] - self.ts[l]) / (self.thr[r] - self.thr[l])
+
+        return times.reshape(n_curves, n_thr)
+
+
+def _parse_pod_logs(dirname, results, pod_logs_f):
+    parser = _PodLogParser(results, pod_logs_f.name)
+
+    # iterate over the file object to stream the lines
+    # instead of loading the whole file in memory
+    for line in pod_logs_f:
+        parser.parse_line(line)
+
+    pod_name = pod_logs_f.name.rpartition("/")[-1][:-4]
+    parser.finish(pod_name)
+
+
+def _new_pod_results():
     results = types.SimpleNamespace()
-    results.pod_names = set()
     results.thresholds = {}
     results.avg_sample_sec = {}
+    # MLLOG event key names, indexed by the key ids of the events
+    results.mllog_keys = []
+    # pod_name -> gpu_name -> MllogEvents
+    results.mllog_events = {}
 
-    has_logs = False
-    for log_file in glob.glob(f"{dirname}/run-*.log"):
-        pod_name = log_file.rpartition("/")[-1][:-4]
-        results.pod_names.add(pod_name)
+    return results
+
+
+def _iter_lines(data):
+    # same line splitting as iterating over a text file
+    return io.TextIOWrapper(io.BytesIO(data))
+
+
+def _gpu_log_prefix(line):
+    """Returns the name of the GPU log file prefixing a line of the
+    MIG logs (grep . /tmp/benchmark_*.log), or None."""
+
+    if not line.startswith("/tmp"): return None
+
+    prefix, colon, _ = line.partition(":")
+    return prefix if colon else None
+
+
+def _summary_is_complete(pod_results, gpu_prefixes, all_sections):
+    """Tells if the summary lines of the pod were all found: the
+    result= line, and the avg. samples / sec line of every GPU.
+
+    With several MIG GPUs, the logs of the GPUs are printed one after
+    the other, each GPU with its avg. samples / sec line at the end of
+    its own section: the tail must cover all the sections
+    (`all_sections`), and every GPU must have its line.
+    """
+
+    if not hasattr(pod_results, "exec_time") or not pod_results.avg_sample_sec:
+        return False
+
+    if not gpu_prefixes:
+        return True
+
+    return all_sections and gpu_prefixes.issubset(pod_results.avg_sample_sec)
+
+
+def _parse_pod_log_summary(log_file):
+    """Parses the summary of a pod log, from its tail.
+
+    The tail is read backwards, with bounded reads of increasing size,
+    until all the summary lines are found. The MLLOG events of a tail
+    are skipped: the evaluations before the tail are missing, so the
+    thresholds would be wrong (eg, the first one above 0.2 would be
+    searched from the start of the tail). The thresholds and the events
+    are only parsed when the tail covers the whole log file.
+
+    Returns the partial results and the number of bytes read, or
+    (None, bytes read) when the summary could not be found.
+    """
+    pod_name = log_file.rpartition("/")[-1][:-4]
+    size = os.path.getsize(log_file)
+    bytes_read = 0
+    with open(log_file, "rb") as log_f:
+        tail = b""
+        tail_size = SUMMARY_TAIL_SIZE
+        while True:
+            tail_start = max(0, size - tail_size)
+            log_f.seek(tail_start)
+            read_size = size - tail_start - len(tail)
+            tail = log_f.read(read_size) + tail
+            bytes_read += read_size
+
+            pod_results = _new_pod_results()
+            parser = _PodLogParser(pod_results, log_file)
+
+            if tail_start == 0:
+                # the whole file has been read, parse all of it
+                for line in _iter_lines(tail):
+                    parser.parse_line(line)
+                parser.finish(pod_name)
+                return pod_results, bytes_read
+
+            # skip the first line of the tail, unless the tail starts
+            # at the start of a line
+            log_f.seek(tail_start - 1)
+            bytes_read += 1
+            if log_f.read(1) == b"\n":
+                lines = tail
+            else:
+                first_line_end = tail.find(b"\n")
+                lines = tail[first_line_end + 1:] if first_line_end != -1 else b""
+
+            gpu_prefixes = set()
+            all_sections = False # a line before the first GPU section was found
+            for line in _iter_lines(lines):
+                gpu_prefix = _gpu_log_prefix(line)
+                if gpu_prefix is None:
+                    all_sections = all_sections or not gpu_prefixes
+                else:
+                    gpu_prefixes.add(gpu_prefix)
+
+                if MLLOG_PREFIX in line: continue
+                parser.parse_line(line)
+
+            if _summary_is_complete(pod_results, gpu_prefixes, all_sections):
+                parser.finish(pod_name)
+                return pod_results, bytes_read
+
+            if tail_size >= SUMMARY_TAIL_MAX_SIZE:
+                return None, bytes_read
+
+            tail_size *= 4
+
+
+def _parse_pod_log_file(log_file):
+    """Parses one pod log file into its own partial results.
+
+    Returns the partial results, the parsing error, if any, and the
+    number of bytes read. The partial results are returned even when
+    the parsing failed, as the values parsed before the failure are
+    kept.
+    """
+    bytes_read = 0
+    pod_results = _new_pod_results()
+    try:
+        if SUMMARY_ONLY:
+            summary_results, bytes_read = _parse_pod_log_summary(log_file)
+            if summary_results is not None:
+                return summary_results, None, bytes_read
+
+            # summary lines not found, parse the whole file
+
+        bytes_read += os.path.getsize(log_file)
         with open(log_file) as log_f:
+            _parse_pod_logs(os.path.dirname(log_file), pod_results, log_f)
+    except Exception as e:
+        return pod_results, str(e), bytes_read
+
+    return pod_results, None, bytes_read
+
+
+def _merge_pod_events(results, pod_results):
+    """Merges the MLLOG events of a pod into the events of the run,
+    translating the key ids of the pod into the key ids of the run."""
+    key_ids = {key: key_id for key_id, key in enumerate(results.mllog_keys)}
+    for key in pod_results.mllog_keys:
+        if key in key_ids: continue
+        key_ids[key] = len(results.mllog_keys)
+        results.mllog_keys.append(key)
+
+    key_map = np.array([key_ids[key] for key in pod_results.mllog_keys], dtype=np.int32)
+    for events_pod_name, pod_events in pod_results.mllog_events.items():
+        results.mllog_events[events_pod_name] = {
+            gpu_name: MllogEvents(events.ts, key_map[events.key], events.value)
+            for gpu_name, events in pod_events.items()
+        }
+
+
+def _merge_pod_results(dirname, results, pod_name, pod_results):
+    """Merges the partial results of a pod into the results of the run.
+
+    The MLLOG key ids of the pod are translated into the key ids of the
+    run. The events are merged without a copy when the pod shares the
+    key ids of the run.
+    """
+    if pod_results.mllog_keys is results.mllog_keys:
+        results.mllog_events.update(pod_results.mllog_events)
+    else:
+        _merge_pod_events(results, pod_results)
+
+    for gpu_name, thresholds in pod_results.thresholds.items():
+        if results.thresholds.get(gpu_name, thresholds) is not thresholds and gpu_name != "full_gpu":
+            # the pod logs are merged in a fixed order, the last one wins
+            print(f"WARNING: gpu_name={gpu_name} found in several pods of '{dirname}', keeping {pod_name}")
+        results.thresholds[gpu_name] = thresholds
+
+    results.avg_sample_sec.update(pod_results.avg_sample_sec)
+    if hasattr(pod_results, "exec_time"):
+        results.exec_time = pod_results.exec_time
+
+
+def _parse_pod_log_files(log_files):
+    """Returns the (partial results, error, bytes read) of each pod log file, in order.
+
+    The files are parsed in parallel when POD_WORKERS is set, unless
+    this process is already a worker of the directory pool.
+    """
+    if POD_WORKERS == 1 or len(log_files) < 2 or multiprocessing.parent_process() is not None:
+        return list(map(_parse_pod_log_file, log_files))
+
+    mp_context = multiprocessing.get_context("fork")
+    with concurrent.futures.ProcessPoolExecutor(max_workers=min(POD_WORKERS, len(log_files)),
+                                                mp_context=mp_context) as executor:
+        return list(executor.map(_parse_pod_log_file, log_files))
+
+
+class _PodLogWatcher():
+    """Incremental parser of a pod log file still being written.
+
+    The byte offset of the last complete line parsed and the state of
+    the parser are kept, so that only the lines appended since the last
+    refresh are parsed. The file is read in chunks of WATCH_READ_SIZE
+    bytes.
+    """
+
+    def __init__(self, log_file, mllog_keys):
+        self.log_file = log_file
+        self.pod_name = log_file.rpartition("/")[-1][:-4]
+        self.offset = 0
+        self.results = _new_pod_results()
+        # share the key ids of the run, so that the events of the pod
+        # are merged without translating (and copying) them
+        self.results.mllog_keys = mllog_keys
+        self.parser = _PodLogParser(self.results, log_file)
+        self.error = None
+        # modification time of the log file, at the last refresh
+        self.mtime = None
+
+    def _running(self):
+        return self.error is None and not hasattr(self.results, "exec_time")
+
+    def timed_out(self):
+        """Tells if the log file was not modified for WATCH_TIMEOUT
+        seconds, while the pod did not complete."""
+        return self._running() and self.mtime is not None and time.time() - self.mtime > WATCH_TIMEOUT
+
+    def in_progress(self):
+        return self._running() and not self.timed_out()
+
+    def refresh(self):
+        """Parses the lines appended since the last refresh.
+
+        Returns the partial results of the pod, the parsing error if it
+        failed during this refresh, and the number of bytes read.
+        """
+        if self.error is not None:
+            return self.results, None, 0
+
+        bytes_read = 0
+        try:
+            with open(self.log_file, "rb") as log_f:
+                self.mtime = os.fstat(log_f.fileno()).st_mtime
+                log_f.seek(self.offset)
+
+                partial_line = b""
+                while True:
+                    chunk = log_f.read(WATCH_READ_SIZE)
+                    if not chunk: break
+                    bytes_read += len(chunk)
+
+                    # the last line may be cut by the chunk, or still be
+                    # being written: it is parsed with the next chunk or
+                    # at the next refresh
+                    data = partial_line + chunk
+                    lines_end = data.rfind(b"\n") + 1
+                    partial_line = data[lines_end:]
+
+                    for line in _iter_lines(data[:lines_end]):
+                        self.parser.parse_line(line)
+                    self.offset += lines_end
+
+            self.parser.finish(self.pod_name)
+        except Exception as e:
+            self.error = str(e)
+            return self.results, self.error, bytes_read
+
+        return self.results, None, bytes_read
+
+
+class _RunWatcher():
+    """Keeps the results of a run in progress up to date, by parsing the
+    lines appended to its pod logs.
+
+    The results are read by the plotting thread while the run is
+    watched: the values of a refresh are merged into new objects, which
+    then replace the attributes of the results. The objects already
+    published are never modified.
+    """
+
+    def __init__(self, dirname, results):
+        self.dirname = dirname
+        self.results = results
+        # log_file -> _PodLogWatcher
+        self.pod_watchers = {}
+
+    def in_progress(self):
+        return any(pod_watcher.in_progress() for pod_watcher in self.pod_watchers.values())
+
+    def timed_out(self):
+        return any(pod_watcher.timed_out() for pod_watcher in self.pod_watchers.values())
+
+    def _parse(self, log_files):
+        # the (partial results, error, bytes read) of each pod log file,
+        # like _parse_pod_log_files
+        parsed = []
+        for log_file in log_files:
+            try:
+                pod_watcher = self.pod_watchers[log_file]
+            except KeyError:
+                pod_watcher = self.pod_watchers[log_file] = _PodLogWatcher(log_file, self.results.mllog_keys)
+
+            parsed.append(pod_watcher.refresh())
+
+        return parsed
+
+    def refresh(self):
+        """Parses the pod logs and updates the results of the run.
+
+        Returns the parsing errors, and if any pod was parsed, like
+        _merge_parsed_pods.
+        """
+        log_files = sorted(glob.glob(f"{self.dirname}/run-*.log"))
+        for log_file in set(self.pod_watchers) - set(log_files):
+            # removed, not watched anymore
+            del self.pod_watchers[log_file]
+
+        results = _new_pod_results()
+        results.pod_names = set()
+        # append-only, the key ids already published do not change
+        results.mllog_keys = self.results.mllog_keys
+
+        errors, has_logs = _merge_parsed_pods(self.dirname, results, log_files, self._parse(log_files))
+
+        # the lists of the pods are extended by their next refresh
+        results.thresholds = {gpu_name: list(thresholds) for gpu_name, thresholds in results.thresholds.items()}
+        results.threshold_index = ThresholdIndex.from_results(results)
+
+        vars(self.results).update(vars(results))
+
+        return errors, has_logs
+
+
+# the runs in progress, refreshed by _watch_runs
+_run_watchers = []
+
+
+def _watch_runs():
+    while _run_watchers:
+        time.sleep(WATCH_INTERVAL)
+
+        for run_watcher in list(_run_watchers):
             try:
-                _parse_pod_logs(dirname, results, log_f)
-                has_logs = True
+                run_watcher.refresh()
             except Exception as e:
-                print(f"WARNING: failed to parse {log_file}: {e}")
-                #raise e
+                print(f"WARNING: failed to refresh '{run_watcher.dirname}': {e.__class__.__name__}: {e}")
+                _run_watchers.remove(run_watcher)
+                continue
+
+            if run_watcher.in_progress(): continue
+
+            if run_watcher.timed_out():
+                print(f"INFO: the logs of run '{run_watcher.dirname}' were not modified "
+                      f"for {WATCH_TIMEOUT:.0f}s, not watching it anymore.")
+            else:
+                print(f"INFO: run '{run_watcher.dirname}' completed, not watching it anymore.")
+            _run_watchers.remove(run_watcher)
+
+
+def _merge_parsed_pods(dirname, results, log_files, parsed):
+    """Merges the partial results of the pods into the results of the
+    run, in the order of log_files.
+
+    Returns the list of the parsing errors, and if any pod was parsed.
+    """
+    has_logs = False
+    errors = []
+    for log_file, (pod_results, error, bytes_read) in zip(log_files, parsed):
+        parse_profiling.count_file(log_file, bytes_read)
+
+        pod_name = log_file.rpartition("/")[-1][:-4]
+        results.pod_names.add(pod_name)
+
+        _merge_pod_results(dirname, results, pod_name, pod_results)
+
+        if error is not None:
+            print(f"WARNING: failed to parse {log_file}: {error}")
+            errors.append(f"{pod_name}: {error}")
+            continue
+
+        has_logs = True
+
+    return errors, has_logs
+
+
+def _parse_ssd_results(dirname, import_settings):
+    results = _new_pod_results()
+    results.pod_names = set()
+
+    run_watcher = _RunWatcher(dirname, results) if WATCH_INTERVAL else None
+
+    if run_watcher is not None:
+        with parse_profiling.step("log_scan"):
+            errors, has_logs = run_watcher.refresh()
+    else:
+        # sorted, so that the merge order does not depend on the file system
+        log_files = sorted(glob.glob(f"{dirname}/run-*.log"))
+
+        with parse_profiling.step("log_scan"):
+            parsed = _parse_pod_log_files(log_files)
+
+        errors, has_logs = _merge_parsed_pods(dirname, results, log_files, parsed)
+        results.threshold_index = ThresholdIndex.from_results(results)
 
     if not has_logs:
         print(f"WARNING: could not find pod log files in '{dirname}', skipping ...")
+        parse_quarantine.quarantine(dirname, "; ".join(errors) or "no pod log file", QUARANTINE_PATTERNS)
+        return None
+
+    # computed with the Prometheus metrics
+    results.energy = None
+
+    if run_watcher is not None and run_watcher.in_progress():
+        _run_watchers.append(run_watcher)
+
+    return results
+
+
+def _iter_dir_files(dirname):
+    """Yields the (relative path, stat) of the files of a result directory.
+
+    Hidden files are ignored.
+    """
+    for this_dir, directories, files in os.walk(dirname):
+        directories[:] = sorted(d for d in directories if not d.startswith("."))
+        for fname in sorted(files):
+            if fname.startswith("."): continue
+
+            path = os.path.join(this_dir, fname)
+            yield os.path.relpath(path, dirname), os.stat(path)
+
+
+def _dir_fingerprint(dirname):
+    """Returns a digest of the file list, sizes and mtimes of a result directory."""
+    entries = [(relpath, stat.st_size, stat.st_mtime_ns) for relpath, stat in _iter_dir_files(dirname)]
+
+    return hashlib.sha1(repr(entries).encode()).hexdigest()
+
+
+def _compact_is_fresh(dirname):
+    """Tells if the compact sidecar file exists and is newer than all the
+    other files of the result directory."""
+    compact_mtime = None
+    sources_mtime = 0
+    for relpath, stat in _iter_dir_files(dirname):
+        if relpath == COMPACT_FILENAME:
+            compact_mtime = stat.st_mtime_ns
+        else:
+            sources_mtime = max(sources_mtime, stat.st_mtime_ns)
+
+    return compact_mtime is not None and compact_mtime > sources_mtime
+
+
+def compact_directory(dirname):
+    """Parses a result directory and saves all its results into a single
+    binary sidecar file (COMPACT_FILENAME).
+
+    The sidecar is a numpy .npz archive, without any pickled object: the
+    arrays are stored by key, and the 'index' entry holds a JSON
+    description of the results pointing to these keys.
+
+    Returns False if the directory could not be parsed.
+    """
+    results = _parse_ssd_results(dirname, {})
+    if results is None:
+        return False
+
+    _parse_prom_gpu_metrics(dirname, results)
+
+    arrays = {}
+    def add_array(array):
+        key = f"a{len(arrays)}"
+        arrays[key] = array
+        return key
+
+    index = dict(
+        version=COMPACT_VERSION,
+        pod_names=sorted(results.pod_names),
+        exec_time=getattr(results, "exec_time", None),
+        avg_sample_sec=results.avg_sample_sec,
+        thresholds={},
+        mllog_keys=results.mllog_keys,
+        mllog_events={},
+        prom={},
+    )
+
+    for gpu_name, values in results.thresholds.items():
+        index["thresholds"][gpu_name] = add_array(np.array(values, dtype=np.float64).reshape(-1, 2))
+
+    for pod_name, pod_events in results.mllog_events.items():
+        index["mllog_events"][pod_name] = {
+            gpu_name: (add_array(events.ts), add_array(events.key), add_array(events.value))
+            for gpu_name, events in pod_events.items()}
+
+    for metric in results.prom:
+        index["prom"][metric] = {prom_group: (add_array(series.ts), add_array(series.values), series.device)
+                                 for prom_group, series in results.prom[metric].items()}
+
+    arrays["index"] = np.array(json.dumps(index))
+
+    compact_path = pathlib.Path(dirname) / COMPACT_FILENAME
+    tmp_path = compact_path.with_name("." + compact_path.name + ".tmp")
+    with open(tmp_path, "wb") as out_f:
+        np.savez(out_f, **arrays)
+    os.replace(tmp_path, compact_path)
+
+    return True
+
+
+def _load_compact(dirname, parse_metrics):
+    compact_path = pathlib.Path(dirname) / COMPACT_FILENAME
+    parse_profiling.count_file(compact_path)
+    try:
+        with np.load(compact_path, allow_pickle=False) as compact, parse_profiling.step("compact_load"):
+            index = json.loads(str(compact["index"]))
+            if index.get("version") != COMPACT_VERSION:
+                return None
+
+            results = types.SimpleNamespace()
+            results.pod_names = set(index["pod_names"])
+            results.avg_sample_sec = index["avg_sample_sec"]
+            results.thresholds = {gpu_name: compact[key].tolist()
+                                  for gpu_name, key in index["thresholds"].items()}
+            results.mllog_keys = index["mllog_keys"]
+            results.mllog_events = {
+                pod_name: {gpu_name: MllogEvents(compact[ts_key], compact[key_key], compact[value_key])
+                           for gpu_name, (ts_key, key_key, value_key) in pod_events.items()}
+                for pod_name, pod_events in index["mllog_events"].items()}
+    except Exception as e:
+        print(f"WARNING: failed to load the compact file of '{dirname}': {e}")
+        return None
+
+    if index["exec_time"] is not None:
+        results.exec_time = index["exec_time"]
+
+    results.threshold_index = ThresholdIndex.from_results(results)
+
+    results.energy = None
+    if parse_metrics:
+        results.prom = _CompactPromMetrics(index["prom"], results.pod_names, compact_path)
+        results.energy = RunEnergy.from_results(results)
+
+    return results
+
+
+def _parse_cache_path(dirname):
+    dir_key = hashlib.sha1(os.path.abspath(dirname).encode()).hexdigest()
+    return pathlib.Path(PARSE_CACHE_DIR) / f"{dir_key}.pickle"
+
+
+def _load_parse_cache(dirname, fingerprint, parse_metrics):
+    try:
+        with parse_profiling.open_file(_parse_cache_path(dirname), "rb") as cache_f, \
+             parse_profiling.step("cache_load"):
+            stat = os.fstat(cache_f.fileno())
+            if stat.st_uid != os.getuid() or stat.st_mode & 0o022:
+                # unpickling the file could run the code of another user
+                print(f"WARNING: ignoring the parse cache of '{dirname}': "
+                      f"'{cache_f.name}' is not owned by the user, or writable by others")
+                return None
+
+            cache = pickle.load(cache_f)
+    except FileNotFoundError:
+        return None
+    except Exception as e:
+        print(f"WARNING: failed to load the parse cache of '{dirname}': {e}")
+        return None
+
+    if cache.get("version") != PARSE_CACHE_VERSION: return None
+    if cache.get("fingerprint") != fingerprint: return None
+    if parse_metrics and not cache.get("parse_metrics"): return None
+
+    results = cache["results"]
+    if isinstance(getattr(results, "prom", None), LazyPromMetrics):
+        # the directory may have been moved since the cache was saved
+        results.prom.dirname = str(dirname)
+
+    return results
+
+
+def _save_parse_cache(dirname, fingerprint, parse_metrics, results):
+    cache_path = _parse_cache_path(dirname)
+    cache = dict(
+        version=PARSE_CACHE_VERSION,
+        fingerprint=fingerprint,
+        parse_metrics=parse_metrics,
+        results=results,
+    )
+    tmp_path = cache_path.with_name(cache_path.name + ".tmp")
+    try:
+        cache_path.parent.mkdir(mode=0o700, parents=True, exist_ok=True)
+        # only readable by the user, see _load_parse_cache
+        with open(tmp_path, "wb", opener=lambda path, flags: os.open(path, flags, 0o600)) as cache_f:
+            pickle.dump(cache, cache_f, protocol=pickle.HIGHEST_PROTOCOL)
+        os.replace(tmp_path, cache_path)
+    except Exception as e:
+        # eg, unpicklable results: the directory will be parsed again next time
+        print(f"WARNING: failed to save the parse cache of '{dirname}': {e.__class__.__name__}: {e}")
+        try:
+            tmp_path.unlink()
+        except OSError:
+            pass
+
+
+def _parse_directory(dirname, import_settings, parse_metrics):
+    with parse_profiling.directory(dirname):
+        return _parse_directory_files(dirname, import_settings, parse_metrics)
+
+
+def _in_progress(results):
+    # in watch mode, the runs in progress are parsed from their logs, to be watched
+    return WATCH_INTERVAL and not hasattr(results, "exec_time")
+
+
+def _parse_directory_files(dirname, import_settings, parse_metrics):
+    if _compact_is_fresh(dirname):
+        results = _load_compact(dirname, parse_metrics)
+        if results is not None and not _in_progress(results):
+            return results
+
+    results = None
+    if PARSE_CACHE_ENABLED:
+        fingerprint = _dir_fingerprint(dirname)
+        results = _load_parse_cache(dirname, fingerprint, parse_metrics)
+
+    if results is not None and not _in_progress(results):
+        return results
+
+    results = _parse_ssd_results(dirname, import_settings)
+
+    if results is None:
         return None
 
+    if parse_metrics:
+        _parse_prom_gpu_metrics(dirname, results)
+
+    # the summary results and the runs being watched are incomplete, do not cache them
+    if PARSE_CACHE_ENABLED and not SUMMARY_ONLY and not _in_progress(results):
+        with parse_profiling.step("cache_save"):
+            _save_parse_cache(dirname, fingerprint, parse_metrics, results)
+
     return results
 
 
+def _parse_directory_in_worker(args):
+    # runs in a worker process: capture the warnings, so that the
+    # parent process can print them in a deterministic order
+    dirname, import_settings, parse_metrics = args
+
+    output = io.StringIO()
+    error = None
+    with contextlib.redirect_stdout(output):
+        try:
+            results = _parse_directory(dirname, import_settings, parse_metrics)
+        except Exception as e:
+            # raised by the parent process, like when parsing serially
+            results = None
+            error = e
+
+    return (results, output.getvalue(), parse_profiling.records.get(str(dirname)),
+            parse_quarantine.added_entry(dirname), error)
+
+
+# directories waiting to be parsed by the worker pool,
+# as a list of (dirname, import_settings, parse_metrics)
+_pending_directories = []
+# dirname -> what _parse_directory_in_worker returned for the directory
+_parsed_directories = {}
+
+
+def _should_parse_metrics():
+    parse_metrics = False
+    parse_metrics |= "visualize" in cli_args.kwargs["execution_mode"]
+    parse_metrics |= "parse" in cli_args.kwargs["execution_mode"]
+    parse_metrics &= not SUMMARY_ONLY
+
+    return parse_metrics
+
+
+def _collect_directory(fn_add_to_matrix, dirname, import_settings):
+    # first walk of the result directories, see parse_data
+    if import_settings.get("benchmark") != "ssd":
+        return
+
+    if parse_quarantine.check(dirname, QUARANTINE_PATTERNS) is not None:
+        return
+
+    _pending_directories.append((dirname, import_settings, _should_parse_metrics()))
+
+
+def _parse_pending_directories():
+    print(f"INFO: parsing {len(_pending_directories)} directories with {PARSE_WORKERS} worker processes ...")
+
+    # the workers inherit the state of the parent process (cli_args, ...)
+    mp_context = multiprocessing.get_context("fork")
+    chunksize = max(1, len(_pending_directories) // (PARSE_WORKERS * 4))
+    with concurrent.futures.ProcessPoolExecutor(max_workers=PARSE_WORKERS, mp_context=mp_context) as executor:
+        parsed = executor.map(_parse_directory_in_worker, _pending_directories, chunksize=chunksize)
+
+        for (dirname, *_), parsed_directory in zip(_pending_directories, parsed):
+            _parsed_directories[str(dirname)] = parsed_directory
+
+    _pending_directories[:] = []
+
+
 def _parse_results(fn_add_to_matrix, dirname, import_settings):
     benchmark = import_settings.get("benchmark")
     if benchmark != "ssd":
         print(f"WARNING: benchmark '{benchmark}' not currently parsed. Skipping {dirname} ...")
         return
 
-    results = _parse_ssd_results(dirname, import_settings)
+    if parse_quarantine.check(dirname, QUARANTINE_PATTERNS) is not None:
+        # could not be parsed by a previous import, and did not change since then
+        return
+
+    try:
+        results, output, record, quarantined, error = _parsed_directories.pop(str(dirname))
+    except KeyError:
+        results = _parse_directory(dirname, import_settings, _should_parse_metrics())
+    else:
+        # parsed by the worker pool
+        print(output, end="")
+        parse_profiling.add_record(record)
+        parse_quarantine.add_entry(dirname, quarantined)
+        if error is not None:
+            raise error
 
     if results is None:
         return
 
-    parse_metrics = False
-    parse_metrics |= "visualize" in cli_args.kwargs["execution_mode"]
-    parse_metrics |= "parse" in cli_args.kwargs["execution_mode"]
-    if parse_metrics:
-        _parse_prom_gpu_metrics(dirname, results)
-
-    fn_add_to_matrix(results)
+    with parse_profiling.directory(dirname), parse_profiling.step("matrix_insert"):
+        fn_add_to_matrix(results)
 
 
 def parse_data():
     # delegate the parsing to the simple_store
     store.register_custom_rewrite_settings(_rewrite_settings)
+
+    if PARSE_WORKERS > 1 and not WATCH_INTERVAL:
+        # a first walk collects the directories, which are parsed by
+        # the worker pool. The second walk adds their results to the
+        # matrix, in the same flow as when they are parsed serially.
+        store_simple.register_custom_parse_results(_collect_directory)
+        store_simple.parse_data()
+
+        if _pending_directories:
+            _parse_pending_directories()
+
     store_simple.register_custom_parse_results(_parse_results)
 
-    return store_simple.parse_data()
+    ret = store_simple.parse_data()
+
+    if _run_watchers and "visualize" in cli_args.kwargs["execution_mode"]:
+        print(f"INFO: watching {len(_run_watchers)} runs in progress every {WATCH_INTERVAL:.0f}s ...")
+        threading.Thread(target=_watch_runs, name="mlperf-watch", daemon=True).start()
+
+    parse_profiling.report()
+    parse_quarantine.report()
+
+    return ret
@@ -0,0 +1,104 @@
+import os
+import json
+
+import pytest
+
+import parse_quarantine
+
+PATTERNS = ("run-*.log",)
+
+
+@pytest.fixture
+def index_path(tmp_path, monkeypatch):
+    index_path = tmp_path / "quarantine.json"
+    monkeypatch.setattr(parse_quarantine, "ENABLED", True)
+    monkeypatch.setattr(parse_quarantine, "INDEX_PATH", str(index_path))
+    _new_import(monkeypatch)
+
+    return index_path
+
+
+def _new_import(monkeypatch):
+    # the state of the module, as in a new process
+    monkeypatch.setattr(parse_quarantine, "_index", None)
+    monkeypatch.setattr(parse_quarantine, "_index_path", None)
+    monkeypatch.setattr(parse_quarantine, "_modified", False)
+    monkeypatch.setattr(parse_quarantine, "skipped", {})
+    monkeypatch.setattr(parse_quarantine, "added", {})
+
+
+def _make_run(tmp_path):
+    run_dir = tmp_path / "results" / "run1"
+    (run_dir / "metrics").mkdir(parents=True)
+    (run_dir / "run-mlperf-0abcd.log").write_text("no result\n")
+    (run_dir / "metrics" / "prom_DCGM_FI_DEV_POWER_USAGE.json").write_text("{}")
+
+    return run_dir
+
+
+def _touch(path, content):
+    path.write_text(content)
+    # a new mtime, even on coarse file systems
+    stat = path.stat()
+    os.utime(path, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1_000_000_000))
+
+
+def test_quarantine_round_trip(tmp_path, monkeypatch, index_path):
+    run_dir = _make_run(tmp_path)
+
+    assert parse_quarantine.check(run_dir, PATTERNS) is None
+    parse_quarantine.quarantine(run_dir, "no pod log file", PATTERNS)
+    parse_quarantine.report()
+
+    saved = json.loads(index_path.read_text())
+    assert saved["version"] == parse_quarantine.INDEX_VERSION
+    assert list(saved["directories"]) == [str(run_dir.resolve())]
+
+    _new_import(monkeypatch)
+    assert parse_quarantine.check(run_dir, PATTERNS) == "no pod log file"
+    assert parse_quarantine.skipped == {str(run_dir.resolve()): "no pod log file"}
+
+    # a file not read by the store does not release the directory
+    _touch(run_dir / "metrics" / "prom_DCGM_FI_DEV_POWER_USAGE.json", "{ }")
+    assert parse_quarantine.check(run_dir, PATTERNS) == "no pod log file"
+
+
+@pytest.mark.parametrize("patterns, changed", [
+    (PATTERNS, "run-mlperf-0abcd.log"),
+    (PATTERNS, "run-mlperf-1abcd.log"), # new file
+    (None, "metrics/prom_DCGM_FI_DEV_POWER_USAGE.json"),
+])
+def test_changed_directory_is_released(tmp_path, monkeypatch, index_path, patterns, changed):
+    run_dir = _make_run(tmp_path)
+    parse_quarantine.quarantine(run_dir, "no result generated", patterns)
+    parse_quarantine.report()
+
+    _new_import(monkeypatch)
+    _touch(run_dir / changed, "result=3600\n")
+    assert parse_quarantine.check(run_dir, patterns) is None
+
+    # the release is saved
+    parse_quarantine.report()
+    assert json.loads(index_path.read_text())["directories"] == {}
+
+
+def test_hidden_files_are_not_fingerprinted(tmp_path):
+    run_dir = _make_run(tmp_path)
+    fingerprint = parse_quarantine.fingerprint(run_dir)
+
+    (run_dir / ".mlperf_parse_cache.pickle").write_bytes(b"cache")
+    (run_dir / ".cache").mkdir()
+    (run_dir / ".cache" / "file").write_text("cache")
+
+    assert parse_quarantine.fingerprint(run_dir) == fingerprint
+
+
+def test_disabled(tmp_path, monkeypatch, index_path):
+    monkeypatch.setattr(parse_quarantine, "ENABLED", False)
+    run_dir = _make_run(tmp_path)
+
+    parse_quarantine.quarantine(run_dir, "no pod log file", PATTERNS)
+    parse_quarantine.report()
+
+    assert parse_quarantine.check(run_dir, PATTERNS) is None
+    assert not index_path.exists()
@@ -0,0 +1,341 @@
+import os
+import sys
+import math
+import random
+import json
+import pathlib
+import importlib
+
+import numpy as np
+import pytest
+
+pytest.importorskip("matrix_benchmarking")
+
+THIS_DIR = pathlib.Path(__file__).absolute().parent
+sys.path.insert(0, str(THIS_DIR.parent))
+store = importlib.import_module(f"{THIS_DIR.name}.store")
+
+T0 = 1637669864000
+
+
+def _mllog(time_ms, key, value=None):
+    return ":::MLLOG " + json.dumps({"namespace": "", "time_ms": time_ms, "event_type": "POINT_IN_TIME",
+                                     "key": key, "value": value, "metadata": {"file": "train.py", "lineno": 1}})
+
+
+MIG_PREFIXES = tuple(f"/tmp/benchmark_MIG-GPU-{gpu}.log:" for gpu in range(7))
+
+
+def _write_pod_log(path, accuracies, gpu_prefixes=("",)):
+    """Writes a pod log like the SSD training ones. For each GPU in
+    turn, its whole training log: init_start, one evaluation per epoch
+    with some training lines between them, and its avg. samples / sec
+    line. With MIG GPUs, the GPU logs are printed with their file name
+    prefix by `grep . /tmp/benchmark_*.log`, after the `ls` of the
+    files. Then the summary lines."""
+    with open(path, "w") as log_f:
+        print("Running the training", file=log_f)
+        for prefix in gpu_prefixes:
+            if prefix: print(prefix.rstrip(":"), file=log_f)
+
+        for gpu, prefix in enumerate(gpu_prefixes):
+            print(prefix + _mllog(T0 + gpu, "init_start"), file=log_f)
+            for epoch, accuracy in enumerate(accuracies):
+                for iteration in range(20):
+                    print(f"{prefix}Iteration: {epoch * 20 + iteration:6d}, Loss function: 4.321, Average Loss: 4.567", file=log_f)
+                print(prefix + _mllog(T0 + (epoch + 1) * 60000 + gpu, "eval_accuracy", accuracy), file=log_f)
+            print(f"{prefix}avg. samples / sec: {100 + gpu}", file=log_f)
+
+        print("result=3600", file=log_f)
+        print("ALL FINISHED", file=log_f)
+
+
+def test_summary_matches_full_parse(tmp_path, monkeypatch):
+    # the accuracy goes above 0.2 early, then drops: a tail restarting the
+    # threshold derivation would find other thresholds
+    accuracies = [0.05, 0.12, 0.21, 0.15] + [0.16 + 0.001 * epoch for epoch in range(60)]
+    log_file = tmp_path / "run-mlperf-0abcd.log"
+    _write_pod_log(log_file, accuracies)
+
+    monkeypatch.setattr(store, "SUMMARY_TAIL_SIZE", 1024)
+    monkeypatch.setattr(store, "SUMMARY_TAIL_MAX_SIZE", 16 * 1024)
+    assert log_file.stat().st_size > store.SUMMARY_TAIL_MAX_SIZE
+
+    full_results, error, _ = store._parse_pod_log_file(str(log_file))
+    assert error is None
+
+    summary_results, bytes_read = store._parse_pod_log_summary(str(log_file))
+    assert summary_results is not None
+    assert bytes_read < log_file.stat().st_size
+
+    assert summary_results.exec_time == full_results.exec_time
+    assert summary_results.avg_sample_sec == full_results.avg_sample_sec
+    # the thresholds cannot be derived from the tail
+    assert summary_results.thresholds == {}
+    assert full_results.thresholds["full_gpu"][-1][0] == 0.21
+
+
+def test_summary_of_mig_logs_matches_full_parse(tmp_path, monkeypatch):
+    log_file = tmp_path / "run-mlperf-0abcd.log"
+    _write_pod_log(log_file, [0.05 + 0.01 * epoch for epoch in range(30)], MIG_PREFIXES)
+
+    full_results, error, _ = store._parse_pod_log_file(str(log_file))
+    assert error is None
+    assert len(full_results.avg_sample_sec) == len(MIG_PREFIXES)
+
+    # the tail only covers the section of the last GPU
+    monkeypatch.setattr(store, "SUMMARY_TAIL_SIZE", 1024)
+    monkeypatch.setattr(store, "SUMMARY_TAIL_MAX_SIZE", 16 * 1024)
+    assert log_file.stat().st_size > store.SUMMARY_TAIL_MAX_SIZE
+
+    assert store._parse_pod_log_summary(str(log_file))[0] is None
+
+    monkeypatch.setattr(store, "SUMMARY_ONLY", True)
+    summary_results, error, _ = store._parse_pod_log_file(str(log_file))
+    assert error is None
+    assert summary_results.exec_time == full_results.exec_time
+    assert summary_results.avg_sample_sec == full_results.avg_sample_sec
+
+
+def test_summary_of_a_small_log_is_complete(tmp_path):
+    log_file = tmp_path / "run-mlperf-0abcd.log"
+    _write_pod_log(log_file, [0.05, 0.12, 0.21, 0.15])
+
+    full_results, error, _ = store._parse_pod_log_file(str(log_file))
+    assert error is None
+
+    summary_results, bytes_read = store._parse_pod_log_summary(str(log_file))
+    assert bytes_read == log_file.stat().st_size
+
+    assert summary_results.exec_time == full_results.exec_time
+    assert summary_results.avg_sample_sec == full_results.avg_sample_sec
+    assert summary_results.thresholds == full_results.thresholds
+
+
+def test_summary_tail_starting_on_a_line(tmp_path, monkeypatch):
+    log_file = tmp_path / "run-mlperf-0abcd.log"
+    _write_pod_log(log_file, [0.05, 0.12, 0.21, 0.15])
+
+    # the tail starts exactly on the avg. samples / sec line
+    tail = log_file.read_bytes()
+    tail = tail[tail.rindex(b"\navg. samples / sec") + 1:]
+    monkeypatch.setattr(store, "SUMMARY_TAIL_SIZE", len(tail))
+    monkeypatch.setattr(store, "SUMMARY_TAIL_MAX_SIZE", len(tail))
+
+    summary_results, _ = store._parse_pod_log_summary(str(log_file))
+    assert summary_results is not None
+    assert summary_results.avg_sample_sec == {"single": 100}
+
+
+def test_watched_log_matches_full_parse(tmp_path, monkeypatch):
+    log_file = tmp_path / "run-mlperf-0abcd.log"
+    _write_pod_log(log_file, [0.05 + 0.01 * epoch for epoch in range(30)], MIG_PREFIXES[:2])
+    content = log_file.read_bytes()
+
+    full_results, error, _ = store._parse_pod_log_file(str(log_file))
+    assert error is None
+
+    monkeypatch.setattr(store, "WATCH_INTERVAL", 1)
+    # the lines are also cut by the chunks read
+    monkeypatch.setattr(store, "WATCH_READ_SIZE", 777)
+    # the log is written in chunks, cutting the lines
+    log_file.write_bytes(b"")
+    run_results = store._new_pod_results()
+    run_results.pod_names = set()
+    run_watcher = store._RunWatcher(str(tmp_path), run_results)
+    for chunk_start in range(0, len(content), 5000):
+        with open(log_file, "ab") as log_f:
+            log_f.write(content[chunk_start:chunk_start + 5000])
+        run_watcher.refresh()
+
+    assert not run_watcher.in_progress()
+    assert run_results.exec_time == full_results.exec_time
+    assert run_results.thresholds == full_results.thresholds
+
+    pod_events = run_results.mllog_events["run-mlperf-0abcd"]
+    for gpu_name, events in full_results.mllog_events["run-mlperf-0abcd"].items():
+        watched_events = pod_events[gpu_name]
+        assert watched_events.ts.tolist() == events.ts.tolist()
+        assert [run_results.mllog_keys[key] for key in watched_events.key] == \
+            [full_results.mllog_keys[key] for key in events.key]
+        assert np.array_equal(watched_events.value, events.value, equal_nan=True)
+
+
+def test_watched_results_are_replaced_and_time_out(tmp_path, monkeypatch):
+    log_file = tmp_path / "run-mlperf-0abcd.log"
+    _write_pod_log(log_file, [0.05 + 0.01 * epoch for epoch in range(30)])
+    # a crashed pod, without the summary lines
+    content = log_file.read_bytes()
+    content = content[:content.index(b"avg. samples / sec")]
+    log_file.write_bytes(content[:len(content) // 2])
+
+    monkeypatch.setattr(store, "WATCH_INTERVAL", 1)
+    run_results = store._new_pod_results()
+    run_results.pod_names = set()
+    run_watcher = store._RunWatcher(str(tmp_path), run_results)
+    run_watcher.refresh()
+    assert run_watcher.in_progress()
+
+    # the objects already published are not modified by a refresh
+    thresholds = run_results.thresholds
+    published = {gpu_name: list(values) for gpu_name, values in thresholds.items()}
+    log_file.write_bytes(content)
+    run_watcher.refresh()
+    assert thresholds == published
+    assert run_results.thresholds is not thresholds
+    assert len(run_results.thresholds["full_gpu"]) > len(thresholds["full_gpu"])
+
+    monkeypatch.setattr(store, "WATCH_TIMEOUT", 60)
+    assert run_watcher.in_progress()
+    stat = log_file.stat()
+    os.utime(log_file, (stat.st_atime, stat.st_mtime - 120))
+    run_watcher.refresh()
+    assert run_watcher.timed_out()
+    assert not run_watcher.in_progress()
+
+
+def test_energy_of_shared_gpus_is_counted_once(tmp_path):
+    log_files = []
+    for pod in range(2):
+        log_files.append(tmp_path / f"run-mlperf-{pod}abcd.log")
+        _write_pod_log(log_files[-1], [0.1, 0.2, 0.3])
+
+    results = store._new_pod_results()
+    results.pod_names = set()
+    store._merge_parsed_pods(str(tmp_path), results, [str(log_file) for log_file in log_files],
+                             [store._parse_pod_log_file(str(log_file)) for log_file in log_files])
+
+    # 2 MIG pods sharing one physical GPU at 100 W, and a pod with its own GPU at 50 W
+    ts = np.arange(T0, T0 + 5 * 60000, 1000) / 1000
+    results.prom = {store.ENERGY_METRIC: {
+        "run-mlperf-0abcd | gpu #0 ": store.PromSeries(ts, np.full(len(ts), 100.), "dgx | GPU-0"),
+        "run-mlperf-1abcd | gpu #0 ": store.PromSeries(ts, np.full(len(ts), 100.), "dgx | GPU-0"),
+        "run-mlperf-1abcd | gpu #1 ": store.PromSeries(ts, np.full(len(ts), 50.), "dgx | GPU-1"),
+    }}
+
+    energy = store.RunEnergy.from_results(results)
+    assert energy.total == pytest.approx(150 * energy.duration)
+    assert energy.pods["run-mlperf-0abcd"][-1] == pytest.approx(50 * energy.duration)
+    assert energy.pods["run-mlperf-1abcd"][-1] == pytest.approx(100 * energy.duration)
+
+
+def test_parse_cache_is_private(tmp_path, monkeypatch):
+    monkeypatch.setattr(store, "PARSE_CACHE_DIR", str(tmp_path / "cache"))
+    run_dir = tmp_path / "results" / "run1"
+    run_dir.mkdir(parents=True)
+    results = store._new_pod_results()
+    results.exec_time = 60
+
+    store._save_parse_cache(run_dir, "fingerprint", False, results)
+    cache_path = store._parse_cache_path(run_dir)
+    # outside of the result directory
+    assert list(run_dir.iterdir()) == []
+    assert cache_path.stat().st_mode & 0o077 == 0
+
+    assert store._load_parse_cache(run_dir, "fingerprint", False).exec_time == 60
+    assert store._load_parse_cache(run_dir, "modified", False) is None
+
+    # a file which could have been written by another user is not unpickled
+    cache_path.chmod(0o666)
+    assert store._load_parse_cache(run_dir, "fingerprint", False) is None
+
+
+@pytest.fixture
+def walk_results(tmp_path, monkeypatch):
+    """Replaces the walk of the result directories by matrix_benchmarking:
+    returns the list of the directories added to the matrix, filled
+    before store.parse_data returns."""
+    for run in range(3):
+        run_dir = tmp_path / f"run{run}"
+        run_dir.mkdir()
+        _write_pod_log(run_dir / "run-mlperf-0abcd.log", [0.1, 0.2, 0.3])
+
+    callbacks = []
+    added = []
+    def parse_data():
+        for run_dir in sorted(tmp_path.iterdir()):
+            callbacks[-1](lambda results, run_dir=run_dir: added.append(run_dir.name), run_dir, dict(benchmark="ssd"))
+        return list(added)
+
+    monkeypatch.setattr(store.store, "register_custom_rewrite_settings", lambda fn: None)
+    monkeypatch.setattr(store.store_simple, "register_custom_parse_results", callbacks.append)
+    monkeypatch.setattr(store.store_simple, "parse_data", parse_data)
+    monkeypatch.setattr(store, "PARSE_CACHE_ENABLED", False)
+    monkeypatch.setattr(store.parse_quarantine, "ENABLED", False)
+
+    return added
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_worker_pool_matches_serial_parse(monkeypatch, walk_results, workers):
+    monkeypatch.setattr(store, "PARSE_WORKERS", workers)
+
+    # the entries are added during the walk
+    assert store.parse_data() == ["run0", "run1", "run2"]
+
+
+@pytest.mark.parametrize("workers", [1, 2])
+def test_worker_pool_raises_like_serial_parse(monkeypatch, walk_results, workers):
+    monkeypatch.setattr(store, "PARSE_WORKERS", workers)
+
+    parse_directory = store._parse_directory
+    def failing_parse_directory(dirname, *args):
+        if dirname.name == "run1":
+            raise ValueError(f"cannot parse {dirname.name}")
+        return parse_directory(dirname, *args)
+    monkeypatch.setattr(store, "_parse_directory", failing_parse_directory)
+
+    with pytest.raises(ValueError, match="cannot parse run1"):
+        store.parse_data()
+    assert walk_results == ["run0"]
+
+
+def _naive_time_to_threshold(accuracies, threshold):
+    # the monotone part of the curve, scanned point by point
+    curve = []
+    for epoch, accuracy in enumerate(accuracies):
+        if curve and accuracy < max(thr for thr, _ in curve): continue
+        curve.append((accuracy, (epoch + 1) * 60000))
+
+    for i, (thr, ts) in enumerate(curve):
+        if thr < threshold: continue
+        if thr == threshold: return ts
+        if i == 0: return math.nan
+
+        prev_thr, prev_ts = curve[i - 1]
+        return prev_ts + (threshold - prev_thr) * (ts - prev_ts) / (thr - prev_thr)
+
+    return math.nan
+
+
+def test_threshold_index_matches_naive_scan(tmp_path):
+    rng = random.Random(42)
+    runs = []
+    for run in range(3):
+        run_dir = tmp_path / f"run{run}"
+        run_dir.mkdir()
+        pods = {}
+        for pod in range(2):
+            # noisy increasing curves, with exact repeats and drops
+            pods[f"run-mlperf-{pod}abcd"] = accuracies = [
+                round(min(0.25, 0.004 * epoch + rng.uniform(-0.02, 0.02)), 3) for epoch in range(60)]
+            _write_pod_log(run_dir / f"run-mlperf-{pod}abcd.log", accuracies)
+
+        log_files = sorted(str(log_file) for log_file in run_dir.glob("run-*.log"))
+        results = store._new_pod_results()
+        results.pod_names = set()
+        store._merge_parsed_pods(str(run_dir), results, log_files,
+                                 [store._parse_pod_log_file(log_file) for log_file in log_files])
+        runs.append((pods, store.ThresholdIndex.from_results(results)))
+
+    thresholds = [0.0, 0.05, 0.1, 0.123, 0.2, 0.21, 0.25, 0.3, -1]
+    index, owners = store.ThresholdIndex.concat([index for _, index in runs])
+    times = index.time_to_threshold(thresholds)
+
+    assert len(index) == 6
+    for name, owner, curve_times in zip(index.names, owners, times):
+        pod_name = name.partition(" | ")[0]
+        accuracies = runs[owner][0][pod_name]
+        expected = [_naive_time_to_threshold(accuracies, threshold) for threshold in thresholds]
+
+        assert curve_times == pytest.approx(expected, nan_ok=True)
@@ -8,6 +8,10 @@ import matrix_benchmarking.store.simple as store_simple
 import matrix_benchmarking.store.prom_db as store_prom_db
 import matrix_benchmarking.parsing.prom as parsing_prom
 
+# shared with the mlperf workload
+import mlperf.parse_profiling as parse_profiling
+import mlperf.parse_quarantine as parse_quarantine
+
 def _rewrite_settings(settings_dict):
     # no rewriting to do at the moment
     settings_dict.pop("expe")
@@ -30,7 +34,21 @@ INTERESTING_METRICS = [
     "pod:container_cpu_usage:sum",
 ]
 
+def _invalid_directory(dirname, import_settings, reason):
+    # the directory content will not change, do not parse it again
+    parse_quarantine.quarantine(dirname, reason)
+    store.simple.invalid_directory(dirname, import_settings, reason)
+
 def _parse_results(fn_add_to_matrix, dirname, import_settings):
+    reason = parse_quarantine.check(dirname)
+    if reason is not None:
+        store.simple.invalid_directory(dirname, import_settings, reason)
+        return
+
+    with parse_profiling.directory(dirname):
+        _parse_directory(fn_add_to_matrix, dirname, import_settings)
+
+def _parse_directory(fn_add_to_matrix, dirname, import_settings):
     results = types.SimpleNamespace()
     if 'batch_size_per_gpu' in import_settings:
         store.simple.invalid_directory(dirname, import_settings, "invalid BS configuration")
@@ -42,10 +60,11 @@ def _parse_results(fn_add_to_matrix, dirname, import_settings):
     #results.cpu_usage = sum(parsing_prom.mean(results.metrics["pod:container_cpu_usage:sum"], "run-bert"))
     #results.network_usage = sum(parsing_prom.last(results.metrics["container_network_transmit_bytes_total"], "run-bert"))
 
-    with open(list(dirname.glob("pod.*-launcher*.log"))[0]) as f:
+    with parse_profiling.open_file(list(dirname.glob("pod.*-launcher*.log"))[0]) as f, \
+         parse_profiling.step("log_scan"):
         for line in f.readlines():
             if "Resource exhausted" in line:
-                store.simple.invalid_directory(dirname, import_settings, "OOM detected")
+                _invalid_directory(dirname, import_settings, "OOM detected")
                 return
 
             prefix, delim, msg = line.strip().partition("] ")
@@ -71,18 +90,19 @@ def _parse_results(fn_add_to_matrix, dirname, import_settings):
                 results.throughput_units = msg.split()[2].strip("()")
 
     if "throughput" not  in results.__dict__:
-        store.simple.invalid_directory(dirname, import_settings, "no result generated")
+        _invalid_directory(dirname, import_settings, "no result generated")
         return
 
-    fn_add_to_matrix(results)
-    if import_settings["mpi_mode"] == "all_in_one_pod" and import_settings["num_gpu"] == "1":
-        for num_pods in 2, 4, 8:
-            settings = import_settings.copy()
-            settings["mpi_mode"] = "test-gpu-per-pod"
-            settings["num_gpu"] = "1"
-            settings["num_gpu_per_per_pod"] = str(int(16/num_pods))
-            settings["num_pods"] = "1"
-            fn_add_to_matrix(results, settings)
+    with parse_profiling.step("matrix_insert"):
+        fn_add_to_matrix(results)
+        if import_settings["mpi_mode"] == "all_in_one_pod" and import_settings["num_gpu"] == "1":
+            for num_pods in 2, 4, 8:
+                settings = import_settings.copy()
+                settings["mpi_mode"] = "test-gpu-per-pod"
+                settings["num_gpu"] = "1"
+                settings["num_gpu_per_per_pod"] = str(int(16/num_pods))
+                settings["num_pods"] = "1"
+                fn_add_to_matrix(results, settings)
     pass
 
 # https://github.com/NVIDIA/DeepLearningExamples/tree/master/TensorFlow2/LanguageModeling/BERT#fine-tuning-training-performance-for-squad-v11-on-nvidia-dgx-1-v100-8x-v100-16gb
@@ -119,4 +139,9 @@ def parse_data():
                             "<website>", results,
                             None)
 
-    return store_simple.parse_data()
+    ret = store_simple.parse_data()
+
+    parse_profiling.report()
+    parse_quarantine.report()
+
+    return ret
@@ -8,6 +8,8 @@ import matrix_benchmarking.store as store
 import matrix_benchmarking.common as common
 import matrix_benchmarking.cli_args as cli_args
 
+import mlperf.parse_profiling as parse_profiling
+
 def _parse_generated(dirname, fname, elt):
     for key in "Title", "TestClient", "Description":
         value = elt.find(key).text
@@ -95,8 +97,15 @@ def parse_data():
         if "psap"  in dirname or "gce" in dirname: continue
         for fname in files:
             if fname != "composite.xml": continue
-            root = ET.parse(pathlib.Path(this_dir) / fname).getroot()
-            for elt in root:
+            with parse_profiling.directory(this_dir):
+                parse_profiling.count_file(pathlib.Path(this_dir) / fname)
+                with parse_profiling.step("xml_decode"):
+                    root = ET.parse(pathlib.Path(this_dir) / fname).getroot()
+
+                with parse_profiling.step("matrix_insert"):
+                    for elt in root:
+
+                        PARSERS.get(elt.tag, _parse_unknown)(dirname, fname, elt)
+                        pass
 
-                PARSERS.get(elt.tag, _parse_unknown)(dirname, fname, elt)
-                pass
+    parse_profiling.report()
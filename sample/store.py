@@ -4,6 +4,8 @@ import yaml
 import matrix_benchmarking.store as store
 import matrix_benchmarking.store.simple as store_simple
 
+import mlperf.parse_profiling as parse_profiling
+
 def _rewrite_settings(params_dict):
     # add a @ on top of parameter name 'run'
     # to treat it as multiple identical executions
@@ -28,7 +30,7 @@ def _rewrite_settings(params_dict):
 def __parse_date(dirname, settings):
     results = types.SimpleNamespace()
 
-    with open(dirname / "date") as f:
+    with parse_profiling.open_file(dirname / "date") as f:
         results.date_ts = int(f.readlines()[0])
 
     return results
@@ -36,7 +38,7 @@ def __parse_date(dirname, settings):
 def __parse_procs(dirname, settings):
     results = types.SimpleNamespace()
 
-    with open(dirname / "procs") as f:
+    with parse_profiling.open_file(dirname / "procs") as f:
         results.procs = int(f.readlines()[0])
 
     return results
@@ -44,12 +46,16 @@ def __parse_procs(dirname, settings):
 def __parse_memfree(dirname, settings):
     results = types.SimpleNamespace()
 
-    with open(dirname / "memfree") as f:
+    with parse_profiling.open_file(dirname / "memfree") as f:
         results.memfree = int(f.readlines()[0]) * 1000 # unit if kB
 
     return results
 
 def _parse_directory(fn_add_to_matrix, dirname, import_settings):
+    with parse_profiling.directory(dirname):
+        _parse_directory_files(fn_add_to_matrix, dirname, import_settings)
+
+def _parse_directory_files(fn_add_to_matrix, dirname, import_settings):
     mode = import_settings.get("mode")
     if not mode:
         print(f"ERROR: failed to parse '{dirname}', 'mode' setting not defined.")
@@ -66,12 +72,19 @@ def _parse_directory(fn_add_to_matrix, dirname, import_settings):
         print(f"ERROR: failed to parse '{dirname}', mode={mode} not recognized.")
         return
 
-    results = fct(dirname, import_settings)
-    fn_add_to_matrix(results)
+    with parse_profiling.step("log_scan"):
+        results = fct(dirname, import_settings)
+
+    with parse_profiling.step("matrix_insert"):
+        fn_add_to_matrix(results)
 
 def parse_data():
     # delegate the parsing to the simple_store
     store.register_custom_rewrite_settings(_rewrite_settings)
     store_simple.register_custom_parse_results(_parse_directory)
 
-    return store_simple.parse_data()
+    ret = store_simple.parse_data()
+
+    parse_profiling.report()
+
+    return ret